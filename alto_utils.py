@@ -1,30 +1,300 @@
-# alto_utils: parse_alto, extract_ocr_info, extract_avg_wc
+# alto_utils: parse_alto_page, parse_alto_stream, parse_alto, extract_ocr_info, extract_avg_wc
+from array import array
+from dataclasses import dataclass, field
 import xml.etree.ElementTree as ET
 
+import numpy as np
 
-def parse_alto(alto_xml):
+from metrics_utils import timed_stage
+
+# Regionkoder for block_region; rekkefølgen er også rekkefølgen blokkene nummereres i.
+REGIONS = ("PrintSpace", "TopMargin", "BottomMargin")
+REGION_PRINTSPACE, REGION_TOPMARGIN, REGION_BOTTOMMARGIN = range(len(REGIONS))
+# Områdene under Page som bestemmer det faktiske ALTO-rommet for TextBlock-koordinatene
+_AREA_TAGS = ("TopMargin", "BottomMargin", "PrintSpace", "LeftMargin", "RightMargin")
+
+
+def _empty_boxes():
+    return np.empty((0, 4), dtype=np.int32)
+
+
+def _empty_index():
+    return np.empty(0, dtype=np.int32)
+
+
+@dataclass
+class AltoPage:
+    """Resultatet av én gjennomgang av en ALTO-fil.
+
+    Geometrien ligger i kolonner: blocks/lines/words er int32-matriser med
+    (x, y, w, h) per rad. line_block og word_line peker på indeksen til
+    foreldreelementet, block_region er en kode fra REGIONS og word_wc er
+    float32 med NaN der WC mangler. Blokknummeret i visningen er indeks + 1.
+    block_ids/line_ids/word_ids er ALTO-ID-ene ('' der elementet mangler ID).
+
+    width/height er None når filen mangler Layout/Page eller ikke kan parses.
+    """
+    width: int = None
+    height: int = None
+    blocks: np.ndarray = field(default_factory=_empty_boxes)
+    block_region: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.uint8))
+    lines: np.ndarray = field(default_factory=_empty_boxes)
+    line_block: np.ndarray = field(default_factory=_empty_index)
+    words: np.ndarray = field(default_factory=_empty_boxes)
+    word_line: np.ndarray = field(default_factory=_empty_index)
+    word_wc: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.float32))
+    word_content: list = field(default_factory=list)
+    block_ids: list = field(default_factory=list)
+    line_ids: list = field(default_factory=list)
+    word_ids: list = field(default_factory=list)
+    full_text: str = ""
+    avg_wc: float = None
+    ocr_info: list = field(default_factory=list)
+    image_url: str = None
+    block_scale_x: float = 1.0
+    block_scale_y: float = 1.0
+    # Avledede strukturer som bygges ved behov og lever like lenge som siden (se spatial_utils)
+    derived: dict = field(default_factory=dict, repr=False, compare=False)
+
+    @property
+    def text_blocks(self):
+        """Blokkene som (x, y, w, h, id, label)-tupler, som parse_alto returnerer."""
+        return [(x, y, w, h, i + 1, REGIONS[r])
+                for i, ((x, y, w, h), r) in enumerate(zip(self.blocks.tolist(), self.block_region.tolist()))]
+
+    def geometry(self):
+        """Kompakt geometri for klienten: flate [x, y, w, h, ...]-lister og WC med null der den mangler."""
+        wc = np.round(self.word_wc.astype(np.float64), 3).tolist()
+        return {
+            'width':        self.width,
+            'height':       self.height,
+            'regions':      list(REGIONS),
+            'blocks':       self.blocks.ravel().tolist(),
+            'block_region': self.block_region.tolist(),
+            'lines':        self.lines.ravel().tolist(),
+            'words':        self.words.ravel().tolist(),
+            'word_wc':      [None if v != v else v for v in wc],
+        }
+
+    def as_tuple(self):
+        """Samme format som parse_alto returnerer."""
+        return (self.width, self.height, self.text_blocks,
+                [tuple(b) for b in self.lines.tolist()], [tuple(b) for b in self.words.tolist()],
+                self.full_text)
+
+
+@timed_stage('parse')
+def parse_alto_page(alto_xml):
+    """Parse ALTO-XML én gang og hent ut geometri, tekst, WC, OCR-info og bilde-URL."""
     if not alto_xml:
-        return None, None, [], [], [], ""
+        return AltoPage()
     try:
         root = ET.fromstring(alto_xml)
     except ET.ParseError:
-        return None, None, [], [], [], ""
+        return AltoPage()
+
+    result = AltoPage()
+    description = next((child for child in root if child.tag.endswith("Description")), None)
+    if description is not None:
+        result.ocr_info = _ocr_info(description)
+        result.image_url = _image_url(description)
 
     ns = {"alto": root.tag.split("}")[0].strip("{")} if "}" in root.tag else {"alto": ""}
+    _parse_layout(root, ns, result)
+    return result
+
+
+@timed_stage('parse')
+def parse_alto_stream(source, strict=False):
+    """Som parse_alto_page, men leser ALTO-XML trinnvis fra en binær fil eller strøm.
+
+    Elementene kastes etter hvert som de er lest, så minnet som brukes følger antall
+    ord på siden og ikke størrelsen på filen. Filer som ikke er gyldig UTF-8 leses
+    på nytt som latin-1 når strømmen kan spoles tilbake. Ugyldig XML gir en tom
+    AltoPage, eller ET.ParseError med strict=True.
+    """
+    try:
+        return _retry_latin1(_stream_page, source)
+    except ET.ParseError:
+        if strict:
+            raise
+        return AltoPage()
+
+
+def extract_image_url_stream(source):
+    """Bilde-URL fra en ALTO-fil i en strøm; slutter å lese ved første treff."""
+    try:
+        return _retry_latin1(_stream_image_url, source)
+    except ET.ParseError:
+        return None
+
+
+def _retry_latin1(parse, source):
+    try:
+        return parse(source, None)
+    except ET.ParseError as error:
+        if not (hasattr(source, 'seekable') and source.seekable()):
+            raise
+        first = error
+    source.seek(0)
+    try:
+        return parse(source, ET.XMLParser(encoding='latin-1'))
+    except ET.ParseError:
+        # Feilen fra første forsøk sier mest om hva som er galt med filen
+        raise first from None
+
+
+def _stream_image_url(source, parser):
+    for _, elem in ET.iterparse(source, parser=parser):
+        tag = elem.tag.split('}')[-1]
+        if tag == 'fileName' and elem.text and elem.text.strip().startswith('http'):
+            return elem.text.strip()
+        if tag != 'fileName':
+            elem.clear()
+    return None
+
+
+def _stream_page(source, parser):
+    result = AltoPage()
+    # Hver region samles for seg og settes sammen i REGIONS-rekkefølge til slutt,
+    # slik parse_alto_page nummererer blokkene uansett rekkefølgen i filen
+    columns = [_Columns() for _ in REGIONS]
+    q = None
+    path = []
+    seen = set()
+    layout = page = area = None
+    width = height = None
+    alto_w = alto_h = 0
+    region = cols = block = line = None
+    block_text = line_text = None
+    nan = float('nan')
+
+    for event, elem in ET.iterparse(source, events=('start', 'end'), parser=parser):
+        if event == 'start':
+            path.append(elem)
+            depth = len(path)
+            tag = elem.tag
+            if depth == 1:
+                ns = tag.split("}")[0].strip("{") if "}" in tag else ""
+                q = {name: f"{{{ns}}}{name}" if ns else name
+                     for name in ('Layout', 'Page', 'TextBlock', 'TextLine', 'String', *_AREA_TAGS)}
+                area_names = {q[name]: name for name in _AREA_TAGS}
+            elif depth == 2 and tag == q['Layout'] and 'Layout' not in seen:
+                seen.add('Layout')
+                layout = elem
+            elif depth == 3 and path[1] is layout and tag == q['Page'] and 'Page' not in seen:
+                seen.add('Page')
+                try:
+                    width, height = int(elem.attrib['WIDTH']), int(elem.attrib['HEIGHT'])
+                except (KeyError, ValueError):
+                    continue
+                page = elem
+                alto_w, alto_h = width, height
+            elif depth == 4 and page is not None and path[2] is page and tag in area_names:
+                name = area_names[tag]
+                if name in seen:
+                    continue
+                seen.add(name)
+                try:
+                    alto_w = max(alto_w, int(elem.attrib.get("HPOS", 0)) + int(elem.attrib.get("WIDTH", 0)))
+                    alto_h = max(alto_h, int(elem.attrib.get("VPOS", 0)) + int(elem.attrib.get("HEIGHT", 0)))
+                except ValueError:
+                    pass
+                if name in REGIONS:
+                    region = REGIONS.index(name)
+                    cols, area = columns[region], elem
+            elif cols is None:
+                continue
+            elif tag == q['TextBlock']:
+                try:
+                    cols.block_raw.extend(_coords(elem.attrib))
+                except ValueError:
+                    continue
+                cols.block_region.append(region)
+                cols.block_ids.append(elem.attrib.get('ID', ''))
+                block, block_text = elem, []
+            elif tag == q['TextLine'] and block is not None and path[-2] is block:
+                try:
+                    cols.line_raw.extend(_coords(elem.attrib))
+                except ValueError:
+                    continue
+                cols.line_block.append(len(cols.block_region) - 1)
+                cols.line_ids.append(elem.attrib.get('ID', ''))
+                line, line_text = elem, []
+            elif tag == q['String'] and line is not None and path[-2] is line:
+                attrib = elem.attrib
+                try:
+                    cols.word_raw.extend(_coords(attrib))
+                except ValueError:
+                    continue
+                cols.word_line.append(len(cols.line_block) - 1)
+                cols.word_ids.append(attrib.get('ID', ''))
+                content = attrib.get('CONTENT', '')
+                cols.word_content.append(content)
+                line_text.append(content)
+                try:
+                    cols.word_wc.append(float(attrib.get("WC") or nan))
+                except ValueError:
+                    cols.word_wc.append(nan)
+            continue
+
+        # end: avslutt elementet og kast det, så treet aldri vokser. Description er liten
+        # og leses samlet når den slutter, så innholdet der beholdes til da.
+        if len(path) > 2 and path[1].tag.endswith("Description"):
+            path.pop()
+            continue
+        if len(path) == 2 and elem.tag.endswith("Description") and 'description' not in seen:
+            seen.add('description')
+            result.ocr_info = _ocr_info(elem)
+            result.image_url = _image_url(elem)
+        elif elem is line:
+            block_text.append(" ".join(line_text))
+            line = None
+        elif elem is block:
+            cols.text_parts.append("\n".join(block_text))
+            block = None
+        elif elem is area:
+            cols = area = None
+        path.pop()
+        elem.clear()
+        if path:
+            path[-1].remove(elem)
 
+    if page is None:
+        return result
+    merged = columns[0]
+    for other in columns[1:]:
+        merged.extend(other)
+    merged.store(result, width, height,
+                 width / alto_w if alto_w > width * 1.1 else 1.0,
+                 height / alto_h if alto_h > height * 1.1 else 1.0)
+    return result
+
+
+def _coords(attrib):
+    return (float(attrib.get('HPOS', 0)), float(attrib.get('VPOS', 0)),
+            float(attrib.get('WIDTH', 0)), float(attrib.get('HEIGHT', 0)))
+
+
+def _to_boxes(raw):
+    # round() og np.rint runder begge halvveis til nærmeste partall
+    return np.rint(np.frombuffer(raw, dtype=np.float64).reshape(-1, 4)).astype(np.int32)
+
+
+def _parse_layout(root, ns, result):
     layout = root.find("alto:Layout", ns)
     if layout is None:
-        return None, None, [], [], [], ""
+        return
 
     page = layout.find("alto:Page", ns)
     if page is None:
-        return None, None, [], [], [], ""
+        return
 
     try:
         width = int(page.attrib['WIDTH'])
         height = int(page.attrib['HEIGHT'])
     except (KeyError, ValueError):
-        return None, None, [], [], [], ""
+        return
 
     # Noen ALTO-filer (f.eks. fra NB.no) har inkonsistente koordinatsystem der
     # TextBlock-koordinater bruker et stort ALTO-rom (f.eks. 3439×5063) mens
@@ -32,7 +302,7 @@ def parse_alto(alto_xml):
     # Beregn det faktiske ALTO-rommet fra area-elementene, og normaliser
     # TextBlock-koordinater til Page-rommet. TextLine/String brukes uendret.
     alto_w, alto_h = width, height
-    for area_tag in ["TopMargin", "BottomMargin", "PrintSpace", "LeftMargin", "RightMargin"]:
+    for area_tag in _AREA_TAGS:
         area = page.find(f"alto:{area_tag}", ns)
         if area is not None:
             try:
@@ -47,54 +317,118 @@ def parse_alto(alto_xml):
     block_scale_x = width / alto_w if alto_w > width * 1.1 else 1.0
     block_scale_y = height / alto_h if alto_h > height * 1.1 else 1.0
 
-    text_blocks = []
-    lines = []
-    words = []
-    full_text = ""
-
-    block_id = 1
+    cols = _Columns()
+    # Lokale navn på bufferne: dette er den varme løkken
+    block_raw, line_raw, word_raw = cols.block_raw, cols.line_raw, cols.word_raw
+    block_region, line_block, word_line = cols.block_region, cols.line_block, cols.word_line
+    word_wc, word_content = cols.word_wc, cols.word_content
+    block_ids, line_ids, word_ids = cols.block_ids, cols.line_ids, cols.word_ids
+    text_parts = cols.text_parts
+    nan = float('nan')
 
-    for area_tag, label in [("PrintSpace", "PrintSpace"), ("TopMargin", "TopMargin"), ("BottomMargin", "BottomMargin")]:
+    for region, area_tag in enumerate(REGIONS):
         area = page.find(f"alto:{area_tag}", ns)
         if area is None:
             continue
         for block in area.findall(".//alto:TextBlock", ns):
             try:
-                x, y, w, h = (round(float(block.attrib.get('HPOS', 0))), round(float(block.attrib.get('VPOS', 0))),
-                              round(float(block.attrib.get('WIDTH', 0))), round(float(block.attrib.get('HEIGHT', 0))))
+                block_raw.extend(_coords(block.attrib))
             except ValueError:
                 continue
-            bx = round(x * block_scale_x)
-            by = round(y * block_scale_y)
-            bw = round(w * block_scale_x)
-            bh = round(h * block_scale_y)
-            text_blocks.append((bx, by, bw, bh, block_id, label))
-            block_id += 1
+            block_index = len(block_region)
+            block_region.append(region)
+            block_ids.append(block.attrib.get('ID', ''))
 
             block_text = []
             for line in block.findall("alto:TextLine", ns):
                 try:
-                    lx, ly, lw, lh = (round(float(line.attrib.get('HPOS', 0))), round(float(line.attrib.get('VPOS', 0))),
-                                      round(float(line.attrib.get('WIDTH', 0))), round(float(line.attrib.get('HEIGHT', 0))))
+                    line_raw.extend(_coords(line.attrib))
                 except ValueError:
                     continue
-                lines.append((lx, ly, lw, lh))
+                line_index = len(line_block)
+                line_block.append(block_index)
+                line_ids.append(line.attrib.get('ID', ''))
 
                 line_text = []
                 for string in line.findall("alto:String", ns):
+                    attrib = string.attrib
                     try:
-                        wx, wy, ww, wh = (round(float(string.attrib.get('HPOS', 0))), round(float(string.attrib.get('VPOS', 0))),
-                                          round(float(string.attrib.get('WIDTH', 0))), round(float(string.attrib.get('HEIGHT', 0))))
+                        word_raw.extend(_coords(attrib))
                     except ValueError:
                         continue
-                    words.append((wx, wy, ww, wh))
-                    line_text.append(string.attrib.get('CONTENT', ''))
+                    word_line.append(line_index)
+                    word_ids.append(attrib.get('ID', ''))
+                    content = attrib.get('CONTENT', '')
+                    word_content.append(content)
+                    line_text.append(content)
+                    try:
+                        word_wc.append(float(attrib.get("WC") or nan))
+                    except ValueError:
+                        word_wc.append(nan)
 
                 block_text.append(" ".join(line_text))
 
-            full_text += "\n".join(block_text) + "\n\n"
+            text_parts.append("\n".join(block_text))
+
+    cols.store(result, width, height, block_scale_x, block_scale_y)
+
 
-    return width, height, text_blocks, lines, words, full_text.strip()
+class _Columns:
+    """Flate array-buffere for geometri, tekst og WC, som gjøres om til AltoPage-kolonner til slutt."""
+
+    def __init__(self):
+        self.block_raw, self.line_raw, self.word_raw = array('d'), array('d'), array('d')
+        self.block_region, self.line_block, self.word_line = array('B'), array('i'), array('i')
+        self.word_wc = array('f')
+        self.word_content = []
+        self.block_ids, self.line_ids, self.word_ids = [], [], []
+        self.text_parts = []
+
+    def extend(self, other):
+        """Legg other sine elementer etter disse, med foreldreindeksene forskjøvet."""
+        block_offset, line_offset = len(self.block_region), len(self.line_block)
+        self.block_raw.extend(other.block_raw)
+        self.line_raw.extend(other.line_raw)
+        self.word_raw.extend(other.word_raw)
+        self.block_region.extend(other.block_region)
+        self.line_block.extend(i + block_offset for i in other.line_block)
+        self.word_line.extend(i + line_offset for i in other.word_line)
+        self.word_wc.extend(other.word_wc)
+        self.word_content += other.word_content
+        self.block_ids += other.block_ids
+        self.line_ids += other.line_ids
+        self.word_ids += other.word_ids
+        self.text_parts += other.text_parts
+
+    def store(self, result, width, height, block_scale_x, block_scale_y):
+        blocks = _to_boxes(self.block_raw)
+        if block_scale_x != 1.0 or block_scale_y != 1.0:
+            scale = np.array([block_scale_x, block_scale_y, block_scale_x, block_scale_y])
+            blocks = np.rint(blocks * scale).astype(np.int32)
+
+        result.width, result.height = width, height
+        result.block_scale_x, result.block_scale_y = block_scale_x, block_scale_y
+        result.blocks = blocks
+        result.block_region = np.frombuffer(self.block_region, dtype=np.uint8)
+        result.lines = _to_boxes(self.line_raw)
+        result.line_block = np.frombuffer(self.line_block, dtype=np.int32)
+        result.words = _to_boxes(self.word_raw)
+        result.word_line = np.frombuffer(self.word_line, dtype=np.int32)
+        result.word_wc = np.frombuffer(self.word_wc, dtype=np.float32)
+        result.word_content = self.word_content
+        result.block_ids, result.line_ids, result.word_ids = self.block_ids, self.line_ids, self.word_ids
+        result.full_text = "\n\n".join(self.text_parts).strip()
+        result.avg_wc = mean_wc(result.word_wc)
+
+
+def mean_wc(wc):
+    """Gjennomsnittlig WC avrundet til tre desimaler, eller None uten WC-verdier."""
+    valid = wc[~np.isnan(wc)]
+    return round(float(valid.mean(dtype=np.float64)), 3) if valid.size else None
+
+
+def parse_alto(alto_xml):
+    return parse_alto_page(alto_xml).as_tuple()
 
 
 def extract_ocr_info(alto_xml):
@@ -104,12 +438,15 @@ def extract_ocr_info(alto_xml):
         root = ET.fromstring(alto_xml)
     except ET.ParseError:
         return []
-    info = []
 
     description = next((child for child in root if child.tag.endswith("Description")), None)
     if description is None:
         return []
+    return _ocr_info(description)
+
 
+def _ocr_info(description):
+    info = []
     for ocr_proc in description:
         if not ocr_proc.tag.endswith("OCRProcessing"):
             continue
@@ -147,7 +484,11 @@ def extract_image_url(alto_xml):
         root = ET.fromstring(alto_xml)
     except ET.ParseError:
         return None
-    for elem in root.iter():
+    return _image_url(root)
+
+
+def _image_url(element):
+    for elem in element.iter():
         tag = elem.tag.split('}')[-1] if '}' in elem.tag else elem.tag
         if tag == 'fileName' and elem.text:
             url = elem.text.strip()
@@ -185,19 +526,4 @@ def extract_doc_urn(image_url):
 
 
 def extract_avg_wc(alto_xml):
-    if not alto_xml:
-        return None
-    try:
-        root = ET.fromstring(alto_xml)
-    except ET.ParseError:
-        return None
-    ns = {"alto": root.tag.split("}")[0].strip("{")} if "}" in root.tag else {"alto": ""}
-    wc_values = []
-    for word in root.findall(".//alto:String", ns):
-        wc_str = word.attrib.get("WC")
-        if wc_str:
-            try:
-                wc_values.append(float(wc_str))
-            except ValueError:
-                pass
-    return round(sum(wc_values) / len(wc_values), 3) if wc_values else None
+    return parse_alto_page(alto_xml).avg_wc
@@ -1,31 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+import base64
+import hashlib
+import hmac
 import json
 import os
 import re
+import shutil
+import tempfile
+import time
+from urllib.parse import urlencode
+import zipfile
 
-import requests
-from flask import Flask, Blueprint, render_template, request, jsonify, Response, stream_with_context
+from flask import Flask, Blueprint, g, render_template, request, jsonify, Response, stream_with_context
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from alto_utils import parse_alto, extract_avg_wc, extract_ocr_info, extract_image_url, extract_doc_urn
-from image_utils import fetch_image, plot_alto, fetch_image_from_url
-from download_utils import fetch_alto
-from metadata_utils import fetch_iiif_manifest, get_page_list, get_metadata, extract_urn_or_lookup
+from alto_utils import AltoPage, parse_alto_stream, extract_image_url_stream, extract_doc_urn
+from cache_utils import ByteLRUCache, SingleFlight
+from cpu_utils import cpu_stats, run_cpu
+from image_utils import (fetch_image_bytes, fetch_tile_bytes, decode_image, plot_alto, plot_alto_bytes, fetch_image_from_url,
+                         iiif_image_url, render_overlay, contact_sheet, encode_image, OVERLAY_FORMATS, WC_THRESHOLD)
+from download_utils import (fetch_alto_page, read_alto_page, iter_document_pages, iter_document_text,
+                            iter_document_text_ordered)
+from metadata_utils import fetch_iiif_manifest, fetch_image_info, get_page_list, get_metadata, extract_urn_or_lookup
+import metrics_utils
+from prefetch_utils import Prefetcher
+from quality_utils import QualityReport, page_quality
+from search_utils import IndexCache
+from spatial_utils import hit_test
+from upload_utils import zip_members, iter_zip_pages
+from export_utils import NpzStream, page_record
+from tile_utils import tile_grid, tile_region, tile_elements
+from diff_utils import diff_pages
 
 app = Flask(__name__)
 
 # APP_ROOT settes som miljøvariabel på serveren, f.eks. '/run/alto-viewer/app'
 APP_ROOT = os.environ.get('APP_ROOT', '')
 
+# Antall proxyer foran appen som legger til X-Forwarded-For. Med 0 er klienten
+# den som kobler til; ellers brukes adressen proxyen oppgir, både for
+# ratebegrensning og forhåndshenting. Sett den bare når proxyen faktisk finnes.
+PROXY_HOPS = int(os.environ.get('ALTO_PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# Klientnøkkelen for flask-limiter og forhåndshenting
+_client_key = get_remote_address
+
 limiter = Limiter(
-    get_remote_address,
+    _client_key,
     app=app,
     default_limits=["60 per minute"],
     storage_uri="memory://",
+    # Kan slås av for lasttester fra én adresse (ALTO_RATELIMIT=0)
+    enabled=os.environ.get('ALTO_RATELIMIT', '1') != '0',
 )
 
 bp = Blueprint('alto_viewer', __name__)
 
+# Ferdig kodede overlegg per (urn, side, visning, format, kvalitet)
+OVERLAY_CACHE_MB = int(os.environ.get('ALTO_OVERLAY_CACHE_MB', 128))
+_overlay_cache = ByteLRUCache(OVERLAY_CACHE_MB * 1024 * 1024)
+metrics_utils.register_stats('overlay_cache', _overlay_cache.stats)
+# Samtidige forespørsler etter samme overlegg venter på én tegning
+_overlay_flight = SingleFlight()
+metrics_utils.register_stats('singleflight_overlay', _overlay_flight.stats)
+
+# /metrics er av med mindre ALTO_METRICS=1. Med ALTO_METRICS_TOKEN satt må skrapingen
+# sende 'Authorization: Bearer <token>'; uten token bør endepunktet bare nås fra innsiden
+METRICS_ENABLED = os.environ.get('ALTO_METRICS', '0') == '1'
+METRICS_TOKEN   = os.environ.get('ALTO_METRICS_TOKEN', '')
+
+# Uavhengige kall mot nb.no innen én forespørsel kjøres samtidig, med en felles frist i sekunder
+UPSTREAM_WORKERS  = int(os.environ.get('ALTO_UPSTREAM_WORKERS', 16))
+UPSTREAM_DEADLINE = float(os.environ.get('ALTO_UPSTREAM_DEADLINE', 20))
+_upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS)
+
 # Valideringsmønstre
 _URN_RE     = re.compile(r'^URN:NBN:no-nb_[A-Za-z0-9_\-]+$', re.IGNORECASE)
 _PAGE_ID_RE = re.compile(r'^[A-Za-z0-9:_\-]+$')
@@ -39,9 +91,217 @@ def _valid_page_id(s):
     return bool(_PAGE_ID_RE.match(s))
 
 
+# Visningene klienten kan velge; ukjente visninger avvises, så de ikke gir egne cacheoppføringer
+VIEWS = ('tekstblokker', 'tekstlinjer', 'ord', 'konfidens')
+
+
+def _select_view(page, view):
+    """Elementene som skal tegnes for valgt visning: (boxes, color, regions, show_numbers, wc, view_fallback).
+
+    wc er ordenes WC for konfidensvisningen, ellers None; color er da kantfargen for ord under terskelen.
+    """
+    view_map = {
+        'tekstblokker': (page.blocks, 'red',     True,  None),
+        'tekstlinjer':  (page.lines,  'blue',    False, None),
+        'ord':          (page.words,  'green',   False, None),
+        'konfidens':    (page.words,  'magenta', False, page.word_wc),
+    }
+    boxes, color, show_numbers, wc = view_map.get(view, view_map['tekstblokker'])
+    view_fallback = False
+    if not len(boxes) and len(page.blocks):
+        boxes, color, show_numbers, wc = view_map['tekstblokker']
+        view_fallback = True
+    regions = page.block_region if show_numbers else None
+    return boxes, color, regions, show_numbers, wc, view_fallback
+
+
+def _view_threshold(view):
+    """WC-terskelen fra ?wc_threshold= (eller skjemafeltet) for konfidensvisningen, avrundet så
+    cachenøklene ikke sprer seg; None for andre visninger. ValueError ved ugyldig verdi."""
+    if view != 'konfidens':
+        return None
+    threshold = float(request.values.get('wc_threshold', WC_THRESHOLD))
+    if not 0.0 <= threshold <= 1.0:
+        raise ValueError(threshold)
+    return round(threshold, 2)
+
+
+def _render_view(image, page, view, threshold=None):
+    """Tegn valgt visning over sidebildet. Returnerer (image_b64, view_fallback)."""
+    boxes, color, regions, show_numbers, wc, view_fallback = _select_view(page, view)
+    image_b64 = plot_alto(image, page.width, page.height, boxes, color=color, regions=regions,
+                          show_numbers=show_numbers, wc=wc, threshold=threshold)
+    return image_b64, view_fallback
+
+
+def _fan_out(calls):
+    """Kjør uavhengige oppslag samtidig med en felles frist.
+
+    calls er {navn: (funksjon, *argumenter)}. Returnerer (resultater, timinger i ms);
+    resultatet er None for oppslag som feilet eller ikke ble ferdige innen fristen.
+    """
+    # Konteksten følger med, så trinnene i arbeidertrådene havner i forespørselens Server-Timing
+    futures = {name: metrics_utils.submit_in_context(_upstream_pool, _timed, fn, *args)
+               for name, (fn, *args) in calls.items()}
+    done, _ = wait(futures.values(), timeout=UPSTREAM_DEADLINE)
+    results, timings = {}, {}
+    for name, future in futures.items():
+        results[name] = None
+        if future in done and future.exception() is None:
+            results[name], timings[name] = future.result()
+        else:
+            future.cancel()
+    return results, timings
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _server_timing(timings):
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+def _overlay_key(urn, page_id, view, fmt, quality, threshold):
+    return (urn, page_id, view, fmt, quality, threshold)
+
+
+def _cached_overlay(urn, page_id, view, fmt, quality, threshold):
+    """Tegnet overlegg som (bytes, etag, view_fallback), fra cache eller nytegnet. None uten ALTO eller bilde."""
+    entry = _overlay_cache.get(_overlay_key(urn, page_id, view, fmt, quality, threshold))
+    if entry is not None:
+        return entry
+    results, _ = _fan_out({
+        'alto':  (fetch_alto_page, urn, page_id),
+        'image': (fetch_image_bytes, page_id),
+    })
+    page = results['alto'] or AltoPage()
+    return _render_overlay_once(urn, page_id, view, fmt, quality, threshold, page, results['image'])
+
+
+def _render_overlay_once(urn, page_id, view, fmt, quality, threshold, page, image_data):
+    """_render_overlay i CPU-poolen, med samtidige kall for samme overlegg slått sammen til ett."""
+    return _overlay_flight.do(_overlay_key(urn, page_id, view, fmt, quality, threshold),
+                              run_cpu, _render_overlay, urn, page_id, view, fmt, quality, threshold, page, image_data)
+
+
+def _render_overlay(urn, page_id, view, fmt, quality, threshold, page, image_data):
+    """Dekod, tegn og cache overlegget for en allerede hentet side. Kjøres i CPU-poolen."""
+    boxes, color, regions, show_numbers, wc, view_fallback = _select_view(page, view)
+    data = plot_alto_bytes(decode_image(image_data), page.width, page.height, boxes, color=color, regions=regions,
+                           show_numbers=show_numbers, fmt=fmt, quality=quality, wc=wc, threshold=threshold)
+    if data is None:
+        return None
+    entry = (data, hashlib.sha1(data).hexdigest(), view_fallback)
+    _overlay_cache.set(_overlay_key(urn, page_id, view, fmt, quality, threshold), entry, size=len(data))
+    return entry
+
+
+def _overlay_format(default=None):
+    """Format og kvalitet for /api/render og /api/overlay fra ?format= og ?quality=.
+
+    Uten ?format= brukes default, eller WebP hvis klienten godtar det og ellers PNG.
+    Returnerer (format, kvalitet, forhandlet); ValueError med feilmeldingen hvis
+    formatet er ukjent eller kvaliteten ugyldig.
+    """
+    fmt = request.args.get('format', '').strip().lower()
+    negotiated = not fmt and default is None
+    if negotiated:
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'png'
+    fmt = 'jpeg' if fmt == 'jpg' else (fmt or default)
+    if fmt not in OVERLAY_FORMATS:
+        raise ValueError('Ukjent bildeformat')
+    if fmt == 'png':
+        return fmt, 0, negotiated
+    try:
+        quality = int(request.args.get('quality', 80))
+    except ValueError:
+        raise ValueError('Ugyldig kvalitet') from None
+    if not 1 <= quality <= 100:
+        raise ValueError('Ugyldig kvalitet')
+    return fmt, quality, negotiated
+
+
+def _neighbour_pages(urn, page_id):
+    """Neste og forrige side i dokumentet, i den rekkefølgen de bør varmes opp."""
+    _, page_ids = get_page_list(fetch_iiif_manifest(urn))
+    try:
+        index = page_ids.index(page_id)
+    except ValueError:
+        return []
+    return [page_ids[i] for i in (index + 1, index - 1) if 0 <= i < len(page_ids)]
+
+
+def _warm_page(urn, page_id):
+    fetch_alto_page(urn, page_id)
+    fetch_image_bytes(page_id)
+
+
+# Batchoperasjoner over mange sider (miniatyrer, rapporter) får egne, begrensede trådpooler
+BATCH_WORKERS   = int(os.environ.get('ALTO_BATCH_WORKERS', 8))
+MAX_BATCH_PAGES = int(os.environ.get('ALTO_MAX_BATCH_PAGES', 400))
+
+PREFETCH_ENABLED = os.environ.get('ALTO_PREFETCH', '1') != '0'
+_prefetcher = Prefetcher(
+    _warm_page, _neighbour_pages,
+    queue_size=int(os.environ.get('ALTO_PREFETCH_QUEUE', 8)),
+    rate=float(os.environ.get('ALTO_PREFETCH_RATE', 2)),
+)
+metrics_utils.register_stats('prefetch', lambda: _prefetcher.stats)
+metrics_utils.register_stats('cpu', cpu_stats)
+
+
+def _schedule_prefetch(urn, page_id):
+    if PREFETCH_ENABLED:
+        _prefetcher.schedule((_client_key(), urn), urn, page_id)
+
+
+@app.before_request
+def _begin_metrics():
+    g.request_start = time.perf_counter()
+    metrics_utils.begin_request()
+
+
+@app.after_request
+def _emit_metrics(response):
+    """Legg trinntimingene til Server-Timing og før forespørselstiden inn i histogrammet.
+
+    For strømmende svar måles tiden til svaret starter; selve strømmen telles i
+    alto_sse_streams_in_flight.
+    """
+    stages = metrics_utils.stage_timings()
+    if stages:
+        header = _server_timing(stages)
+        existing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = f"{existing}, {header}" if existing else header
+    if 'request_start' in g:
+        metrics_utils.observe('alto_request_seconds', time.perf_counter() - g.request_start,
+                              endpoint=request.endpoint or 'ukjent', status=response.status_code)
+    return response
+
+
+def _metrics_authorized():
+    if not METRICS_TOKEN:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+
+@bp.route('/metrics')
+def metrics():
+    """Metrikker i Prometheus-tekstformat. Av som standard; se ALTO_METRICS og ALTO_METRICS_TOKEN."""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Ikke funnet'}), 404
+    if not _metrics_authorized():
+        return jsonify({'error': 'Mangler eller feil token'}), 401
+    return Response(metrics_utils.render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @bp.route('/')
 def index():
-    return render_template('index.html', app_root=APP_ROOT)
+    return render_template('index.html', app_root=APP_ROOT, wc_threshold=WC_THRESHOLD)
 
 
 @bp.route('/api/pages')
@@ -84,40 +344,487 @@ def api_render():
     if not _valid_page_id(page_id):
         return jsonify({'error': 'Ugyldig side-ID'}), 400
 
-    alto_xml = fetch_alto(urn, page_id)
-    image    = fetch_image(page_id)
-
-    width, height, text_blocks, lines, words, full_text = parse_alto(alto_xml)
-    avg_wc   = extract_avg_wc(alto_xml)
-    ocr_info = extract_ocr_info(alto_xml)
-    metadata = get_metadata(urn)
+    # JPEG er det billigste formatet å kode for skannede sider; WebP kan fortsatt velges med ?format=
+    try:
+        fmt, quality, _ = _overlay_format('jpeg')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if view not in VIEWS:
+        return jsonify({'error': 'Ukjent visning'}), 400
+    try:
+        threshold = _view_threshold(view)
+    except ValueError:
+        return jsonify({'error': 'Ugyldig WC-terskel'}), 400
 
-    view_map = {
-        'tekstblokker': (text_blocks, 'red',   True),
-        'tekstlinjer':  (lines,       'blue',  False),
-        'ord':          (words,       'green', False),
+    # ALTO, bilde og metadata hentes samtidig; bildet trengs bare hvis overlegget ikke er cachet.
+    # Overlegget tegnes inn i cachen her, så bildet klienten henter fra overlay_url er et cachetreff.
+    start = time.perf_counter()
+    entry = _overlay_cache.get(_overlay_key(urn, page_id, view, fmt, quality, threshold))
+    calls = {
+        'alto':     (fetch_alto_page, urn, page_id),
+        'metadata': (get_metadata, urn),
     }
-    elements, color, show_numbers = view_map.get(view, (text_blocks, 'red', True))
-    view_fallback = False
-    if not elements and text_blocks:
-        elements, color, show_numbers = text_blocks, 'red', True
-        view_fallback = True
-    image_b64 = plot_alto(image, width, height, elements, color=color, show_numbers=show_numbers)
+    if entry is None:
+        calls['image'] = (fetch_image_bytes, page_id)
+    results, timings = _fan_out(calls)
+    timings['fetch'] = (time.perf_counter() - start) * 1000
 
-    return jsonify({
-        'image_b64':    image_b64,
-        'full_text':    full_text,
+    page     = results['alto'] or AltoPage()
+    metadata = results['metadata']
+    if entry is None:
+        entry, timings['render'] = _timed(_render_overlay_once, urn, page_id, view, fmt, quality, threshold,
+                                          page, results['image'])
+    timings['total'] = (time.perf_counter() - start) * 1000
+
+    overlay_url = None
+    if entry is not None:
+        params = {'urn': urn, 'page_id': page_id, 'view': view, 'format': fmt}
+        if fmt != 'png':
+            params['quality'] = quality
+        if threshold is not None:
+            params['wc_threshold'] = threshold
+        overlay_url = f"{APP_ROOT}/api/overlay?" + urlencode(params)
+
+    response = jsonify({
+        'overlay_url':  overlay_url,
+        'full_text':    page.full_text,
         'metadata':     metadata,
-        'ocr_info':     ocr_info,
-        'avg_wc':       avg_wc,
-        'has_lines':    bool(lines),
-        'has_words':    bool(words),
-        'view_fallback': view_fallback,
+        'ocr_info':     page.ocr_info,
+        'avg_wc':       page.avg_wc,
+        'has_lines':    bool(len(page.lines)),
+        'has_words':    bool(len(page.words)),
+        'view_fallback': entry[2] if entry is not None else False,
         'links': {
             'image': f"https://www.nb.no/services/image/resolver/{page_id}/full/pct:66/0/native.jpg",
             'alto':  f"https://api.nb.no/catalog/v1/metadata/{urn}/altos/{page_id}",
         },
     })
+    response.headers['Server-Timing'] = _server_timing(timings)
+    _schedule_prefetch(urn, page_id)
+    return response
+
+
+@bp.route('/api/overlay')
+def api_overlay():
+    """Tegnet overlegg som bilde, med sterk ETag og støtte for If-None-Match."""
+    urn     = request.args.get('urn', '').strip()
+    page_id = request.args.get('page_id', '').strip()
+    view    = request.args.get('view', 'tekstblokker').strip()
+
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+
+    if not _valid_page_id(page_id):
+        return jsonify({'error': 'Ugyldig side-ID'}), 400
+
+    try:
+        fmt, quality, negotiated = _overlay_format()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if view not in VIEWS:
+        return jsonify({'error': 'Ukjent visning'}), 400
+    try:
+        threshold = _view_threshold(view)
+    except ValueError:
+        return jsonify({'error': 'Ugyldig WC-terskel'}), 400
+
+    entry = _cached_overlay(urn, page_id, view, fmt, quality, threshold)
+    if entry is None:
+        return jsonify({'error': 'Kunne ikke tegne siden'}), 404
+
+    data, etag, view_fallback = entry
+    response = Response(data, mimetype=OVERLAY_FORMATS[fmt])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    response.headers['X-View-Fallback'] = '1' if view_fallback else '0'
+    if negotiated:
+        response.vary.add('Accept')
+    return response.make_conditional(request)
+
+
+@bp.route('/api/geometry')
+def api_geometry():
+    """Som /api/render, men uten ferdig tegnet bilde: klienten tegner overlegget selv
+    over IIIF-bildet, så bytte av visning krever ingen nye kall."""
+    urn     = request.args.get('urn', '').strip()
+    page_id = request.args.get('page_id', '').strip()
+
+    if not urn or not page_id:
+        return jsonify({'error': 'Mangler urn eller page_id'}), 400
+
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+
+    if not _valid_page_id(page_id):
+        return jsonify({'error': 'Ugyldig side-ID'}), 400
+
+    start = time.perf_counter()
+    results, timings = _fan_out({
+        'alto':     (fetch_alto_page, urn, page_id),
+        'metadata': (get_metadata, urn),
+    })
+    timings['fetch'] = (time.perf_counter() - start) * 1000
+    page     = results['alto'] or AltoPage()
+    metadata = results['metadata']
+
+    response = jsonify({
+        'geometry':  page.geometry() if page.width is not None else None,
+        'image_url': iiif_image_url(page_id),
+        'full_text': page.full_text,
+        'metadata':  metadata,
+        'ocr_info':  page.ocr_info,
+        'avg_wc':    page.avg_wc,
+        'has_lines': bool(len(page.lines)),
+        'has_words': bool(len(page.words)),
+        'links': {
+            'image': f"https://www.nb.no/services/image/resolver/{page_id}/full/pct:66/0/native.jpg",
+            'alto':  f"https://api.nb.no/catalog/v1/metadata/{urn}/altos/{page_id}",
+        },
+    })
+    response.headers['Server-Timing'] = _server_timing(timings)
+    _schedule_prefetch(urn, page_id)
+    return response
+
+
+# Visning -> nivå for overlegg på fliser; 'ingen' gir flisen uten overlegg
+TILE_VIEWS = {'tekstblokker': 'blocks', 'tekstlinjer': 'lines', 'ord': 'words', 'konfidens': 'words'}
+
+
+def _tile_key(urn, page_id, view, fmt, quality, threshold, scale_factor, column, row):
+    return ('tile', urn, page_id, view, fmt, quality, threshold, scale_factor, column, row)
+
+
+def _cached_tile(urn, page_id, view, fmt, quality, threshold, scale_factor, column, row):
+    """Flis med overlegg som (bytes, etag), fra cache eller nytegnet. None utenfor siden eller ved feil.
+
+    Mangler ALTO-en for en overleggsvisning (feil eller tidsavbrudd), gis flisen uten overlegg
+    og med etag None; den caches ikke, så overlegget kommer med når nb.no svarer igjen.
+    """
+    key = _tile_key(urn, page_id, view, fmt, quality, threshold, scale_factor, column, row)
+    entry = _overlay_cache.get(key)
+    if entry is not None:
+        return entry
+    grid = tile_grid(fetch_image_info(page_id) or {})
+    tile = tile_region(grid, scale_factor, column, row) if grid is not None else None
+    if tile is None:
+        return None
+    region, width = tile
+    calls = {'image': (fetch_tile_bytes, page_id, region, width)}
+    if view in TILE_VIEWS:
+        calls['alto'] = (fetch_alto_page, urn, page_id)
+    results, _ = _fan_out(calls)
+    if results['image'] is None:
+        return None
+    if view in TILE_VIEWS and (results['alto'] is None or results['alto'].width is None):
+        return run_cpu(_render_tile, None, 'ingen', fmt, quality, None, None, grid, region, results['image'])
+    return _overlay_flight.do(key, run_cpu, _render_tile, key, view, fmt, quality, threshold,
+                              results.get('alto'), grid, region, results['image'])
+
+
+def _render_tile(key, view, fmt, quality, threshold, page, grid, region, image_data):
+    """Dekod flisen og tegn bare ALTO-elementene som overlapper den. Kjøres i CPU-poolen.
+
+    Med key None caches ikke flisen, og etag blir None.
+    """
+    if view in TILE_VIEWS and page is not None and page.width is not None:
+        boxes, color, regions, show_numbers, wc, view_fallback = _select_view(page, view)
+        level = 'blocks' if view_fallback else TILE_VIEWS[view]
+        idx, local = tile_elements(page, level, grid, region)
+        image = decode_image(image_data)
+        if len(idx):
+            # Boksene er i fullt oppløste piksler fra flisens hjørne; render_overlay skalerer til flisen
+            image = render_overlay(image, region[2], region[3], local, color,
+                                   regions=regions[idx] if regions is not None else None,
+                                   show_numbers=show_numbers, numbers=(idx + 1).tolist(),
+                                   wc=wc[idx] if wc is not None else None, threshold=threshold,
+                                   open_edges=True)
+        data = encode_image(image, fmt, quality)
+    elif fmt == 'jpeg':
+        data = image_data
+    else:
+        data = encode_image(decode_image(image_data), fmt, quality)
+    if key is None:
+        return data, None
+    entry = (data, hashlib.sha1(data).hexdigest())
+    _overlay_cache.set(key, entry, size=len(data))
+    return entry
+
+
+@bp.route('/api/tiles/info')
+def api_tiles_info():
+    """Flisrutenettet for sidebildet fra IIIF info.json: full størrelse, flisstørrelse og zoomnivåer."""
+    page_id = request.args.get('page_id', '').strip()
+    if not _valid_page_id(page_id):
+        return jsonify({'error': 'Ugyldig side-ID'}), 400
+    grid = tile_grid(fetch_image_info(page_id) or {})
+    if grid is None:
+        return jsonify({'error': 'Fant ikke bildeinformasjon for siden'}), 404
+    response = jsonify(grid)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+@bp.route('/api/tile')
+@limiter.limit("1200 per minute")
+def api_tile():
+    """Én flis av sidebildet for dypzoom, med overlegg for elementene som er synlige i den.
+
+    s er skaleringsfaktoren for zoomnivået (se /api/tiles/info), col og row flisens
+    plass i rutenettet på det nivået. view=ingen gir flisen uten overlegg.
+    """
+    urn     = request.args.get('urn', '').strip()
+    page_id = request.args.get('page_id', '').strip()
+    view    = request.args.get('view', 'tekstblokker').strip()
+
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+
+    if not _valid_page_id(page_id):
+        return jsonify({'error': 'Ugyldig side-ID'}), 400
+
+    try:
+        scale_factor = int(request.args['s'])
+        column, row = int(request.args['col']), int(request.args['row'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Mangler eller ugyldig flis'}), 400
+
+    fmt = request.args.get('format', 'jpeg').strip().lower()
+    fmt = 'jpeg' if fmt == 'jpg' else fmt
+    if fmt not in OVERLAY_FORMATS:
+        return jsonify({'error': 'Ukjent bildeformat'}), 400
+    quality = 0 if fmt == 'png' else 85
+    if view not in TILE_VIEWS and view != 'ingen':
+        return jsonify({'error': 'Ukjent visning'}), 400
+    try:
+        threshold = _view_threshold(view)
+    except ValueError:
+        return jsonify({'error': 'Ugyldig WC-terskel'}), 400
+
+    entry = _cached_tile(urn, page_id, view, fmt, quality, threshold, scale_factor, column, row)
+    if entry is None:
+        return jsonify({'error': 'Fant ikke flisen'}), 404
+
+    data, etag = entry
+    response = Response(data, mimetype=OVERLAY_FORMATS[fmt])
+    if etag is None:
+        # Uten overlegg fordi ALTO-en ikke kunne hentes; skal hentes på nytt neste gang
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response.make_conditional(request)
+
+
+def _page_thumbnail(urn, page_id, width):
+    """Miniatyr av siden med blokkene tegnet inn, eller None hvis bildet mangler."""
+    data = fetch_image_bytes(page_id, width=width)
+    if data is None:
+        return None
+    try:
+        return run_cpu(_draw_thumbnail, data, read_alto_page(urn, page_id))
+    except (OSError, ValueError):
+        return None
+
+
+def _draw_thumbnail(image_data, page):
+    image = decode_image(image_data)
+    if page.width is None:
+        return image.convert('RGB')
+    return render_overlay(image, page.width, page.height, page.blocks, regions=page.block_region, tags=False)
+
+
+def _int_arg(name, default, lo, hi):
+    try:
+        return max(lo, min(hi, int(request.args.get(name, default))))
+    except ValueError:
+        return default
+
+
+@bp.route('/api/thumbnails')
+@limiter.limit("10 per minute")
+def api_thumbnails():
+    """Miniatyrer med blokkoverlegg for et sideintervall (first–last, 1-basert).
+
+    mode=sheet (standard) gir ett kontaktark som bilde; mode=stream gir NDJSON med
+    én linje per side, i den rekkefølgen sidene blir ferdige.
+    """
+    urn = request.args.get('urn', '').strip()
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+
+    _, page_ids = get_page_list(fetch_iiif_manifest(urn))
+    if not page_ids:
+        return jsonify({'error': 'Ingen sider funnet for dette dokumentet'}), 404
+
+    first   = _int_arg('first', 1, 1, len(page_ids))
+    last    = _int_arg('last', len(page_ids), first, min(len(page_ids), first + MAX_BATCH_PAGES - 1))
+    width   = _int_arg('width', 160, 40, 400)
+    columns = _int_arg('columns', 10, 1, 50)
+    mode    = request.args.get('mode', 'sheet').strip()
+    fmt     = request.args.get('format', 'jpeg').strip().lower()
+    if fmt not in OVERLAY_FORMATS:
+        return jsonify({'error': 'Ukjent bildeformat'}), 400
+
+    selected = list(enumerate(page_ids[first - 1:last], first))
+
+    if mode == 'stream':
+        def generate():
+            pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+            try:
+                futures = {pool.submit(_page_thumbnail, urn, page_id, width): (n, page_id)
+                           for n, page_id in selected}
+                for future in as_completed(futures):
+                    n, page_id = futures[future]
+                    thumb = future.result()
+                    data = base64.b64encode(run_cpu(encode_image, thumb, fmt)).decode() if thumb is not None else None
+                    yield json.dumps({'page': n, 'page_id': page_id, 'mimetype': OVERLAY_FORMATS[fmt],
+                                      'image_b64': data}) + "\n"
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        return Response(stream_with_context(metrics_utils.track_stream('thumbnails', generate())),
+                        mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+
+    if mode != 'sheet':
+        return jsonify({'error': 'Ukjent modus'}), 400
+
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+        thumbs = list(pool.map(lambda item: _page_thumbnail(urn, item[1], width), selected))
+    sheet = run_cpu(contact_sheet, [(str(n), thumb) for (n, _), thumb in zip(selected, thumbs)], width, columns)
+    return Response(run_cpu(encode_image, sheet, fmt), mimetype=OVERLAY_FORMATS[fmt],
+                    headers={'Cache-Control': 'public, max-age=3600'})
+
+
+@bp.route('/api/quality/report')
+@limiter.limit("10 per hour")
+def api_quality_report():
+    """OCR-kvalitetsrapport for hele dokumentet som SSE.
+
+    Hver side gir én hendelse med sidens statistikk og det løpende aggregatet,
+    i den rekkefølgen sidene blir ferdige. Siste hendelse har done=true.
+    """
+    urn = request.args.get('urn', '').strip()
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+
+    _, page_ids = get_page_list(fetch_iiif_manifest(urn))
+    if not page_ids:
+        return jsonify({'error': 'Ingen sider funnet for dette dokumentet'}), 404
+
+    def generate():
+        report = QualityReport(len(page_ids))
+        for done, (page_number, page) in enumerate(iter_document_pages(urn, page_ids, BATCH_WORKERS), 1):
+            stats = None
+            if page is None or page.width is None:
+                report.add_missing(page_number)
+            else:
+                stats = page_quality(page)
+                report.add_page(page_number, page, stats)
+            event = {'page': page_number, 'page_id': page_ids[page_number - 1], 'stats': stats,
+                     'current': done, 'total': len(page_ids), 'done': False, 'summary': report.summary()}
+            yield f"data: {json.dumps(event)}\n\n"
+        event = {'current': len(page_ids), 'total': len(page_ids), 'done': True, 'summary': report.summary()}
+        yield f"data: {json.dumps(event)}\n\n"
+
+    return Response(
+        stream_with_context(metrics_utils.track_stream('quality_report', generate())),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def _search_pages(urn, page_ids):
+    return iter_document_pages(urn, page_ids, BATCH_WORKERS)
+
+
+# Ordindekser for de sist søkte dokumentene; bygges i bakgrunnen ved første søk,
+# høyst ALTO_SEARCH_BUILDS samtidig, innenfor ALTO_SEARCH_CACHE_MB til sammen
+SEARCH_CACHE_MB = int(os.environ.get('ALTO_SEARCH_CACHE_MB', 256))
+_search_indexes = IndexCache(_search_pages, SEARCH_CACHE_MB * 1024 * 1024,
+                             max_builds=int(os.environ.get('ALTO_SEARCH_BUILDS', 2)))
+metrics_utils.register_stats('search_indexes', _search_indexes.stats)
+
+
+@bp.route('/api/search')
+@limiter.limit("120 per minute")
+def api_search():
+    """Søk etter ord i hele dokumentet. Gir sidene med treff og ordboksene i ALTO-koordinater.
+
+    Første søk i et dokument starter indekseringen; til den er ferdig (complete=false)
+    svarer endepunktet med treffene i sidene som er indeksert så langt.
+    """
+    urn   = request.args.get('urn', '').strip()
+    query = request.args.get('q', '').strip()
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+    if not query or len(query) > 200:
+        return jsonify({'error': 'Mangler søkeord eller for lang søkestreng'}), 400
+
+    _, page_ids = get_page_list(fetch_iiif_manifest(urn))
+    if not page_ids:
+        return jsonify({'error': 'Ingen sider funnet for dette dokumentet'}), 404
+
+    index = _search_indexes.get(urn, page_ids)
+    return jsonify(index.search(query, limit=_int_arg('limit', 50, 1, 200)))
+
+
+HIT_LEVELS = {
+    'ord':          ('words',),
+    'tekstlinjer':  ('lines',),
+    'tekstblokker': ('blocks',),
+    'alle':         ('words', 'lines', 'blocks'),
+}
+
+
+@bp.route('/api/hit')
+@limiter.limit("600 per minute")
+def api_hit():
+    """Elementene under et klikk (x, y) eller i et dratt rektangel (x, y, w, h).
+
+    Koordinatene er i visningens piksler; display_width/display_height er størrelsen
+    bildet vises i, og brukes til å skalere til ALTO-koordinater. Uten dem tolkes
+    koordinatene som ALTO-koordinater. Svaret har boksene i begge koordinatsystemer.
+    """
+    urn     = request.args.get('urn', '').strip()
+    page_id = request.args.get('page_id', '').strip()
+    level   = request.args.get('level', 'alle').strip()
+
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+    if not _valid_page_id(page_id):
+        return jsonify({'error': 'Ugyldig side-ID'}), 400
+    if level not in HIT_LEVELS:
+        return jsonify({'error': 'Ukjent nivå'}), 400
+
+    try:
+        x, y = float(request.args['x']), float(request.args['y'])
+        w = float(request.args['w']) if 'w' in request.args else None
+        h = float(request.args['h']) if 'h' in request.args else None
+        display_width = float(request.args.get('display_width', 0))
+        display_height = float(request.args.get('display_height', 0))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Mangler eller ugyldige koordinater'}), 400
+    if (w is None) != (h is None) or (w is not None and (w < 0 or h < 0)):
+        return jsonify({'error': 'w og h må oppgis sammen og være positive'}), 400
+
+    page = fetch_alto_page(urn, page_id)
+    if page.width is None:
+        return jsonify({'error': 'Fant ikke ALTO for siden'}), 404
+
+    sx = page.width / display_width if display_width > 0 else 1.0
+    sy = page.height / display_height if display_height > 0 else 1.0
+    if w is None:
+        hits = hit_test(page, HIT_LEVELS[level], x * sx, y * sy, limit=_int_arg('limit', 200, 1, 1000))
+    else:
+        hits = hit_test(page, HIT_LEVELS[level], x * sx, y * sy, max(1.0, w * sx), max(1.0, h * sy),
+                        limit=_int_arg('limit', 200, 1, 1000))
+
+    for items in hits.values():
+        for item in items:
+            bx, by, bw, bh = item['box']
+            item['display_box'] = [round(bx / sx, 1), round(by / sy, 1), round(bw / sx, 1), round(bh / sy, 1)]
+    return jsonify({'width': page.width, 'height': page.height, 'hits': hits})
 
 
 @bp.route('/api/download/page')
@@ -131,8 +838,7 @@ def download_page():
     if not _valid_page_id(page_id):
         return jsonify({'error': 'Ugyldig side-ID'}), 400
 
-    alto_xml = fetch_alto(urn, page_id)
-    _, _, _, _, _, full_text = parse_alto(alto_xml)
+    full_text = fetch_alto_page(urn, page_id).full_text
     return Response(
         full_text or '',
         mimetype='text/plain; charset=utf-8',
@@ -140,46 +846,204 @@ def download_page():
     )
 
 
+# Gjenopptak av en avbrutt SSE-nedlasting er unntatt grensen på 5 per time, men bare med en
+# hendelses-ID serveren selv har signert. Den binder nedlastingen (URN, sideliste og når den
+# startet) til antall sider som faktisk er levert, så den gir ikke rabatt på en ny nedlasting.
+# Uten ALTO_RESUME_SECRET får hver prosess sin egen hemmelighet, og et gjenopptak hos en
+# annen arbeider teller som ny nedlasting.
+RESUME_SECRET = os.environ.get('ALTO_RESUME_SECRET', '').encode() or os.urandom(32)
+RESUME_TTL    = int(os.environ.get('ALTO_RESUME_TTL', 3600))
+
+
+def _new_download():
+    """ID for en ny nedlasting: starttidspunkt og et tilfeldig tillegg."""
+    return f"{int(time.time())}-{os.urandom(4).hex()}"
+
+
+def _event_id(urn, page_ids_str, download, delivered):
+    """Signert hendelses-ID '<levert>.<nedlasting>.<mac>' etter at delivered sider er sendt."""
+    message = f"{urn}\n{page_ids_str}\n{download}\n{delivered}".encode()
+    mac = hmac.new(RESUME_SECRET, message, hashlib.sha256).hexdigest()[:32]
+    return f"{delivered}.{download}.{mac}"
+
+
+def _resume():
+    """(start, nedlasting): antall sider klienten har fått og nedlastingen den fortsetter.
+
+    Med en gyldig Last-Event-ID fra en SSE-strøm (stream=1) for samme URN og sideliste,
+    fortsatt innen RESUME_TTL sekunder fra nedlastingen startet, er nedlastingen ID-en
+    fra hendelsen. Ellers er den None, og start kommer fra ?start= uten noe unntak.
+    """
+    urn          = request.args.get('urn', '').strip()
+    page_ids_str = request.args.get('page_ids', '').strip()
+    last_id = request.headers.get('Last-Event-ID', '').strip()
+    parts = last_id.split('.')
+    if request.args.get('stream', '') == '1' and len(parts) == 3 and parts[0].isdigit():
+        delivered, download = int(parts[0]), parts[1]
+        issued = download.partition('-')[0]
+        if (delivered > 0 and issued.isdigit() and 0 <= time.time() - int(issued) <= RESUME_TTL
+                and hmac.compare_digest(last_id, _event_id(urn, page_ids_str, download, delivered))):
+            return delivered, download
+    start = request.args.get('start', '').strip()
+    return (int(start) if start.isdigit() else 0), None
+
+
+def _is_resume():
+    return _resume()[1] is not None
+
+
 @bp.route('/api/download/full/progress')
-@limiter.limit("5 per hour")
+@limiter.limit("5 per hour", exempt_when=_is_resume)
+@limiter.limit("30 per hour", exempt_when=lambda: not _is_resume())
 def download_full_progress():
+    """Fulltekst for hele dokumentet med SSE-fremdrift.
+
+    Med stream=1 sendes hver sides tekst i sin egen hendelse, i siderekkefølge,
+    med en signert hendelses-ID for hvor mange sider som er levert. Nettleserens
+    EventSource sender den som Last-Event-ID ved gjentilkobling, og nedlastingen
+    fortsetter fra neste side uten å telle mot grensen for nye nedlastinger.
+    """
     urn          = request.args.get('urn', '').strip()
     page_ids_str = request.args.get('page_ids', '').strip()
+    stream       = request.args.get('stream', '') == '1'
 
     if not _valid_urn(urn):
         return jsonify({'error': 'Ugyldig URN-format'}), 400
 
     page_ids = [p for p in page_ids_str.split(',') if p and _valid_page_id(p)]
     total    = len(page_ids)
+    start, download = _resume()
+    start    = min(start, total)
+    download = download or _new_download()
 
     def generate():
-        full_text = ""
-        for i, page_id in enumerate(page_ids, 1):
-            url = f"https://api.nb.no/catalog/v1/metadata/{urn}/altos/{page_id}"
-            try:
-                resp = requests.get(url, timeout=10)
-                if resp.status_code == 200:
-                    _, _, _, _, _, page_text = parse_alto(resp.text)
-                    if page_text:
-                        full_text += f"=== Side {i} ===\n{page_text}\n\n"
-                elif resp.status_code not in (404, 500):
-                    full_text += f"=== Side {i} ===\n[FEIL: Status {resp.status_code}]\n\n"
-            except requests.RequestException:
-                full_text += f"=== Side {i} ===\n[FEIL: Nettverksfeil]\n\n"
+        # Sidene blir ferdige i vilkårlig rekkefølge; teksten settes sammen i siderekkefølge til slutt
+        segments = [""] * total
+        for done, (page_number, segment) in enumerate(iter_document_text(urn, page_ids), 1):
+            segments[page_number - 1] = segment
+            yield f"data: {json.dumps({'current': done, 'total': total, 'done': False})}\n\n"
 
-            yield f"data: {json.dumps({'current': i, 'total': total, 'done': False})}\n\n"
+        full_text = "".join(segments).strip()
+        yield f"data: {json.dumps({'current': total, 'total': total, 'done': True, 'text': full_text})}\n\n"
 
-        yield f"data: {json.dumps({'current': total, 'total': total, 'done': True, 'text': full_text.strip()})}\n\n"
+    def generate_stream():
+        yield "retry: 2000\n\n"
+        for page_number, segment in iter_document_text_ordered(urn, page_ids, start=start):
+            event = {'current': page_number, 'total': total, 'done': False, 'text': segment}
+            yield f"id: {_event_id(urn, page_ids_str, download, page_number)}\ndata: {json.dumps(event)}\n\n"
+        yield f"id: {_event_id(urn, page_ids_str, download, total)}\ndata: {json.dumps({'current': total, 'total': total, 'done': True})}\n\n"
 
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(metrics_utils.track_stream('download_full_progress',
+                                                       generate_stream() if stream else generate())),
         mimetype='text/event-stream',
         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
     )
 
 
+@bp.route('/api/download/full/text')
+@limiter.limit("5 per hour")
+def download_full_text():
+    """Fulltekst for hele dokumentet som chunket text/plain-vedlegg, én side om gangen.
+
+    ?start=n hopper over de n første sidene, for å fortsette et avbrutt nedlastingsforsøk.
+    Fortsettelsen teller som en ny nedlasting.
+    """
+    urn          = request.args.get('urn', '').strip()
+    page_ids_str = request.args.get('page_ids', '').strip()
+
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+
+    page_ids = [p for p in page_ids_str.split(',') if p and _valid_page_id(p)]
+    start    = _int_arg('start', 0, 0, len(page_ids))
+
+    def generate():
+        for _, segment in iter_document_text_ordered(urn, page_ids, start=start):
+            if segment:
+                yield segment
+
+    return Response(
+        stream_with_context(metrics_utils.track_stream('download_full_text', generate())),
+        mimetype='text/plain; charset=utf-8',
+        headers={
+            'Content-Disposition': f'attachment; filename="{urn}_FULLTEKST.txt"',
+            'X-Accel-Buffering': 'no',
+        },
+    )
+
+
+@bp.route('/api/export')
+@limiter.limit("10 per hour")
+def api_export():
+    """Parset ALTO for hele dokumentet som kolonner: blokker, linjer og ord med koordinater,
+    WC, innhold og ID-er per side.
+
+    format=npz (standard) gir en NPZ-fil som strømmes side for side (compress=0 for
+    ukomprimert); format=jsonl gir én JSON-linje per side. Sidene kommer i den
+    rekkefølgen de blir ferdige, med sidenummeret i navnet eller linjen.
+    """
+    urn = request.args.get('urn', '').strip()
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+    fmt = request.args.get('format', 'npz').strip().lower()
+    if fmt not in ('npz', 'jsonl'):
+        return jsonify({'error': 'Ukjent eksportformat'}), 400
+
+    _, page_ids = get_page_list(fetch_iiif_manifest(urn))
+    if not page_ids:
+        return jsonify({'error': 'Ingen sider funnet for dette dokumentet'}), 404
+
+    pages = iter_document_pages(urn, page_ids, BATCH_WORKERS)
+
+    if fmt == 'jsonl':
+        def generate():
+            for page_number, page in pages:
+                yield json.dumps(page_record(page_number, page_ids[page_number - 1], page),
+                                 ensure_ascii=False) + "\n"
+        mimetype = 'application/x-ndjson'
+    else:
+        def generate():
+            npz = NpzStream(compress=request.args.get('compress', '1') != '0')
+            for page_number, page in pages:
+                chunk = run_cpu(npz.add_page, page_number, page_ids[page_number - 1], page)
+                if chunk:
+                    yield chunk
+            yield run_cpu(npz.finish)
+        mimetype = 'application/octet-stream'
+
+    return Response(
+        stream_with_context(metrics_utils.track_stream('export', generate())),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{urn}_ALTO.{fmt}"',
+            'X-Accel-Buffering': 'no',
+        },
+    )
+
+
+# Opplastinger leses trinnvis fra strømmen, så grensene verner bare mot misbruk.
+# UPLOAD_MAX_MB gjelder én ALTO-fil (også hver fil i en ZIP), BATCH_UPLOAD_MAX_MB hele ZIP-filen.
+UPLOAD_MAX_MB       = int(os.environ.get('ALTO_UPLOAD_MAX_MB', 100))
+BATCH_UPLOAD_MAX_MB = int(os.environ.get('ALTO_BATCH_UPLOAD_MAX_MB', 1024))
+MAX_BATCH_FILES     = int(os.environ.get('ALTO_MAX_BATCH_FILES', 5000))
+app.config['MAX_CONTENT_LENGTH'] = max(UPLOAD_MAX_MB, BATCH_UPLOAD_MAX_MB) * 1024 * 1024
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': 'Forespørselen er for stor'}), 413
+
+
+def _upload_too_large(max_mb):
+    return request.content_length is not None and request.content_length > max_mb * 1024 * 1024
+
+
 @bp.route('/api/local/render', methods=['POST'])
 def local_render():
+    if _upload_too_large(UPLOAD_MAX_MB):
+        return jsonify({'error': f'Filen er for stor (maks {UPLOAD_MAX_MB} MB)'}), 413
+
     if 'file' not in request.files:
         return jsonify({'error': 'Ingen fil lastet opp'}), 400
 
@@ -187,64 +1051,150 @@ def local_render():
     if not f.filename.lower().endswith('.xml'):
         return jsonify({'error': 'Kun XML-filer støttes'}), 400
 
-    content = f.read()
-    if len(content) > 5_000_000:
-        return jsonify({'error': 'Filen er for stor (maks 5 MB)'}), 413
-
-    try:
-        alto_xml = content.decode('utf-8')
-    except UnicodeDecodeError:
-        alto_xml = content.decode('latin-1', errors='replace')
-
     view = request.form.get('view', 'tekstblokker').strip()
+    if view not in VIEWS:
+        return jsonify({'error': 'Ukjent visning'}), 400
+    try:
+        threshold = _view_threshold(view)
+    except ValueError:
+        return jsonify({'error': 'Ugyldig WC-terskel'}), 400
 
-    image_url = extract_image_url(alto_xml)
-    image     = fetch_image_from_url(image_url) if image_url else None
-
-    width, height, text_blocks, lines, words, full_text = parse_alto(alto_xml)
-    avg_wc   = extract_avg_wc(alto_xml)
-    ocr_info = extract_ocr_info(alto_xml)
+    page  = run_cpu(parse_alto_stream, f.stream)
+    image = fetch_image_from_url(page.image_url) if page.image_url else None
 
-    view_map = {
-        'tekstblokker': (text_blocks, 'red',   True),
-        'tekstlinjer':  (lines,       'blue',  False),
-        'ord':          (words,       'green', False),
-    }
-    elements, color, show_numbers = view_map.get(view, (text_blocks, 'red', True))
-    view_fallback = False
-    if not elements and text_blocks:
-        elements, color, show_numbers = text_blocks, 'red', True
-        view_fallback = True
-    image_b64 = plot_alto(image, width, height, elements, color=color, show_numbers=show_numbers)
+    image_b64, view_fallback = run_cpu(_render_view, image, page, view, threshold)
 
     return jsonify({
         'image_b64':    image_b64,
-        'full_text':    full_text,
-        'ocr_info':     ocr_info,
-        'avg_wc':       avg_wc,
-        'has_lines':    bool(lines),
-        'has_words':    bool(words),
+        'full_text':    page.full_text,
+        'ocr_info':     page.ocr_info,
+        'avg_wc':       page.avg_wc,
+        'has_lines':    bool(len(page.lines)),
+        'has_words':    bool(len(page.words)),
         'view_fallback': view_fallback,
-        'image_url':    image_url,
+        'image_url':    page.image_url,
     })
 
 
 @bp.route('/api/local/urn', methods=['POST'])
 def local_urn():
     """Les dokument-URN fra bilde-URL i en lokal ALTO XML-fil."""
+    if _upload_too_large(UPLOAD_MAX_MB):
+        return jsonify({'error': f'Filen er for stor (maks {UPLOAD_MAX_MB} MB)'}), 413
     if 'file' not in request.files:
         return jsonify({'error': 'Ingen fil'}), 400
-    f = request.files['file']
-    content = f.read()
-    try:
-        alto_xml = content.decode('utf-8')
-    except UnicodeDecodeError:
-        alto_xml = content.decode('latin-1', errors='replace')
-    image_url = extract_image_url(alto_xml)
+    image_url = extract_image_url_stream(request.files['file'].stream)
     doc_urn   = extract_doc_urn(image_url)
     return jsonify({'image_url': image_url, 'doc_urn': doc_urn})
 
 
+@bp.route('/api/local/diff', methods=['POST'])
+@limiter.limit("60 per minute")
+def local_diff():
+    """Sammenlign ordene i en lokal ALTO-fil med NB.no-ALTO for samme side.
+
+    Svarer med ordoperasjonene (substitute, delete, insert) med bokser i hver sides
+    egne koordinater, tellinger og tegn- og ordfeilrate med NB.no som fasit.
+    """
+    if _upload_too_large(UPLOAD_MAX_MB):
+        return jsonify({'error': f'Filen er for stor (maks {UPLOAD_MAX_MB} MB)'}), 413
+    if 'file' not in request.files:
+        return jsonify({'error': 'Ingen fil lastet opp'}), 400
+
+    urn     = request.form.get('urn', '').strip()
+    page_id = request.form.get('page_id', '').strip()
+    if not _valid_urn(urn):
+        return jsonify({'error': 'Ugyldig URN-format'}), 400
+    if not _valid_page_id(page_id):
+        return jsonify({'error': 'Ugyldig side-ID'}), 400
+    try:
+        limit = max(0, min(20000, int(request.form.get('limit', 2000))))
+    except ValueError:
+        limit = 2000
+
+    local = run_cpu(parse_alto_stream, request.files['file'].stream)
+    if local.width is None:
+        return jsonify({'error': 'Den lokale filen mangler Layout/Page med gyldig WIDTH og HEIGHT'}), 400
+    nb = fetch_alto_page(urn, page_id)
+    if nb.width is None:
+        return jsonify({'error': 'Fant ikke ALTO for siden'}), 404
+
+    result = run_cpu(diff_pages, nb, local, limit)
+    return jsonify({
+        'nb':    {'width': nb.width, 'height': nb.height},
+        'local': {'width': local.width, 'height': local.height},
+        **result,
+    })
+
+
+@bp.route('/api/local/batch', methods=['POST'])
+@limiter.limit("10 per hour")
+def local_batch():
+    """Valider en hel OCR-leveranse: en ZIP med ALTO-filer som parses samtidig.
+
+    Svarer med NDJSON, én linje per fil i den rekkefølgen filene blir ferdige, og til
+    slutt en linje med done=true og kvalitetsaggregatet for hele leveransen.
+    """
+    if _upload_too_large(BATCH_UPLOAD_MAX_MB):
+        return jsonify({'error': f'Filen er for stor (maks {BATCH_UPLOAD_MAX_MB} MB)'}), 413
+    if 'file' not in request.files:
+        return jsonify({'error': 'Ingen fil lastet opp'}), 400
+
+    f = request.files['file']
+    if not f.filename.lower().endswith('.zip'):
+        return jsonify({'error': 'Kun ZIP-filer støttes'}), 400
+
+    # Forespørselens filer lukkes før svaret strømmes, så arkivet kopieres til en egen midlertidig fil
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(f.stream, spool)
+    try:
+        archive = zipfile.ZipFile(spool)
+    except zipfile.BadZipFile:
+        spool.close()
+        return jsonify({'error': 'Ugyldig ZIP-fil'}), 400
+
+    members = zip_members(archive)
+    error = ('Ingen XML-filer i ZIP-filen' if not members else
+             f'For mange filer (maks {MAX_BATCH_FILES})' if len(members) > MAX_BATCH_FILES else None)
+    if error:
+        archive.close()
+        spool.close()
+        return jsonify({'error': error}), 400
+
+    def generate():
+        report = QualityReport(len(members))
+        failed = 0
+        try:
+            for n, info, page, error in iter_zip_pages(archive, members, UPLOAD_MAX_MB * 1024 * 1024,
+                                                       BATCH_WORKERS):
+                line = {'index': n, 'file': info.filename, 'ok': error is None, 'error': error}
+                if page is None:
+                    failed += 1
+                    report.add_missing(n)
+                else:
+                    stats = page_quality(page)
+                    report.add_page(n, page, stats)
+                    line.update({
+                        'width':     page.width,
+                        'height':    page.height,
+                        'lines':     len(page.lines),
+                        'image_url': page.image_url,
+                        'doc_urn':   extract_doc_urn(page.image_url),
+                        'ocr_info':  page.ocr_info,
+                        'stats':     stats,
+                    })
+                yield json.dumps(line) + "\n"
+            yield json.dumps({'done': True, 'files': len(members), 'failed': failed,
+                              'summary': report.summary()}) + "\n"
+        finally:
+            archive.close()
+            spool.close()
+
+    return Response(stream_with_context(metrics_utils.track_stream('local_batch', generate())),
+                    mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
 app.register_blueprint(bp, url_prefix='/alto-viewer')
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+"""Samtidig pågang mot én kald side: kall mot stand-in-serveren med og uten sammenslåing.
+
+N klienter ber om /api/render og deretter /api/overlay for samme side i samme øyeblikk,
+slik det skjer når en lenke til et dokument deles. Teller kall per rute mot
+stand-in-serveren og antall overlegg som faktisk ble tegnet.
+
+    python -m benchmarks.bench_burst [klienter] [forsinkelse-sekunder]
+"""
+import os
+import sys
+import threading
+import time
+
+from benchmarks.fixture_server import FixtureServer
+
+
+def _burst(client, clients, urn, page_id):
+    barrier = threading.Barrier(clients)
+    statuses = []
+
+    def one():
+        barrier.wait()
+        r = client.get('/alto-viewer/api/render', query_string={'urn': urn, 'page_id': page_id})
+        o = client.get('/alto-viewer/api/overlay', query_string={'urn': urn, 'page_id': page_id,
+                                                                 'view': 'tekstblokker', 'format': 'jpeg'})
+        statuses.append((r.status_code, o.status_code))
+
+    threads = [threading.Thread(target=one) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(s == (200, 200) for s in statuses), statuses
+    return time.perf_counter() - start
+
+
+def main(clients=32, latency=0.2):
+    server = FixtureServer(latency=latency).start()
+    os.environ.update({'NB_API_BASE': server.url, 'NB_IMAGE_BASE': server.url,
+                       'ALTO_CACHE_BACKEND': 'none', 'ALTO_PREFETCH': '0', 'ALTO_RATELIMIT': '0',
+                       'ALTO_UPSTREAM_WORKERS': str(4 * clients)})
+    import app
+    from cache_utils import SingleFlight
+
+    # Tell tegninger ved å pakke inn funksjonen som faktisk tegner
+    rendered = []
+    render = app._render_overlay
+    app._render_overlay = lambda *args: rendered.append(1) or render(*args)
+
+    client = app.app.test_client()
+    print(f"{clients} samtidige klienter, {latency * 1000:.0f} ms forsinkelse per kall")
+    print(f"  {'':<18} {'alto':>5} {'bilde':>6} {'metadata':>9} {'tegnet':>7} {'tid (s)':>8}")
+    try:
+        for label, enabled in (('uten sammenslåing', False), ('med sammenslåing', True)):
+            SingleFlight.enabled = enabled
+            # Ny URN per runde, så alle prosesscacher er kalde
+            urn = f"URN:NBN:no-nb_digibok_{5000000000000 + enabled}"
+            before = dict(server.hits)
+            rendered.clear()
+            elapsed = _burst(client, clients, urn, f"{urn}_0001")
+            hits = {k: server.hits[k] - before.get(k, 0) for k in ('alto', 'image', 'metadata')}
+            print(f"  {label:<18} {hits['alto']:>5} {hits['image']:>6} {hits['metadata']:>9} "
+                  f"{len(rendered):>7} {elapsed:>8.2f}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 32, float(args[1]) if len(args) > 1 else 0.2)
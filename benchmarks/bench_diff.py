@@ -0,0 +1,68 @@
+"""Ordjustering mellom to OCR-versjoner av samme side (diff_utils.diff_pages).
+
+Den lokale versjonen lages fra den syntetiske siden med endrede og slettede ord,
+dobbel oppløsning og to tekstblokker i byttet leserekkefølge. Tabellen viser tid
+per side, og for bok-tettheten også ren Myers over hele siden til sammenligning.
+
+    python -m benchmarks.bench_diff
+"""
+import random
+import re
+import time
+
+from alto_utils import parse_alto_page
+from benchmarks.synthetic import DENSITIES, make_density
+from diff_utils import diff_pages, _myers
+
+
+def _local_version(alto_xml, seed=1, changed=0.05, dropped=0.02, scale=2):
+    rnd = random.Random(seed)
+
+    def string(match):
+        draw = rnd.random()
+        if draw < dropped:
+            return ''
+        element = match.group(0)
+        if draw < dropped + changed:
+            element = re.sub(r'CONTENT="([^"]*)"', lambda m: f'CONTENT="{m.group(1)[:-1]}q"', element)
+        return re.sub(r'(HPOS|VPOS|WIDTH|HEIGHT)="(\d+)"',
+                      lambda m: f'{m.group(1)}="{int(m.group(2)) * scale}"', element)
+
+    xml = re.sub(r'<String [^>]*/>', string, alto_xml)
+    xml = re.sub(r'(<Page [^>]*WIDTH=")(\d+)(" HEIGHT=")(\d+)',
+                 lambda m: f'{m.group(1)}{int(m.group(2)) * scale}{m.group(3)}{int(m.group(4)) * scale}', xml)
+    blocks = re.findall(r'<TextBlock ID="TB_\d+".*?</TextBlock>', xml)
+    if len(blocks) > 4:
+        xml = xml.replace(blocks[1], '\0').replace(blocks[4], blocks[1]).replace('\0', blocks[4])
+    return xml
+
+
+def _best_ms(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    print(f"{'tetthet':<8} {'ord':>7} {'diff (ms)':>10} {'CER':>7} {'WER':>7} {'erstattet':>10} {'slettet':>8}")
+    for name in DENSITIES:
+        alto_xml = make_density(name)
+        nb = parse_alto_page(alto_xml)
+        local = parse_alto_page(_local_version(alto_xml))
+        result = diff_pages(nb, local)
+        ms = _best_ms(lambda: diff_pages(nb, local))
+        counts = result['counts']
+        print(f"{name:<8} {len(nb.words):>7} {ms:>10.1f} {result['cer']:>7.4f} {result['wer']:>7.4f} "
+              f"{counts['substitute']:>10} {counts['delete']:>8}")
+
+    nb = parse_alto_page(make_density('bok'))
+    local = parse_alto_page(_local_version(make_density('bok')))
+    ms = _best_ms(lambda: _myers(nb.word_content, local.word_content, len(nb.words) + len(local.words)), repeat=1)
+    print(f"\nbok, ren Myers over hele siden: {ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Nedlasting av hele dokumentet mot en lokal ALTO-server med kunstig forsinkelse.
+
+Sammenligner sekvensiell henting (1 arbeider) med samtidig henting og sjekker
+at teksten blir identisk, med sidene i riktig rekkefølge.
+
+    python -m benchmarks.bench_download [sider] [forsinkelse-sekunder]
+"""
+import os
+import sys
+import time
+
+# Uten delt cache: hver variant skal hente alle sidene fra serveren
+os.environ.setdefault('ALTO_CACHE_BACKEND', 'none')
+
+import download_utils
+from benchmarks.fixture_server import FixtureServer
+
+
+def main(pages=60, latency=0.05):
+    server = FixtureServer(latency=latency).start()
+    download_utils.ALTO_URL = server.url + "/catalog/v1/metadata/{urn}/altos/{page_id}"
+    urn = "URN:NBN:no-nb_digibok_0000000000000"
+    page_ids = tuple(f"{urn}_{i:04d}" for i in range(1, pages + 1))
+    try:
+        results = {}
+        print(f"{pages} sider, {latency * 1000:.0f} ms forsinkelse per kall")
+        for workers in (1, 4, 8, 16):
+            download_utils.fetch_full_document_text.cache_clear()
+            start = time.perf_counter()
+            results[workers] = download_utils.fetch_full_document_text(urn, page_ids, workers)
+            elapsed = time.perf_counter() - start
+            print(f"  {workers:>2} arbeidere: {elapsed:6.2f} s")
+        reference = results[1]
+        assert all(text == reference for text in results.values()), "teksten avhenger av antall arbeidere"
+        positions = [reference.index(f"=== Side {n} ===") for n in range(1, pages + 1)]
+        assert positions == sorted(positions), "sidene kommer ikke i rekkefølge"
+        print("  identisk tekst og riktig siderekkefølge for alle varianter")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 60, float(args[1]) if len(args) > 1 else 0.05)
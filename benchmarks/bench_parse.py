@@ -0,0 +1,72 @@
+"""Parsetid per side: fire separate parser (før) mot én parse_alto_page (etter),
+minnebruk for geometrien som tuple-lister mot int32-kolonner, og tid og toppminne
+for trinnvis parsing fra strøm (parse_alto_stream, lokale opplastinger).
+
+    python -m benchmarks.bench_parse
+"""
+import io
+import timeit
+import tracemalloc
+
+from alto_utils import parse_alto, parse_alto_page, parse_alto_stream, extract_avg_wc, extract_ocr_info, extract_image_url
+from benchmarks.synthetic import DENSITIES, make_density
+
+
+def _four_parses(alto_xml):
+    parse_alto(alto_xml)
+    extract_avg_wc(alto_xml)
+    extract_ocr_info(alto_xml)
+    extract_image_url(alto_xml)
+
+
+def _best_ms(fn, arg, repeat=5):
+    number = 3
+    return min(timeit.repeat(lambda: fn(arg), number=number, repeat=repeat)) / number * 1000
+
+
+def _retained_kb(build):
+    tracemalloc.start()
+    obj = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size / 1024, peak / 1024
+
+
+def main():
+    print(f"{'tetthet':<8} {'ord':>7} {'4 parser (ms)':>14} {'parse_alto_page (ms)':>21} {'speedup':>8}")
+    for name in DENSITIES:
+        alto_xml = make_density(name)
+        n_words = len(parse_alto_page(alto_xml).words)
+        before = _best_ms(_four_parses, alto_xml)
+        after = _best_ms(parse_alto_page, alto_xml)
+        print(f"{name:<8} {n_words:>7} {before:>14.1f} {after:>21.1f} {before / after:>7.2f}x")
+
+    print()
+    print(f"{'tetthet':<8} {'tupler (KiB)':>13} {'kolonner (KiB)':>15} {'topp parse (KiB)':>17}")
+    for name in DENSITIES:
+        alto_xml = make_density(name)
+        page = parse_alto_page(alto_xml)
+        tuples, _ = _retained_kb(lambda: page.as_tuple()[2:5])
+        columns, _ = _retained_kb(lambda: [a.copy() for a in (page.blocks, page.block_region, page.lines,
+                                                              page.line_block, page.words, page.word_line,
+                                                              page.word_wc)])
+        _, peak = _retained_kb(lambda: parse_alto_page(alto_xml))
+        print(f"{name:<8} {tuples:>13.0f} {columns:>15.0f} {peak:>17.0f}")
+
+    print()
+    print(f"{'tetthet':<8} {'fil (KiB)':>10} {'tre (ms)':>9} {'strøm (ms)':>11} "
+          f"{'topp tre (KiB)':>15} {'topp strøm (KiB)':>17}")
+    for name in DENSITIES:
+        data = make_density(name).encode('utf-8')
+        # Slik opplastingen ble lest før: hele filen dekodet til str og parset som ett tre
+        tree_ms = _best_ms(lambda d: parse_alto_page(d.decode('utf-8')), data)
+        stream_ms = _best_ms(lambda d: parse_alto_stream(io.BytesIO(d)), data)
+        _, tree_peak = _retained_kb(lambda: parse_alto_page(data.decode('utf-8')))
+        _, stream_peak = _retained_kb(lambda: parse_alto_stream(io.BytesIO(data)))
+        print(f"{name:<8} {len(data) / 1024:>10.0f} {tree_ms:>9.1f} {stream_ms:>11.1f} "
+              f"{tree_peak:>15.0f} {stream_peak:>17.0f}")
+
+
+if __name__ == '__main__':
+    main()
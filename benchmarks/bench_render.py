@@ -0,0 +1,47 @@
+"""Rendertid per visning: matplotlib-figur mot direkte rastertegning (PIL/NumPy).
+
+    python -m benchmarks.bench_render
+"""
+import time
+
+from PIL import Image
+
+from alto_utils import parse_alto_page
+from benchmarks.synthetic import make_density
+from image_utils import plot_alto
+
+VIEWS = {
+    'tekstblokker': lambda p: (p.blocks, 'red', p.block_region, True),
+    'tekstlinjer':  lambda p: (p.lines, 'blue', None, False),
+    'ord':          lambda p: (p.words, 'green', None, False),
+}
+
+
+def _best_ms(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    page = parse_alto_page(make_density('avis'))
+    # NB.no-bildet hentes i pct:50
+    image = Image.new('RGB', (page.width // 2, page.height // 2), (235, 228, 210))
+    print(f"{'visning':<13} {'elementer':>9} {'matplotlib (ms)':>16} {'pil (ms)':>9} {'speedup':>8}")
+    for view, select in VIEWS.items():
+        boxes, color, regions, show_numbers = select(page)
+
+        def render(engine):
+            return plot_alto(image, page.width, page.height, boxes, color=color, regions=regions,
+                             show_numbers=show_numbers, engine=engine)
+
+        mpl = _best_ms(lambda: render('matplotlib'))
+        pil = _best_ms(lambda: render('pil'))
+        print(f"{view:<13} {len(boxes):>9} {mpl:>16.0f} {pil:>9.0f} {mpl / pil:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Sammenlign to resultatfiler fra benchmarks.suite.
+
+Skriver hver måling som finnes i begge filene med endringen i prosent. For
+tider (_ms, seconds) og minne (_mb, _kib) er lavere bedre; for pages_per_s høyere.
+
+    python -m benchmarks.compare før.json etter.json [--threshold 10]
+"""
+import argparse
+import json
+
+_LOWER_IS_BETTER = ('_ms', 'seconds', '_mb', '_kib')
+_HIGHER_IS_BETTER = ('_per_s',)
+
+
+def _flatten(tree, prefix=''):
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def compare(before, after, threshold):
+    """Gir (måling, før, etter, endring i %, merknad) for målinger begge filene har."""
+    old = dict(_flatten(before['results']))
+    for path, new in _flatten(after['results']):
+        if path not in old or not path.endswith(_LOWER_IS_BETTER + _HIGHER_IS_BETTER):
+            continue
+        base = old[path]
+        change = (new - base) / base * 100 if base else 0.0
+        better = change < 0 if path.endswith(_LOWER_IS_BETTER) else change > 0
+        note = '' if abs(change) < threshold else ('bedre' if better else 'VERRE')
+        yield path, base, new, change, note
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help="endring i prosent som markeres")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"før:   {before['meta']['commit']}  {before['meta']['timestamp']}")
+    print(f"etter: {after['meta']['commit']}  {after['meta']['timestamp']}")
+    rows = list(compare(before, after, args.threshold))
+    width = max((len(row[0]) for row in rows), default=10)
+    for path, base, new, change, note in rows:
+        print(f"{path:<{width}} {base:>10.2f} {new:>10.2f} {change:>+8.1f} %  {note}")
+
+
+if __name__ == '__main__':
+    main()
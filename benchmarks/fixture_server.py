@@ -0,0 +1,167 @@
+"""Lokal stand-in for api.nb.no og www.nb.no med syntetiske data og konfigurerbar forsinkelse.
+
+Serverer IIIF-manifest, metadata, ALTO-sider med valgt tetthet, IIIF info.json og
+JPEG-skanninger av hele siden eller en region i den størrelsen IIIF-URL-en ber om
+(pct:n eller w,). Pek appen hit med
+
+    NB_API_BASE=<server.url> NB_IMAGE_BASE=<server.url>
+
+    server = FixtureServer(latency=0.05).start()
+    ... server.url ...
+    server.stop()
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import re
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import make_density
+
+_ROUTES = (
+    ('alto',     re.compile(r'^/catalog/v1/metadata/(?P<urn>[^/]+)/altos/(?P<page_id>[^/?]+)$')),
+    ('manifest', re.compile(r'^/catalog/v1/iiif/(?P<urn>[^/]+)/manifest$')),
+    ('metadata', re.compile(r'^/catalog/v1/items/(?P<urn>[^/?]+)$')),
+    ('image',    re.compile(r'^/services/image/resolver/(?P<page_id>[^/]+)/full/(?P<size>[^/]+)/0/native\.jpg$')),
+    ('tile',     re.compile(r'^/services/image/resolver/(?P<page_id>[^/]+)/(?P<region>\d+,\d+,\d+,\d+)/'
+                            r'(?P<size>[^/]+)/0/native\.jpg$')),
+    ('info',     re.compile(r'^/services/image/resolver/(?P<page_id>[^/]+)/info\.json$')),
+)
+
+# Sidestørrelsen make_alto bruker som standard
+PAGE_WIDTH, PAGE_HEIGHT = 2000, 3000
+TILE_SIZE = 512
+
+
+class FixtureServer:
+    """pages er antall sider i manifestet; image_latency er forsinkelsen for bilder
+    (standard: samme som latency). requests teller alle kall, hits per rute."""
+
+    def __init__(self, latency=0.0, density='bok', port=0, pages=100, image_latency=None):
+        self.latency = latency
+        self.image_latency = latency if image_latency is None else image_latency
+        self.density = density
+        self.pages = pages
+        self.requests = 0
+        self.hits = Counter()
+        self._lock = threading.Lock()
+        self._alto = {}
+        self._jpeg = {}
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def alto(self, page_id):
+        with self._lock:
+            if page_id not in self._alto:
+                self._alto[page_id] = make_density(self.density, seed=hash(page_id) & 0xFFFF).encode()
+            return self._alto[page_id]
+
+    def manifest(self, urn):
+        canvases = [{'@id': f"{self.url}/catalog/v1/iiif/{urn}/canvas/{urn}_{n:04d}", 'label': str(n)}
+                    for n in range(1, self.pages + 1)]
+        return json.dumps({'@id': f"{self.url}/catalog/v1/iiif/{urn}/manifest",
+                           'sequences': [{'canvases': canvases}]}).encode()
+
+    def metadata(self, urn):
+        return json.dumps({'id': urn, 'metadata': {'title': 'Syntetisk dokument',
+                                                   'originInfo': {'issued': '1900'}}}).encode()
+
+    def info(self, page_id):
+        return json.dumps({'@id': f"{self.url}/services/image/resolver/{page_id}",
+                           'width': PAGE_WIDTH, 'height': PAGE_HEIGHT,
+                           'tiles': [{'width': TILE_SIZE, 'scaleFactors': [1, 2, 4, 8]}]}).encode()
+
+    def jpeg(self, size, region=None):
+        """Papirfarget skanning med støy; samme bilde for alle sider i en gitt størrelse."""
+        width, height = _image_size(size, region)
+        with self._lock:
+            if (width, height) not in self._jpeg:
+                rng = np.random.default_rng(0)
+                pixels = (rng.normal(0, 12, (height, width, 1)) + (235, 228, 210)).clip(0, 255).astype(np.uint8)
+                buf = io.BytesIO()
+                Image.fromarray(pixels).save(buf, 'JPEG', quality=85)
+                self._jpeg[(width, height)] = buf.getvalue()
+            return self._jpeg[(width, height)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                route, m = next(((name, m) for name, rx in _ROUTES for m in [rx.match(self.path)] if m),
+                                (None, None))
+                with server._lock:
+                    server.requests += 1
+                    server.hits[route] += 1
+                delay = server.image_latency if route in ('image', 'tile') else server.latency
+                if delay:
+                    time.sleep(delay)
+                if route == 'alto':
+                    self._send(200, server.alto(m.group('page_id')), 'application/xml; charset=utf-8')
+                elif route == 'manifest':
+                    self._send(200, server.manifest(m.group('urn')), 'application/json')
+                elif route == 'metadata':
+                    self._send(200, server.metadata(m.group('urn')), 'application/json')
+                elif route == 'info':
+                    self._send(200, server.info(m.group('page_id')), 'application/json')
+                elif route in ('image', 'tile'):
+                    region = m.group('region') if route == 'tile' else None
+                    try:
+                        self._send(200, server.jpeg(m.group('size'), region), 'image/jpeg')
+                    except ValueError:
+                        self._send(400, b'', 'text/plain')
+                else:
+                    self._send(404, b'', 'text/plain')
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _image_size(size, region=None):
+    """IIIF-størrelse ('pct:50', '160,' eller 'full') for hele siden eller en region 'x,y,w,h' til (bredde, høyde)."""
+    full_width, full_height = PAGE_WIDTH, PAGE_HEIGHT
+    if region:
+        x, y, w, h = map(int, region.split(','))
+        full_width, full_height = min(w, PAGE_WIDTH - x), min(h, PAGE_HEIGHT - y)
+        if full_width <= 0 or full_height <= 0:
+            raise ValueError(region)
+    if size == 'full':
+        return full_width, full_height
+    if size.startswith('pct:'):
+        pct = float(size[4:]) / 100
+        return max(1, round(full_width * pct)), max(1, round(full_height * pct))
+    if size.endswith(','):
+        width = int(size[:-1])
+        return width, max(1, round(width * full_height / full_width))
+    raise ValueError(size)
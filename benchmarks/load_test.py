@@ -0,0 +1,166 @@
+"""Lasttest: mange samtidige fulldokument-nedlastinger (SSE) og sidevisninger mot gunicorn.
+
+Starter stand-in-serveren og gunicorn med gunicorn.conf.py, én gang per arbeiderklasse,
+og lar nedlastingsklienter strømme /api/download/full/progress mens renderklienter
+kaller /api/render for nye sider. Rapporterer fullføringstid for nedlastingene og
+latens for renderkallene mens nedlastingene pågår.
+
+    python -m benchmarks.load_test [--downloads 8] [--renders 4] [--pages 40] [--classes sync,gevent]
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from benchmarks.fixture_server import FixtureServer
+
+ROOT = '/alto-viewer'
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_gunicorn(worker_class, workers, fixture_url, port):
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS=str(workers),
+               NB_API_BASE=fixture_url, NB_IMAGE_BASE=fixture_url, ALTO_CACHE_BACKEND='none',
+               ALTO_PREFETCH='0', ALTO_RATELIMIT='0', APP_ROOT='')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                             '--bind', f'127.0.0.1:{port}', 'app:app'],
+                            cwd=REPO, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}{ROOT}/", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"gunicorn ({worker_class}) startet ikke")
+
+
+def _download(base, urn, pages, timeout):
+    page_ids = ','.join(f"{urn}_{n:04d}" for n in range(1, pages + 1))
+    start = time.perf_counter()
+    events, first = 0, None
+    try:
+        with requests.get(f"{base}{ROOT}/api/download/full/progress", stream=True, timeout=timeout,
+                          params={'urn': urn, 'page_ids': page_ids, 'stream': '1'}) as response:
+            for line in response.iter_lines():
+                if line.startswith(b'data:'):
+                    events += 1
+                    first = first or time.perf_counter() - start
+    except requests.RequestException:
+        pass
+    return {'seconds': time.perf_counter() - start, 'first_event_s': first, 'complete': events == pages + 1}
+
+
+def _render_loop(base, client, stop, timeout):
+    latencies, errors = [], 0
+    n = 0
+    while not stop.is_set():
+        n += 1
+        urn = f"URN:NBN:no-nb_digibok_{7000000000000 + client * 10000 + n}"
+        start = time.perf_counter()
+        try:
+            response = requests.get(f"{base}{ROOT}/api/render", timeout=timeout,
+                                    params={'urn': urn, 'page_id': f"{urn}_0001"})
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            errors += 1
+    return latencies, errors
+
+
+def run(worker_class, args, fixture_url):
+    port = _free_port()
+    proc = _start_gunicorn(worker_class, args.workers, fixture_url, port)
+    base = f"http://127.0.0.1:{port}"
+    stop = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=args.downloads + args.renders) as pool:
+            start = time.perf_counter()
+            downloads = [pool.submit(_download, base, f"URN:NBN:no-nb_digibok_{6000000000000 + i}",
+                                     args.pages, args.timeout)
+                         for i in range(args.downloads)]
+            # Renderklientene starter når nedlastingene allerede holder forbindelsene sine
+            time.sleep(0.5)
+            renders = [pool.submit(_render_loop, base, i, stop, args.timeout) for i in range(args.renders)]
+            results = [f.result() for f in downloads]
+            elapsed = time.perf_counter() - start
+            stop.set()
+            latencies, errors = [], 0
+            for f in renders:
+                lat, err = f.result()
+                latencies += lat
+                errors += err
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    latencies.sort()
+    return {
+        'downloads': {
+            'clients':   args.downloads,
+            'complete':  sum(r['complete'] for r in results),
+            'max_s':     round(max(r['seconds'] for r in results), 2),
+            'mean_s':    round(statistics.fmean(r['seconds'] for r in results), 2),
+            # Hvor lenge den siste klienten ventet før strømmen i det hele tatt startet
+            'first_event_max_s': round(max(r['first_event_s'] or r['seconds'] for r in results), 2),
+            'wall_s':    round(elapsed, 2),
+        },
+        'renders': {
+            'clients': args.renders,
+            'ok':      len(latencies),
+            'errors':  errors,
+            'p50_ms':  round(latencies[len(latencies) // 2], 1) if latencies else None,
+            'p95_ms':  round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None,
+            'per_s':   round(len(latencies) / elapsed, 1),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--downloads', type=int, default=8, help="samtidige fulldokument-nedlastinger")
+    parser.add_argument('--renders', type=int, default=4, help="samtidige renderklienter")
+    parser.add_argument('--pages', type=int, default=40, help="sider per nedlasting")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn-arbeidere")
+    parser.add_argument('--latency', type=float, default=0.05, help="forsinkelse per kall mot stand-in, sekunder")
+    parser.add_argument('--timeout', type=float, default=60, help="klienttimeout per kall, sekunder")
+    parser.add_argument('--classes', default='sync,gevent', help="arbeiderklasser som testes, kommaseparert")
+    parser.add_argument('--out', help="skriv resultatet som JSON hit")
+    args = parser.parse_args(argv)
+
+    server = FixtureServer(latency=args.latency, pages=args.pages).start()
+    try:
+        report = {'params': vars(args), 'results': {}}
+        for worker_class in args.classes.split(','):
+            print(f"{worker_class}…", file=sys.stderr)
+            report['results'][worker_class] = run(worker_class, args, server.url)
+    finally:
+        server.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Samlet benchmark mot den lokale stand-in-serveren, med resultater som JSON.
+
+Scenarier: parsetid per sidetetthet, rendertid per visning, /api/render kald og
+varm, gjennomstrømning for /api/download/full/progress og RSS for prosessen
+(som her er arbeideren). Resultatfilen kan sammenlignes med benchmarks.compare.
+
+    python -m benchmarks.suite [--out fil.json] [--latency 0.05] [--pages 40] [--repeat 5]
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+from benchmarks.fixture_server import FixtureServer
+from benchmarks.synthetic import DENSITIES, make_density
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+VIEWS = ('tekstblokker', 'tekstlinjer', 'ord', 'konfidens')
+
+
+def _rss_mb():
+    """Nåværende RSS fra /proc (Linux), ellers toppverdien fra getrusage."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def _summary_ms(samples):
+    samples = sorted(samples)
+    return {
+        'n':       len(samples),
+        'mean_ms': round(statistics.fmean(samples), 2),
+        'p50_ms':  round(samples[len(samples) // 2], 2),
+        'p95_ms':  round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+        'min_ms':  round(samples[0], 2),
+    }
+
+
+def _best_ms(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+def bench_parse(repeat):
+    from alto_utils import parse_alto_page
+
+    out = {}
+    for name in DENSITIES:
+        alto_xml = make_density(name)
+        tracemalloc.start()
+        page = parse_alto_page(alto_xml)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        out[name] = {
+            'words':   len(page.words),
+            'kib':     round(len(alto_xml.encode()) / 1024),
+            'best_ms': round(_best_ms(lambda: parse_alto_page(alto_xml), repeat), 2),
+            'peak_kib': round(peak / 1024),
+        }
+    return out
+
+
+def bench_render(repeat):
+    from PIL import Image
+
+    import app
+    from alto_utils import parse_alto_page
+    from image_utils import plot_alto_bytes
+
+    page = parse_alto_page(make_density('avis'))
+    # NB.no-bildet hentes i pct:50
+    image = Image.new('RGB', (page.width // 2, page.height // 2), (235, 228, 210))
+    out = {}
+    for view in VIEWS:
+        boxes, color, regions, show_numbers, wc, _ = app._select_view(page, view)
+        for fmt in ('jpeg', 'webp', 'png'):
+            def render():
+                return plot_alto_bytes(image, page.width, page.height, boxes, color=color, regions=regions,
+                                       show_numbers=show_numbers, fmt=fmt, wc=wc)
+            out[f"{view}.{fmt}"] = {'elements': len(boxes), 'best_ms': round(_best_ms(render, repeat), 2)}
+    return out
+
+
+def bench_api_render(client, root, requests_per_phase):
+    """Kald: ny URN og side for hvert kall, alt hentes fra stand-in-serveren.
+    Varm: de samme kallene igjen, nå fra prosessens cacher."""
+    targets = [(f"URN:NBN:no-nb_digibok_{9000000000000 + i}", f"URN:NBN:no-nb_digibok_{9000000000000 + i}_0001")
+               for i in range(requests_per_phase)]
+
+    def timed(path, params):
+        start = time.perf_counter()
+        response = client.get(path, query_string=params)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert response.status_code == 200, (path, response.status_code)
+        return elapsed
+
+    out = {}
+    for phase in ('cold', 'warm'):
+        out[phase] = _summary_ms([timed(f"{root}/api/render", {'urn': urn, 'page_id': page_id})
+                                  for urn, page_id in targets])
+    out['overlay_warm'] = _summary_ms([timed(f"{root}/api/overlay", {'urn': urn, 'page_id': page_id,
+                                                                     'view': 'tekstblokker', 'format': 'jpeg'})
+                                       for urn, page_id in targets])
+    return out
+
+
+def bench_download(client, root, pages, worker_counts):
+    import download_utils
+
+    out = {}
+    for workers in worker_counts:
+        download_utils.DOWNLOAD_WORKERS = workers
+        urn = f"URN:NBN:no-nb_digibok_{8000000000000 + workers}"
+        page_ids = ','.join(f"{urn}_{n:04d}" for n in range(1, pages + 1))
+        start = time.perf_counter()
+        response = client.get(f"{root}/api/download/full/progress",
+                              query_string={'urn': urn, 'page_ids': page_ids, 'stream': '1'})
+        events = sum(line.startswith('data:') for line in response.get_data(as_text=True).splitlines())
+        elapsed = time.perf_counter() - start
+        assert events == pages + 1, f"forventet {pages + 1} hendelser, fikk {events}"
+        out[f"workers_{workers}"] = {'pages': pages, 'seconds': round(elapsed, 3),
+                                     'pages_per_s': round(pages / elapsed, 1)}
+    return out
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', help="resultatfil (standard: benchmarks/results/<tid>-<commit>.json)")
+    parser.add_argument('--latency', type=float, default=0.05, help="forsinkelse per kall mot stand-in, sekunder")
+    parser.add_argument('--pages', type=int, default=40, help="sider i nedlastingsscenariet")
+    parser.add_argument('--requests', type=int, default=10, help="kall per fase i /api/render-scenariet")
+    parser.add_argument('--repeat', type=int, default=5, help="gjentakelser for parse og render")
+    args = parser.parse_args(argv)
+
+    server = FixtureServer(latency=args.latency, pages=args.pages).start()
+    # Må settes før appmodulene importeres; uten delt cache og forhåndshenting
+    # så kalde kall faktisk er kalde og ingenting skjer i bakgrunnen.
+    os.environ.update({'NB_API_BASE': server.url, 'NB_IMAGE_BASE': server.url,
+                       'ALTO_CACHE_BACKEND': 'none', 'ALTO_PREFETCH': '0'})
+    rss = {'start_mb': round(_rss_mb(), 1)}
+    try:
+        import app
+        app.limiter.enabled = False
+        client = app.app.test_client()
+        # APP_ROOT er prefikset foran proxyen; testklienten snakker med Flask direkte
+        root = '/alto-viewer'
+        rss['after_import_mb'] = round(_rss_mb(), 1)
+
+        results = {}
+        for name, run in (
+            ('parse',      lambda: bench_parse(args.repeat)),
+            ('render',     lambda: bench_render(args.repeat)),
+            ('api_render', lambda: bench_api_render(client, root, args.requests)),
+            ('download',   lambda: bench_download(client, root, args.pages, (1, 8))),
+        ):
+            print(f"{name}…", file=sys.stderr)
+            results[name] = run()
+            rss[f"after_{name}_mb"] = round(_rss_mb(), 1)
+        rss['peak_mb'] = round(_peak_rss_mb(), 1)
+        results['rss'] = rss
+        results['upstream_requests'] = dict(server.hits)
+    finally:
+        server.stop()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit':    _git_commit(),
+            'python':    platform.python_version(),
+            'platform':  platform.platform(),
+            'params':    vars(args),
+        },
+        'results': results,
+    }
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        out = os.path.join(RESULTS_DIR, f"{stamp}-{report['meta']['commit'] or 'ukjent'}.json")
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(out)
+
+
+if __name__ == '__main__':
+    main()
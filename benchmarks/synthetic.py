@@ -0,0 +1,79 @@
+"""Syntetiske ALTO-sider for benchmarks.
+
+Genererer sider med et gitt antall blokker, linjer per blokk og ord per linje,
+med samme struktur som ALTO-filene fra NB.no (Description med OCR-info og
+fileName, marger og PrintSpace).
+"""
+import random
+
+ALTO_NS = "http://www.loc.gov/standards/alto/ns-v3#"
+
+# Tetthet (blokker, linjer per blokk, ord per linje)
+DENSITIES = {
+    "bok":   (12, 10, 8),      # ~1 000 ord
+    "avis":  (60, 25, 7),      # ~10 000 ord
+    "tett":  (120, 30, 8),     # ~29 000 ord
+}
+
+
+def make_alto(blocks=12, lines_per_block=10, words_per_line=8, width=2000, height=3000,
+              image_url="https://www.nb.no/services/image/resolver/URN:NBN:no-nb_digibok_0000000000000_0001/full/pct:100/0/native.jpg",
+              seed=0):
+    rnd = random.Random(seed)
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<alto xmlns="{ALTO_NS}">',
+        '<Description><MeasurementUnit>pixel</MeasurementUnit>',
+        f'<sourceImageInformation><fileName>{image_url}</fileName></sourceImageInformation>',
+        '<OCRProcessing ID="OCR_0"><ocrProcessingStep><processingSoftware>'
+        '<softwareCreator>ABBYY</softwareCreator><softwareName>ABBYY FineReader</softwareName>'
+        '<softwareVersion>11</softwareVersion></processingSoftware></ocrProcessingStep></OCRProcessing>',
+        '</Description>',
+        '<Layout>',
+        f'<Page ID="P1" PHYSICAL_IMG_NR="1" WIDTH="{width}" HEIGHT="{height}">',
+        f'<TopMargin HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="100">',
+        _block("TB_top", 50, 20, width - 100, 60, 1, 4, rnd),
+        '</TopMargin>',
+        f'<PrintSpace HPOS="0" VPOS="100" WIDTH="{width}" HEIGHT="{height - 200}">',
+    ]
+    cols = max(1, int(blocks ** 0.5))
+    rows = -(-blocks // cols)
+    bw = width // cols
+    bh = (height - 200) // rows
+    for b in range(blocks):
+        bx = (b % cols) * bw
+        by = 100 + (b // cols) * bh
+        out.append(_block(f"TB_{b}", bx, by, bw, bh, lines_per_block, words_per_line, rnd))
+    out += [
+        '</PrintSpace>',
+        f'<BottomMargin HPOS="0" VPOS="{height - 100}" WIDTH="{width}" HEIGHT="100">',
+        _block("TB_bottom", 50, height - 80, 200, 60, 1, 1, rnd),
+        '</BottomMargin>',
+        '</Page></Layout></alto>',
+    ]
+    return "\n".join(out)
+
+
+def _block(block_id, x, y, w, h, n_lines, n_words, rnd):
+    parts = [f'<TextBlock ID="{block_id}" HPOS="{x}" VPOS="{y}" WIDTH="{w}" HEIGHT="{h}">']
+    lh = max(1, h // max(1, n_lines))
+    ww = max(1, w // max(1, n_words))
+    for li in range(n_lines):
+        ly = y + li * lh
+        parts.append(f'<TextLine ID="{block_id}_L{li}" HPOS="{x}" VPOS="{ly}" WIDTH="{w}" HEIGHT="{lh}">')
+        for wi in range(n_words):
+            word = "".join(rnd.choice("abcdefghijklmnopqrstuvwxyzæøå") for _ in range(rnd.randint(2, 9)))
+            parts.append(
+                f'<String ID="{block_id}_L{li}_W{wi}" HPOS="{x + wi * ww}" VPOS="{ly}" WIDTH="{ww - 4}" '
+                f'HEIGHT="{lh - 2}" CONTENT="{word}" WC="{rnd.uniform(0.3, 1.0):.2f}"/>'
+            )
+            if wi < n_words - 1:
+                parts.append(f'<SP HPOS="{x + wi * ww + ww - 4}" VPOS="{ly}" WIDTH="4"/>')
+        parts.append('</TextLine>')
+    parts.append('</TextBlock>')
+    return "".join(parts)
+
+
+def make_density(name, **kwargs):
+    blocks, lines_per_block, words_per_line = DENSITIES[name]
+    return make_alto(blocks, lines_per_block, words_per_line, **kwargs)
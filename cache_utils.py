@@ -0,0 +1,321 @@
+# cache_utils: get_shared_cache, SQLiteCache, NullCache, ByteLRUCache, SingleFlight
+from collections import OrderedDict
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from cpu_utils import native_lock, run_blocking
+
+CACHE_BACKEND = os.environ.get('ALTO_CACHE_BACKEND', 'sqlite')
+CACHE_PATH    = os.environ.get('ALTO_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'alto-viewer-cache.sqlite3'))
+CACHE_MAX_MB  = int(os.environ.get('ALTO_CACHE_MAX_MB', 512))
+
+# Levetid i sekunder per type innhold
+ALTO_TTL     = int(os.environ.get('ALTO_CACHE_TTL_ALTO', 7 * 24 * 3600))
+MANIFEST_TTL = int(os.environ.get('ALTO_CACHE_TTL_MANIFEST', 24 * 3600))
+METADATA_TTL = int(os.environ.get('ALTO_CACHE_TTL_METADATA', 24 * 3600))
+IMAGE_TTL    = int(os.environ.get('ALTO_CACHE_TTL_IMAGE', 7 * 24 * 3600))
+
+
+def alto_key(urn, page_id):
+    return f"alto:{urn}:{page_id}"
+
+
+def manifest_key(urn):
+    return f"manifest:{urn}"
+
+
+def metadata_key(urn):
+    return f"metadata:{urn}"
+
+
+def image_key(page_id, scale):
+    return f"image:{page_id}:{scale}"
+
+
+def image_info_key(page_id):
+    return f"image_info:{page_id}"
+
+
+class NullCache:
+    """Ingen delt cache; bare lru_cache i hver prosess."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+
+class SQLiteCache:
+    """Bytes-verdier i én SQLite-fil som alle prosesser på maskinen deler.
+
+    Utløpte oppføringer ignoreres og slettes ved neste opprydding. Når total
+    størrelse går over max_bytes, slettes de minst nylig brukte oppføringene
+    til cachen er under 90 % av grensen. Totalen holdes løpende i tabellen
+    totals av triggere, så set slipper å summere hele tabellen. Lesetider
+    samles opp i prosessen og skrives samlet høyst hvert TOUCH_INTERVAL sekund,
+    så et treff er bare en lesing. Feil i cachen skal aldri stoppe en
+    forespørsel, så sqlite3-feil svelges.
+
+    Hver prosess har én forbindelse, bak en lås, og skjemaet sjekkes bare når den
+    åpnes. Under gevent går alle kall via run_blocking, så en ventende skrivelås
+    i SQLite stopper bare den ene greenleten og ikke hele arbeideren.
+    """
+
+    # Sekunder mellom hver samlet oppdatering av lesetidene (accessed)
+    TOUCH_INTERVAL = 30
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = native_lock()
+        self._connection = None
+        self._pid = None
+        self._touched = {}
+        self._last_flush = time.monotonic()
+        # Åpnes med en gang, så get_shared_cache kan falle tilbake til NullCache ved feil
+        run_blocking(self._locked, self._has_schema)
+
+    def _conn(self):
+        # Åpnes på nytt etter fork; en forbindelse kan ikke deles mellom prosesser
+        if self._connection is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._has_schema(conn):
+                self._create_schema(conn)
+            self._connection, self._pid = conn, os.getpid()
+        return self._connection
+
+    @staticmethod
+    def _has_schema(conn):
+        # Siste objekt create_schema lager; finnes den, finnes resten
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'entries_update'").fetchone()
+        return row is not None
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO totals VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM entries))")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries"
+                " BEGIN UPDATE totals SET bytes = bytes + new.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries"
+                " BEGIN UPDATE totals SET bytes = bytes - old.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries"
+                " BEGIN UPDATE totals SET bytes = bytes + new.size - old.size WHERE id = 0; END"
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(self._conn(), *args)
+
+    def get(self, key):
+        try:
+            return run_blocking(self._locked, self._get, key)
+        except sqlite3.Error:
+            return None
+
+    def _get(self, conn, key):
+        row = conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        self._touch(conn, key, now)
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires = now + ttl if ttl else float('inf')
+        try:
+            run_blocking(self._locked, self._set, key, value, expires, now)
+        except sqlite3.Error:
+            pass
+
+    def _set(self, conn, key, value, expires, now):
+        conn.execute(
+            "INSERT INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size,"
+            " expires = excluded.expires, accessed = excluded.accessed",
+            (key, value, len(value), expires, now),
+        )
+        total = conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+        if total > self.max_bytes:
+            self._evict(conn, now)
+
+    def _touch(self, conn, key, now):
+        # Kalles med låsen holdt
+        self._touched[key] = now
+        if time.monotonic() - self._last_flush >= self.TOUCH_INTERVAL:
+            self._flush_touched(conn)
+
+    def _flush_touched(self, conn):
+        touched, self._touched = self._touched, {}
+        self._last_flush = time.monotonic()
+        if touched:
+            conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                             [(t, key) for key, t in touched.items()])
+
+    def _evict(self, conn, now):
+        self._flush_touched(conn)
+        conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        excess = conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0] - self.max_bytes * 0.9
+        if excess <= 0:
+            return
+        # De eldste oppføringene til og med den som bringer totalen under målet
+        conn.execute(
+            "DELETE FROM entries WHERE key IN ("
+            " SELECT key FROM (SELECT key, size, SUM(size) OVER (ORDER BY accessed, key) AS run FROM entries)"
+            " WHERE run - size < ?)",
+            (excess,),
+        )
+
+
+class ByteLRUCache:
+    """Prosesslokal LRU-cache for bytes-verdier, begrenset av total størrelse i stedet for antall.
+
+    Verdier større enn hele budsjettet lagres ikke.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, size=None):
+        """size må oppgis når value ikke er bytes, f.eks. en tuppel med bytes og metadata."""
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries':   len(self._entries),
+                'bytes':     self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits':      self._hits,
+                'misses':    self._misses,
+                'hit_ratio': self._hits / lookups if lookups else None,
+            }
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Slår sammen samtidige kall med samme nøkkel til ett.
+
+    Den første som ber om en nøkkel utfører kallet; de som kommer mens det pågår,
+    venter og får samme resultat (eller samme unntak). Ingenting caches etterpå:
+    det er jobben til cachen rundt. ALTO_SINGLEFLIGHT=0 slår sammenslåingen av.
+    """
+
+    enabled = os.environ.get('ALTO_SINGLEFLIGHT', '1') != '0'
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'followers': 0}
+
+    def do(self, key, fn, *args):
+        if not self.enabled:
+            return fn(*args)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self._stats['leaders' if leader else 'followers'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._flights)}
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Cachen som er valgt med ALTO_CACHE_BACKEND ('sqlite' eller 'none')."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                if CACHE_BACKEND == 'sqlite':
+                    try:
+                        _shared_cache = SQLiteCache()
+                    except sqlite3.Error:
+                        _shared_cache = NullCache()
+                else:
+                    _shared_cache = NullCache()
+    return _shared_cache
@@ -0,0 +1,87 @@
+# cpu_utils: run_cpu, run_blocking, native_lock – CPU-tungt og blokkerende arbeid i en begrenset pool av OS-tråder
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import os
+import threading
+
+# Maks antall parse-/renderjobber som kjører samtidig i hver arbeiderprosess
+CPU_WORKERS = int(os.environ.get('ALTO_CPU_WORKERS', 4))
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def _gevent_patched():
+    """True når gunicorn kjører med gevent-arbeidere og threading er erstattet av greenlets."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def _get_pool():
+    # Opprettes ved første bruk, etter at gevent eventuelt har patchet og etter fork
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if _gevent_patched():
+                    # Ekte OS-tråder: huben fortsetter å betjene andre greenlets mens jobben kjører
+                    from gevent.threadpool import ThreadPool
+                    _pool = ThreadPool(CPU_WORKERS)
+                else:
+                    _pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='cpu')
+    return _pool
+
+
+def _run(fn, args):
+    _local.inside = True
+    try:
+        return fn(*args)
+    finally:
+        _local.inside = False
+
+
+def run_cpu(fn, *args):
+    """Kjør fn(*args) i CPU-poolen og vent på resultatet.
+
+    Under gevent blokkerer bare den kallende greenleten, ikke hele arbeideren.
+    Kall fra en jobb som allerede kjører i poolen utføres direkte, så nestede
+    kall ikke kan vente på en plass de selv holder.
+    """
+    if getattr(_local, 'inside', False):
+        return fn(*args)
+    ctx = copy_context()
+    pool = _get_pool()
+    if isinstance(pool, ThreadPoolExecutor):
+        return pool.submit(ctx.run, _run, fn, args).result()
+    return pool.apply(ctx.run, (_run, fn, args))
+
+
+def run_blocking(fn, *args):
+    """Kjør et blokkerende kall som ikke gir fra seg kontrollen (f.eks. sqlite3).
+
+    Under gevent går det via CPU-poolen, så huben ikke står mens kallet venter;
+    ellers kjøres det direkte i tråden som kaller.
+    """
+    if _gevent_patched():
+        return run_cpu(fn, *args)
+    return fn(*args)
+
+
+def native_lock():
+    """En lås for OS-tråder, også når gevent har erstattet threading.Lock.
+
+    Til data som bare brukes fra jobber i poolen (se run_blocking); gevents egne
+    låser er ikke trygge mellom OS-tråder.
+    """
+    if _gevent_patched():
+        from gevent.monkey import get_original
+        return get_original('threading', 'Lock')()
+    return threading.Lock()
+
+
+def cpu_stats():
+    return {'workers': CPU_WORKERS, 'gevent': int(_gevent_patched())}
@@ -0,0 +1,305 @@
+# diff_utils: align_words, diff_pages – ordjustering og tegnfeilrate mellom to ALTO-versjoner av samme side
+from collections import Counter
+from bisect import bisect_left
+
+import numpy as np
+
+from spatial_utils import page_index
+
+# Myers-søket i ett gap gis opp etter så mange redigeringer; gapet blir da slettinger og innsettinger
+MAX_EDITS = 500
+
+# Minste overlapp (IoU) for at en sletting og en innsetting i samme gap regnes som én erstatning
+MIN_IOU = 0.3
+
+# Gap med færre samsvarende ord enn dette mellom seg slås sammen når CER regnes ut, så
+# tegn kan flyttes over korte ankre (f.eks. "to to" mot "t o to")
+CER_JOIN = 3
+
+# Gap der tekstene gir flere celler enn dette i Levenshtein-tabellen, regnes ikke ut;
+# de teller som lengden av den lengste teksten, som er en øvre grense
+MAX_CER_CELLS = 50_000_000
+
+
+def _myers(a, b, max_edits):
+    """Samsvarende (i, j)-par i korteste redigeringsskript (Myers O(ND)), eller None over max_edits."""
+    n, m = len(a), len(b)
+    limit = min(max_edits, n + m)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+    for d in range(limit + 1):
+        trace.append(v[:])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, offset, n, m)
+    return None
+
+
+def _backtrack(trace, offset, x, y):
+    pairs = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[offset + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            pairs.append((x, y))
+        x, y = prev_x, prev_y
+    pairs.reverse()
+    return pairs
+
+
+def _anchors(a, b, a0, a1, b0, b1):
+    """Ord som forekommer nøyaktig én gang på hver side i gapet, i lengste felles rekkefølge (patience)."""
+    count_a = Counter(a[a0:a1])
+    count_b = Counter(b[b0:b1])
+    pos_b = {t: j for j, t in enumerate(b[b0:b1], b0) if count_b[t] == 1}
+    candidates = [(i, pos_b[t]) for i, t in enumerate(a[a0:a1], a0) if count_a[t] == 1 and t in pos_b]
+
+    # Lengste voksende delsekvens over j-posisjonene
+    tails, tail_idx, prev = [], [], [-1] * len(candidates)
+    for n, (_, j) in enumerate(candidates):
+        p = bisect_left(tails, j)
+        if p == len(tails):
+            tails.append(j)
+            tail_idx.append(n)
+        else:
+            tails[p] = j
+            tail_idx[p] = n
+        prev[n] = tail_idx[p - 1] if p else -1
+    chain = []
+    n = tail_idx[-1] if tail_idx else -1
+    while n >= 0:
+        chain.append(candidates[n])
+        n = prev[n]
+    chain.reverse()
+    return chain
+
+
+def align_words(a, b, max_edits=MAX_EDITS):
+    """Samsvarende (i, j)-par mellom to ordsekvenser, i stigende rekkefølge.
+
+    Felles begynnelse og slutt tas først, deretter deles gapet rundt ord som er
+    unike på begge sider (patience diff), og bare gapene uten slike ankre går til
+    Myers O(ND). Kostnaden følger altså antall forskjeller, ikke sidens lengde.
+    """
+    pairs = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+        while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+            pairs.append((a0, b0))
+            a0 += 1
+            b0 += 1
+        while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+            a1 -= 1
+            b1 -= 1
+            pairs.append((a1, b1))
+        if a0 == a1 or b0 == b1:
+            continue
+        chain = _anchors(a, b, a0, a1, b0, b1)
+        if chain:
+            for i, j in chain:
+                pairs.append((i, j))
+                stack.append((a0, i, b0, j))
+                a0, b0 = i + 1, j + 1
+            stack.append((a0, a1, b0, b1))
+            continue
+        found = _myers(a[a0:a1], b[b0:b1], max_edits)
+        pairs.extend((a0 + i, b0 + j) for i, j in found or ())
+    pairs.sort()
+    return pairs
+
+
+def _levenshtein(s, t):
+    if len(s) < len(t):
+        s, t = t, s
+    if len(t) > 32:
+        return _levenshtein_rows(s, t)
+    row = list(range(len(t) + 1))
+    for i, cs in enumerate(s, 1):
+        prev, row[0] = row[0], i
+        for j, ct in enumerate(t, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (cs != ct))
+    return row[-1]
+
+
+def _levenshtein_rows(s, t):
+    """Levenshtein med én numpy-operasjon per tegn i s.
+
+    Innsettingene innen en rad er en løpende minimum: row[j] = min over k <= j av tmp[k] + j - k.
+    """
+    codes_t = np.frombuffer(t.encode('utf-32-le'), dtype=np.uint32)
+    steps = np.arange(len(t) + 1, dtype=np.int32)
+    row = steps.copy()
+    tmp = np.empty_like(row)
+    for cs in np.frombuffer(s.encode('utf-32-le'), dtype=np.uint32).tolist():
+        tmp[0] = row[0] + 1
+        np.minimum(row[1:] + 1, row[:-1] + (codes_t != cs), out=tmp[1:])
+        tmp -= steps
+        row = np.minimum.accumulate(tmp)
+        row += steps
+    return int(row[-1])
+
+
+def _join_gaps(gaps, min_run):
+    """Slå sammen påfølgende gap med færre enn min_run samsvarende ord mellom seg."""
+    joined = []
+    for gap in gaps:
+        if joined and gap[0] - joined[-1][1] < min_run:
+            joined[-1] = (joined[-1][0], gap[1], joined[-1][2], gap[3])
+        else:
+            joined.append(gap)
+    return joined
+
+
+def _gap_text(words):
+    # Hvert ord med mellomrommet foran seg, så ordgrenser og mellomrom telles med
+    return ''.join(' ' + w for w in words)
+
+
+def _iou(a, b):
+    """IoU mellom parvise (n, 4)-bokser (x, y, w, h)."""
+    a, b = a.astype(np.float64), b.astype(np.float64)
+    iw = np.minimum(a[:, 0] + a[:, 2], b[:, 0] + b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+    ih = np.minimum(a[:, 1] + a[:, 3], b[:, 1] + b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    union = a[:, 2] * a[:, 3] + b[:, 2] * b[:, 3] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def _box_pairs(ref, hyp, deleted, inserted):
+    """Par (i, j) av uparede ord på hver side som overlapper på siden (IoU >= MIN_IOU).
+
+    ref-boksene skaleres til hyp-koordinater og slås opp samlet i hyp-sidens
+    rutenettindeks; parene velges grådig etter høyest overlapp, hvert ord høyst én gang.
+    Parene kan krysse gapene, så ord som bare står i ulik leserekkefølge finner hverandre.
+    """
+    if not len(deleted) or not len(inserted):
+        return []
+    if not (ref.width and ref.height and hyp.width and hyp.height):
+        # Uten sidestørrelse på én av sidene kan koordinatene ikke skaleres; de sammenlignes som de er
+        kx = ky = 1.0
+    else:
+        kx, ky = hyp.width / ref.width, hyp.height / ref.height
+    free = np.zeros(len(hyp.words), dtype=bool)
+    free[inserted] = True
+    scale = np.array([kx, ky, kx, ky])
+    rect, hyp_idx = page_index(hyp, 'words').query_rects(ref.words[deleted] * scale)
+    keep = free[hyp_idx]
+    ref_idx, hyp_idx = deleted[rect[keep]], hyp_idx[keep]
+    if not len(ref_idx):
+        return []
+
+    scaled = hyp.words[hyp_idx] / scale
+    iou = _iou(ref.words[ref_idx], scaled)
+    keep = iou >= MIN_IOU
+    order = np.argsort(-iou[keep], kind='stable')
+    used_ref, used_hyp, pairs = set(), set(), []
+    for i, j in zip(ref_idx[keep][order].tolist(), hyp_idx[keep][order].tolist()):
+        if i not in used_ref and j not in used_hyp:
+            used_ref.add(i)
+            used_hyp.add(j)
+            pairs.append((i, j))
+    return pairs
+
+
+def _word(page, i):
+    return {'index': i, 'text': page.word_content[i], 'box': page.words[i].tolist()}
+
+
+def diff_pages(ref, hyp, limit=None):
+    """Sammenlign ordene på to AltoPage-er av samme side: ref (fasit, NB.no) og hyp (lokal OCR).
+
+    Ordene justeres på innhold med align_words; ordene som da står igjen på hver
+    side pares på bokseoverlapp til erstatninger (eller like ord i en annen
+    leserekkefølge). Svaret har operasjonene (substitute, delete, insert) med ord
+    og bokser i hver sides egne koordinater, høyst limit stykker, og tellinger med
+    ordfeilrate (WER) regnet mot ref.
+
+    Tegnfeilraten (CER) er redigeringsavstanden mellom sidenes tekst, ordene skilt
+    med mellomrom, delt på lengden av ref-teksten. Mellomrom og ordgrenser telles,
+    og ord i ulik leserekkefølge teller som feil. Avstanden regnes gap for gap
+    mellom ordene som align_words har paret (gap nærmere enn CER_JOIN ord slås
+    sammen), så den er en øvre grense for den eksakte avstanden og lik den når
+    ingen bedre justering bryter parene. Gap over MAX_CER_CELLS teller som den
+    lengste teksten, og cer_bounded blir da True.
+    """
+    a, b = ref.word_content, hyp.word_content
+    pairs = align_words(a, b)
+
+    # Gapene mellom samsvarende ord: (i0, i1, j0, j1)
+    gaps, i, j = [], 0, 0
+    for pi, pj in pairs + [(len(a), len(b))]:
+        if pi > i or pj > j:
+            gaps.append((i, pi, j, pj))
+        i, j = pi + 1, pj + 1
+    unmatched_ref = np.ones(len(a), dtype=bool)
+    unmatched_hyp = np.ones(len(b), dtype=bool)
+    if pairs:
+        matched = np.array(pairs)
+        unmatched_ref[matched[:, 0]] = False
+        unmatched_hyp[matched[:, 1]] = False
+    boxed = dict(_box_pairs(ref, hyp, np.flatnonzero(unmatched_ref), np.flatnonzero(unmatched_hyp)))
+    paired = set(boxed.values())
+
+    ops, char_errors, bounded = [], 0, False
+    counts = {'equal': len(pairs), 'substitute': 0, 'delete': 0, 'insert': 0}
+    for i0, i1, j0, j1 in _join_gaps(gaps, CER_JOIN):
+        text_a, text_b = _gap_text(a[i0:i1]), _gap_text(b[j0:j1])
+        if len(text_a) * len(text_b) > MAX_CER_CELLS:
+            char_errors += max(len(text_a), len(text_b))
+            bounded = True
+        else:
+            char_errors += _levenshtein(text_a, text_b)
+    if not a or not b:
+        # Uten ord på den ene siden er det ikke noe felles mellomrom å regne med
+        char_errors = max(len(' '.join(a)), len(' '.join(b)))
+
+    for i0, i1, j0, j1 in gaps:
+        for i in range(i0, i1):
+            j = boxed.get(i)
+            if j is not None and a[i] == b[j]:
+                counts['equal'] += 1
+            elif j is not None:
+                counts['substitute'] += 1
+                ops.append({'op': 'substitute', 'nb': _word(ref, i), 'local': _word(hyp, j)})
+            else:
+                counts['delete'] += 1
+                ops.append({'op': 'delete', 'nb': _word(ref, i), 'local': None})
+        for j in range(j0, j1):
+            if j not in paired:
+                counts['insert'] += 1
+                ops.append({'op': 'insert', 'nb': None, 'local': _word(hyp, j)})
+
+    ref_chars = sum(map(len, a)) + max(len(a) - 1, 0)
+    word_errors = counts['substitute'] + counts['delete'] + counts['insert']
+    truncated = limit is not None and len(ops) > limit
+    return {
+        'nb_words':    len(a),
+        'local_words': len(b),
+        'counts':      counts,
+        'nb_chars':    ref_chars,
+        'char_errors': char_errors,
+        'cer':         round(char_errors / ref_chars, 4) if ref_chars else None,
+        'cer_bounded': bounded,
+        'wer':         round(word_errors / len(a), 4) if a else None,
+        'ops':         ops[:limit] if truncated else ops,
+        'truncated':   truncated,
+    }
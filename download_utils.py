@@ -1,36 +1,202 @@
-# download_utils: fetch_alto, fetch_full_document_text
+# download_utils: fetch_alto, fetch_alto_page, read_alto_page, iter_document_pages, fetch_page_text, iter_document_text(_ordered), fetch_full_document_text
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from functools import lru_cache
+from itertools import islice
+import os
 
 import requests
 
-from alto_utils import parse_alto
+from alto_utils import parse_alto_page
+from cache_utils import ALTO_TTL, SingleFlight, alto_key, get_shared_cache
+from cpu_utils import run_cpu
+from http_utils import NB_API_BASE, http_get
+from metrics_utils import register_lru_cache, register_stats, stage
+
+ALTO_URL = NB_API_BASE + "/catalog/v1/metadata/{urn}/altos/{page_id}"
+
+# Antall sider som hentes samtidig ved nedlasting av hele dokumentet
+DOWNLOAD_WORKERS = int(os.environ.get('ALTO_DOWNLOAD_WORKERS', 8))
+
+
+# Samtidige kall for samme side venter på én henting og én parsing
+_alto_flight = SingleFlight()
+_page_flight = SingleFlight()
+
+
+def _fetch_alto_response(urn, page_id):
+    """Returnerer (statuskode, ALTO-tekst eller None), via den delte cachen. Kan kaste RequestException."""
+    key = alto_key(urn, page_id)
+    cached = get_shared_cache().get(key)
+    if cached is not None:
+        return 200, cached.decode('utf-8')
+    return _alto_flight.do(key, _fetch_alto_upstream, urn, page_id, key)
+
+
+def _fetch_alto_upstream(urn, page_id, key):
+    cache = get_shared_cache()
+    with stage('alto_fetch'):
+        response = http_get(ALTO_URL.format(urn=urn, page_id=page_id))
+    if response.status_code != 200:
+        return response.status_code, None
+    cache.set(key, response.text.encode('utf-8'), ttl=ALTO_TTL)
+    return 200, response.text
+
+
+class _NotCached(Exception):
+    """Bærer et resultat som ikke skal ligge i en lru_cache (feil eller side uten ALTO) ut av den."""
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
 
 
 @lru_cache(maxsize=256)
+def _cached_alto(urn, page_id):
+    try:
+        _, alto_xml = _fetch_alto_response(urn, page_id)
+    except requests.RequestException:
+        alto_xml = None
+    if alto_xml is None:
+        raise _NotCached(None)
+    return alto_xml
+
+
 def fetch_alto(urn, page_id):
-    url = f"https://api.nb.no/catalog/v1/metadata/{urn}/altos/{page_id}"
+    """ALTO-teksten for siden, eller None. Feil caches ikke, så neste kall prøver nb.no igjen."""
+    try:
+        return _cached_alto(urn, page_id)
+    except _NotCached as e:
+        return e.value
+
+
+@lru_cache(maxsize=32)
+def _cached_alto_page(urn, page_id):
+    page = _page_flight.do((urn, page_id), _parse_cached_alto, urn, page_id)
+    if page.width is None:
+        raise _NotCached(page)
+    return page
+
+
+def fetch_alto_page(urn, page_id):
+    """Parset AltoPage for siden, delt mellom visning, nedlasting og forhåndshenting.
+
+    Bare sider med gyldig Page-størrelse caches; en tom side etter feil eller
+    tidsavbrudd hentes på nytt ved neste kall, også når forhåndshentingen traff feilen.
+    """
+    try:
+        return _cached_alto_page(urn, page_id)
+    except _NotCached as e:
+        return e.value
+
+
+def _parse_cached_alto(urn, page_id):
+    return run_cpu(parse_alto_page, fetch_alto(urn, page_id))
+
+
+def read_alto_page(urn, page_id):
+    """Som fetch_alto_page, men uten prosessens lru-cacher, så bulkoperasjoner over
+    hele dokumenter ikke skyver ut sidene brukerne ser på. Den delte cachen brukes."""
+    try:
+        _, alto_xml = _fetch_alto_response(urn, page_id)
+    except requests.RequestException:
+        alto_xml = None
+    return run_cpu(parse_alto_page, alto_xml)
+
+
+def _read_page_or_none(urn, page_id):
+    try:
+        status, alto_xml = _fetch_alto_response(urn, page_id)
+    except requests.RequestException:
+        return None
+    return run_cpu(parse_alto_page, alto_xml) if status == 200 else None
+
+
+def iter_document_pages(urn, page_ids, workers=None):
+    """Parsede sider for hele dokumentet, i den rekkefølgen de blir ferdige.
+
+    Gir (sidenummer, AltoPage eller None når siden mangler). Høyst 2 × workers
+    sider er under arbeid samtidig, så lange dokumenter holdes ikke i minnet.
+    """
+    workers = workers or DOWNLOAD_WORKERS
+    numbered = enumerate(page_ids, 1)
+    pool = ThreadPoolExecutor(max_workers=workers)
     try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.text
+        running = {pool.submit(_read_page_or_none, urn, page_id): page_number
+                   for page_number, page_id in islice(numbered, 2 * workers)}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_number = running.pop(future)
+                for next_number, next_id in islice(numbered, 1):
+                    running[pool.submit(_read_page_or_none, urn, next_id)] = next_number
+                yield page_number, future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_page_text(urn, page_number, page_id):
+    """Hent og parse én side. Returnerer sidens bidrag til fulltekstfilen ('' hvis siden hoppes over)."""
+    try:
+        status, alto_xml = _fetch_alto_response(urn, page_id)
+        if status == 200:
+            page_text = run_cpu(parse_alto_page, alto_xml).full_text
+            if page_text:
+                return f"=== Side {page_number} ===\n{page_text}\n\n"
+        elif status not in (404, 500):
+            return f"=== Side {page_number} ===\n[FEIL: Status {status}]\n\n"
     except requests.RequestException:
-        pass
-    return None
+        return f"=== Side {page_number} ===\n[FEIL: Nettverksfeil]\n\n"
+    return ""
+
+
+def iter_document_text(urn, page_ids, workers=None):
+    """Hent sidene med begrenset samtidighet. Gir (sidenummer, tekst) i den rekkefølgen sidene blir ferdige."""
+    pool = ThreadPoolExecutor(max_workers=workers or DOWNLOAD_WORKERS)
+    try:
+        futures = {pool.submit(fetch_page_text, urn, page_number, page_id): page_number
+                   for page_number, page_id in enumerate(page_ids, 1)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # Klienten kan koble fra midt i nedlastingen; ikke hent resten av sidene
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_document_text_ordered(urn, page_ids, workers=None, start=0):
+    """Som iter_document_text, men i siderekkefølge fra indeks start.
+
+    Høyst 2 × workers sider er under henting eller ferdige og ikke levert,
+    så minnebruken er uavhengig av hvor mange sider dokumentet har.
+    """
+    workers = workers or DOWNLOAD_WORKERS
+    numbered = enumerate(page_ids[start:], start + 1)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = deque(
+            (page_number, pool.submit(fetch_page_text, urn, page_number, page_id))
+            for page_number, page_id in islice(numbered, 2 * workers)
+        )
+        while pending:
+            page_number, future = pending.popleft()
+            segment = future.result()
+            for next_number, next_id in islice(numbered, 1):
+                pending.append((next_number, pool.submit(fetch_page_text, urn, next_number, next_id)))
+            yield page_number, segment
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 @lru_cache(maxsize=32)
-def fetch_full_document_text(urn, page_ids):
-    full_doc_text = ""
-    for page_number, page_id in enumerate(page_ids, 1):
-        url = f"https://api.nb.no/catalog/v1/metadata/{urn}/altos/{page_id}"
-        try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                _, _, _, _, _, page_text = parse_alto(response.text)
-                if page_text:
-                    full_doc_text += f"=== Side {page_number} ===\n{page_text}\n\n"
-            elif response.status_code not in (404, 500):
-                full_doc_text += f"=== Side {page_number} ===\n[FEIL: Status {response.status_code}]\n\n"
-        except requests.RequestException:
-            full_doc_text += f"=== Side {page_number} ===\n[FEIL: Nettverksfeil]\n\n"
-    return full_doc_text.strip()
+def fetch_full_document_text(urn, page_ids, workers=None):
+    segments = [""] * len(page_ids)
+    for page_number, segment in iter_document_text(urn, page_ids, workers):
+        segments[page_number - 1] = segment
+    return "".join(segments).strip()
+
+
+register_lru_cache('fetch_alto', _cached_alto)
+register_lru_cache('fetch_alto_page', _cached_alto_page)
+register_lru_cache('fetch_full_document_text', fetch_full_document_text)
+register_stats('singleflight_alto', _alto_flight.stats)
+register_stats('singleflight_alto_page', _page_flight.stats)
@@ -0,0 +1,115 @@
+# export_utils: page_columns, page_record, NpzStream – kolonnevis eksport av parsede ALTO-sider
+import io
+import zipfile
+
+import numpy as np
+
+from alto_utils import REGIONS
+
+
+def _text_column(values):
+    """Strenger som én UTF-8-buffer og int64-forskyvninger: streng i er text[offsets[i]:offsets[i + 1]]."""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def page_columns(page):
+    """Sidens kolonner som navngitte NumPy-matriser, uten objekt-dtype (np.load trenger ikke pickle)."""
+    columns = {
+        'blocks':       page.blocks,
+        'block_region': page.block_region,
+        'lines':        page.lines,
+        'line_block':   page.line_block,
+        'words':        page.words,
+        'word_line':    page.word_line,
+        'word_wc':      page.word_wc,
+    }
+    for name, values in (('block_ids', page.block_ids), ('line_ids', page.line_ids),
+                         ('word_ids', page.word_ids), ('word_content', page.word_content)):
+        columns[f'{name}_text'], columns[f'{name}_offsets'] = _text_column(values)
+    return columns
+
+
+def page_record(page_number, page_id, page):
+    """Én JSONL-linje for siden: de samme kolonnene som flate lister, WC med null der den mangler."""
+    record = {'page': page_number, 'page_id': page_id}
+    if page is None or page.width is None:
+        return {**record, 'missing': True}
+    wc = np.round(page.word_wc.astype(np.float64), 3).tolist()
+    return {
+        **record,
+        'width':        page.width,
+        'height':       page.height,
+        'blocks':       page.blocks.ravel().tolist(),
+        'block_region': page.block_region.tolist(),
+        'block_ids':    page.block_ids,
+        'lines':        page.lines.ravel().tolist(),
+        'line_block':   page.line_block.tolist(),
+        'line_ids':     page.line_ids,
+        'words':        page.words.ravel().tolist(),
+        'word_line':    page.word_line.tolist(),
+        'word_wc':      [None if v != v else v for v in wc],
+        'word_content': page.word_content,
+        'word_ids':     page.word_ids,
+    }
+
+
+class _Chunks(io.RawIOBase):
+    """Skrivbar strøm uten seek som samler det ZipFile skriver, til det hentes med take()."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class NpzStream:
+    """NPZ-fil (ZIP med .npy-medlemmer) som skrives side for side og hentes ut i biter.
+
+    Hver side blir medlemmene p00001/blocks, p00001/words, ... slik at np.load(fil)
+    gir dem som nøkler. Til slutt skrives sideoversikten 'pages' (side, bredde, høyde,
+    antall blokker, linjer og ord; bredde og høyde -1 for sider uten ALTO), 'page_ids'
+    og 'regions'. Bare oversikten holdes i minnet mellom sidene.
+    """
+
+    def __init__(self, compress=True):
+        self._out = _Chunks()
+        self._zip = zipfile.ZipFile(self._out, 'w', zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                                    compresslevel=1 if compress else None)
+        self._pages = []
+
+    def _write(self, name, array):
+        with self._zip.open(f'{name}.npy', 'w') as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+    def add_page(self, page_number, page_id, page):
+        """Skriv sidens kolonner. Returnerer bytene som er klare til å sendes."""
+        if page is None or page.width is None:
+            self._pages.append((page_number, page_id, -1, -1, 0, 0, 0))
+        else:
+            for name, array in page_columns(page).items():
+                self._write(f'p{page_number:05d}/{name}', array)
+            self._pages.append((page_number, page_id, page.width, page.height,
+                                len(page.blocks), len(page.lines), len(page.words)))
+        return self._out.take()
+
+    def finish(self):
+        """Skriv sideoversikten og ZIP-katalogen. Returnerer de siste bytene."""
+        self._pages.sort()
+        self._write('pages', np.array([(n, *rest) for n, _, *rest in self._pages], dtype=np.int32).reshape(-1, 6))
+        self._write('page_ids', np.array([page_id for _, page_id, *_ in self._pages], dtype=str))
+        self._write('regions', np.array(REGIONS))
+        self._zip.close()
+        return self._out.take()
@@ -0,0 +1,15 @@
+# gunicorn.conf.py – gevent-arbeidere som standard
+#
+# Med gevent holder ikke hver SSE-strøm eller hvert kall mot nb.no en egen arbeider:
+# I/O venter i greenlets, og parsing/tegning går til den begrensede CPU-poolen i
+# cpu_utils. Huben svarer på heartbeat selv om strømmene varer lenge, så timeout
+# slår bare til når en arbeider faktisk henger.
+import os
+
+bind               = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers            = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class       = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+timeout            = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout   = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive          = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
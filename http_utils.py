@@ -0,0 +1,147 @@
+# http_utils: http_get, http_stats, paced, NB_API_BASE, NB_IMAGE_BASE – delt HTTP-klient for alle kall mot api.nb.no og www.nb.no
+from contextlib import contextmanager
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from metrics_utils import inc, observe, register_stats
+
+# Basis-URL-er for NB.no. Kan pekes mot en lokal stand-in, f.eks. benchmarks/fixture_server.py
+NB_API_BASE   = os.environ.get('NB_API_BASE', 'https://api.nb.no').rstrip('/')
+NB_IMAGE_BASE = os.environ.get('NB_IMAGE_BASE', 'https://www.nb.no').rstrip('/')
+
+# Maks antall åpne forbindelser per vert, og antall verter det holdes pool for
+POOL_SIZE       = int(os.environ.get('NB_HTTP_POOL_SIZE', 16))
+POOL_HOSTS      = int(os.environ.get('NB_HTTP_POOL_HOSTS', 4))
+CONNECT_TIMEOUT = float(os.environ.get('NB_HTTP_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT    = float(os.environ.get('NB_HTTP_READ_TIMEOUT', 10))
+RETRIES         = int(os.environ.get('NB_HTTP_RETRIES', 2))
+BACKOFF         = float(os.environ.get('NB_HTTP_BACKOFF', 0.3))
+
+# 500 er ikke med: api.nb.no svarer 500 for sider uten ALTO, og det skal ikke prøves på nytt
+RETRY_STATUSES = (502, 503, 504)
+
+_stats = {'requests': 0, 'connections_opened': 0}
+_stats_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+
+# Tempobegrensning for tråden som gjør kallet, satt med paced()
+_pacing = threading.local()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        # Kalles for hver ny socket, også når en frakoblet forbindelse i poolen kobles opp igjen
+        _count('connections_opened')
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        _count('connections_opened')
+        super().connect()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+    def urlopen(self, *args, **kwargs):
+        # Kalles én gang per forsøk, også ved nye forsøk etter Retry
+        _count('requests')
+        return super().urlopen(*args, **kwargs)
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+    def urlopen(self, *args, **kwargs):
+        _count('requests')
+        return super().urlopen(*args, **kwargs)
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http':  _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+def _new_session():
+    retry = Retry(
+        total=RETRIES, connect=RETRIES, read=RETRIES, status=RETRIES,
+        backoff_factor=BACKOFF, status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET'}), raise_on_status=False,
+    )
+    adapter = _PooledAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _new_session()
+    return _session
+
+
+def http_get(url, timeout=None, **kwargs):
+    """GET via den delte sesjonen. timeout er lesetimeout i sekunder; tilkoblingstimeout er felles."""
+    throttle = getattr(_pacing, 'throttle', None)
+    if throttle is not None:
+        throttle()
+    host = urlsplit(url).netloc
+    start = time.perf_counter()
+    try:
+        response = _get_session().get(url, timeout=(CONNECT_TIMEOUT, timeout or READ_TIMEOUT), **kwargs)
+    except requests.RequestException:
+        inc('alto_upstream_responses_total', host=host, status='error')
+        raise
+    finally:
+        observe('alto_upstream_seconds', time.perf_counter() - start, host=host)
+    inc('alto_upstream_responses_total', host=host, status=response.status_code)
+    return response
+
+
+@contextmanager
+def paced(throttle):
+    """Kall throttle() før hver forespørsel denne tråden gjør mot nb.no inne i blokken.
+
+    Cachetreff går ikke via http_get og teller derfor ikke.
+    """
+    previous = getattr(_pacing, 'throttle', None)
+    _pacing.throttle = throttle
+    try:
+        yield
+    finally:
+        _pacing.throttle = previous
+
+
+def http_stats():
+    """Antall forespørsler og forbindelser åpnet mot gjenbrukt siden oppstart."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['connections_reused'] = max(0, stats['requests'] - stats['connections_opened'])
+    return stats
+
+
+register_stats('http', http_stats)
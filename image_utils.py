@@ -1,14 +1,17 @@
-# image_utils: fetch_image, plot_alto
+# image_utils: fetch_image, fetch_image_bytes, fetch_tile_bytes, iiif_image_url, plot_alto, render_overlay
 import io
 import base64
-from functools import lru_cache
+import os
 
+import numpy as np
 import requests
-from PIL import Image
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from alto_utils import REGION_PRINTSPACE, REGION_TOPMARGIN, REGION_BOTTOMMARGIN
+from cache_utils import IMAGE_TTL, ByteLRUCache, SingleFlight, get_shared_cache, image_key
+from http_utils import NB_IMAGE_BASE, http_get
+from metrics_utils import register_stats, stage, timed_stage
+from spatial_utils import GridIndex
 
 
 def fetch_image_from_url(url):
@@ -21,7 +24,7 @@ def fetch_image_from_url(url):
     if m and int(m.group(1)) > 60:
         display_url = re.sub(r'/pct:\d+/', '/pct:50/', url)
     try:
-        response = requests.get(display_url, timeout=15)
+        response = http_get(display_url, timeout=15)
         if response.status_code == 200:
             return Image.open(io.BytesIO(response.content))
     except requests.RequestException:
@@ -29,63 +32,409 @@ def fetch_image_from_url(url):
     return None
 
 
-@lru_cache(maxsize=64)
+def iiif_image_url(page_id, scale=0.5, width=None):
+    """IIIF-URL for hele siden, skalert med scale eller til en fast bredde i piksler."""
+    size = f"{width}," if width else f"pct:{int(scale * 100)}"
+    return f"{NB_IMAGE_BASE}/services/image/resolver/{page_id}/full/{size}/0/native.jpg"
+
+
+def iiif_region_url(page_id, region, width):
+    """IIIF-URL for en region (x, y, w, h) i fullt oppløst bilde, levert width piksler bred."""
+    x, y, w, h = region
+    return f"{NB_IMAGE_BASE}/services/image/resolver/{page_id}/{x},{y},{w},{h}/{width},/0/native.jpg"
+
+
+# Komprimerte JPEG-bytes holdes i minnet innenfor et fast budsjett; bildene dekodes ved bruk
+IMAGE_CACHE_MB = int(os.environ.get('ALTO_IMAGE_CACHE_MB', 64))
+_image_cache = ByteLRUCache(IMAGE_CACHE_MB * 1024 * 1024)
+_image_flight = SingleFlight()
+
+
+def fetch_image_bytes(page_id, scale=0.5, width=None):
+    """JPEG-bytes for siden fra IIIF, via minnecachen og den delte cachen. None ved feil."""
+    key = image_key(page_id, f"w{width}" if width else scale)
+    return _cached_image(key, iiif_image_url(page_id, scale, width), 'image_fetch')
+
+
+def fetch_tile_bytes(page_id, region, width):
+    """JPEG-bytes for én IIIF-flis (region i fullt oppløst bilde, levert width piksler bred).
+
+    Flisene caches som sidebildene, per side, region og størrelse; det vil si per
+    (side, zoomnivå, flis) for et gitt flisrutenett.
+    """
+    key = image_key(page_id, "r{},{},{},{}/w{}".format(*region, width))
+    return _cached_image(key, iiif_region_url(page_id, region, width), 'tile_fetch')
+
+
+def _cached_image(key, url, stage_name):
+    data = _image_cache.get(key)
+    if data is not None:
+        return data
+    return _image_flight.do(key, _fetch_image_upstream, url, key, stage_name)
+
+
+def _fetch_image_upstream(url, key, stage_name):
+    shared = get_shared_cache()
+    data = shared.get(key)
+    if data is None:
+        try:
+            with stage(stage_name):
+                response = http_get(url, timeout=15)
+            if response.status_code != 200:
+                return None
+            data = response.content
+            shared.set(key, data, ttl=IMAGE_TTL)
+        except requests.RequestException:
+            return None
+    _image_cache.set(key, data)
+    return data
+
+
 def fetch_image(page_id, scale=0.5):
-    url = f"https://www.nb.no/services/image/resolver/{page_id}/full/pct:{int(scale * 100)}/0/native.jpg"
-    try:
-        response = requests.get(url, timeout=15)
-        if response.status_code == 200:
-            return Image.open(io.BytesIO(response.content))
-    except requests.RequestException:
-        pass
-    return None
+    return decode_image(fetch_image_bytes(page_id, scale))
+
+
+@timed_stage('decode')
+def decode_image(data):
+    if data is None:
+        return None
+    image = Image.open(io.BytesIO(data))
+    # Dekod med en gang, så tiden havner her og ikke i tegnetrinnet
+    image.load()
+    return image
+
+
+def image_cache_stats():
+    """Minnebruk og treffrate for bildecachen."""
+    return _image_cache.stats()
+
+
+register_stats('image_cache', image_cache_stats)
+register_stats('singleflight_image', _image_flight.stats)
+
+
+# Kantfarge og eventuell merkelapp per regionkode; andre elementer bruker visningens farge.
+_REGION_STYLE = {
+    REGION_PRINTSPACE:   ("red",    None),
+    REGION_TOPMARGIN:    ("orange", "TopMargin"),
+    REGION_BOTTOMMARGIN: ("gray",   "BottomMargin"),
+}
+
+# 'pil' tegner direkte i sidebildet; 'matplotlib' er den gamle figurbaserte rendereren.
+RENDER_ENGINE = os.environ.get('ALTO_RENDER_ENGINE', 'pil')
+PNG_COMPRESS_LEVEL = int(os.environ.get('ALTO_PNG_COMPRESS_LEVEL', 3))
 
+# Konfidensvisningen: WC-verdier og farger som fargeskalaen interpoleres mellom (rød – oransje – grønn,
+# samme grenser som WC-merket i klienten), og terskelen under som ord fylles sterkere og får kant
+_WC_STOPS  = np.array([0.0, 0.7, 0.9, 1.0])
+_WC_COLORS = np.array([(192, 57, 43), (230, 140, 0), (140, 180, 60), (42, 122, 42)], dtype=np.float64)
+_WC_MISSING = (150, 150, 150)
+WC_THRESHOLD = float(os.environ.get('ALTO_WC_THRESHOLD', 0.7))
 
-def plot_alto(image, alto_width, alto_height, elements, color="red", show_numbers=False):
-    """Render ALTO overlay on image and return a base64-encoded PNG string."""
+# Utdataformat for overlegg og tilhørende MIME-type
+OVERLAY_FORMATS = {
+    'png':  'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+def plot_alto(image, alto_width, alto_height, boxes, color="red", regions=None, show_numbers=False, engine=None,
+              wc=None, threshold=WC_THRESHOLD):
+    """Render ALTO overlay on image and return a base64-encoded PNG string.
+
+    boxes is an (n, 4) array of (x, y, w, h) in ALTO coordinates, regions an
+    optional array of region codes (see alto_utils.REGIONS) per box. Block
+    numbers are the box index + 1. With wc (one WC per box) the boxes are filled
+    as a confidence heatmap instead (see render_overlay).
+    """
+    data = plot_alto_bytes(image, alto_width, alto_height, boxes, color, regions, show_numbers, engine=engine,
+                           wc=wc, threshold=threshold)
+    if data is None:
+        return None
+    with stage('base64'):
+        return base64.b64encode(data).decode()
+
+
+def plot_alto_bytes(image, alto_width, alto_height, boxes, color="red", regions=None, show_numbers=False,
+                    fmt='png', quality=80, engine=None, wc=None, threshold=WC_THRESHOLD):
+    """Som plot_alto, men returnerer det kodede bildet som bytes i formatet fmt (se OVERLAY_FORMATS)."""
     if image is None or alto_width is None or alto_height is None:
         return None
 
+    # Konfidensvisningen finnes bare i PIL-rendereren
+    if (engine or RENDER_ENGINE) == 'matplotlib' and wc is None:
+        data = _plot_alto_matplotlib(image, alto_width, alto_height, boxes, color, regions, show_numbers)
+        return data if fmt == 'png' else encode_image(Image.open(io.BytesIO(data)), fmt, quality)
+
+    overlay = render_overlay(image, alto_width, alto_height, boxes, color, regions, show_numbers,
+                             wc=wc, threshold=threshold)
+    return encode_image(overlay, fmt, quality)
+
+
+@timed_stage('encode')
+def encode_image(image, fmt='png', quality=80):
+    buf = io.BytesIO()
+    if fmt == 'png':
+        image.save(buf, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    elif fmt == 'webp':
+        image.convert('RGB').save(buf, format='WEBP', quality=quality)
+    elif fmt == 'jpeg':
+        image.convert('RGB').save(buf, format='JPEG', quality=quality)
+    else:
+        raise ValueError(f"Ukjent bildeformat: {fmt}")
+    return buf.getvalue()
+
+
+@timed_stage('draw')
+def render_overlay(image, alto_width, alto_height, boxes, color="red", regions=None, show_numbers=False, tags=True,
+                   numbers=None, wc=None, threshold=WC_THRESHOLD, open_edges=False):
+    """Tegn ALTO-elementene rett inn i sidebildet i original oppløsning. Returnerer et RGB-bilde.
+
+    tags=False dropper margmerkene, f.eks. for miniatyrer der de ikke er lesbare.
+    numbers er blokknumrene som vises når boxes bare er et utsnitt (standard: indeks + 1).
+    Med wc (én WC per boks, NaN der den mangler) fylles boksene etter konfidens, og
+    bare boksene med WC under threshold får kant i color. open_edges=True er for fliser:
+    se draw_boxes.
+    """
+    page = image.convert('RGB')
+    img_width, img_height = page.size
+    scale = np.array([img_width / alto_width, img_height / alto_height] * 2)
+    xywh = np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * scale
+    if not len(xywh):
+        return page
+
+    # Hjørner i pikselkoordinater, som Rectangle((x, y), w, h) i matplotlib
+    corners = np.rint(np.column_stack([xywh[:, 0], xywh[:, 1],
+                                       xywh[:, 0] + xywh[:, 2], xywh[:, 1] + xywh[:, 3]])).astype(np.int64)
+    palette = [ImageColor.getrgb(color)]
+    codes = np.zeros(len(corners), dtype=np.intp)
+    if regions is not None:
+        for code, (edgecolor, _) in _REGION_STYLE.items():
+            palette.append(ImageColor.getrgb(edgecolor))
+            codes[np.asarray(regions) == code] = len(palette) - 1
+    colors = np.array(palette, dtype=np.uint8)[codes]
+
+    pixels = np.array(page)
+    if wc is not None:
+        wc = np.asarray(wc, dtype=np.float64)
+        low = wc < threshold
+        fill_boxes(pixels, corners, wc_colors(wc), np.where(low, 0.55, 0.3))
+        corners, colors = corners[low], colors[low]
+    # Kanten rundt ord under terskelen holdes tynn, så fyllfargen synes også i små bokser
+    draw_boxes(pixels, corners, colors, width=1 if wc is not None else max(1, round(img_height / 700)),
+               open_edges=open_edges)
+    page = Image.fromarray(pixels)
+
+    if show_numbers or (tags and regions is not None):
+        _draw_labels(page, xywh, regions if tags else None, show_numbers, numbers)
+    return page
+
+
+def contact_sheet(thumbnails, cell_width, columns=10):
+    """Sett miniatyrer sammen til ett kontaktark. thumbnails er [(etikett, bilde eller None)]."""
+    heights = [img.size[1] for _, img in thumbnails if img is not None]
+    cell_height = max(heights) if heights else round(cell_width * 1.5)
+    gap = 4
+    columns = max(1, min(columns, len(thumbnails)))
+    rows = -(-len(thumbnails) // columns)
+    sheet = Image.new('RGB', (columns * (cell_width + gap) + gap, rows * (cell_height + gap) + gap), (245, 245, 245))
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=max(10, cell_width // 12))
+
+    for i, (label, img) in enumerate(thumbnails):
+        x = gap + (i % columns) * (cell_width + gap)
+        y = gap + (i // columns) * (cell_height + gap)
+        if img is None:
+            draw.rectangle((x, y, x + cell_width - 1, y + cell_height - 1), fill=(210, 210, 210))
+        else:
+            sheet.paste(img.convert('RGB'), (x, y))
+        bbox = draw.textbbox((x + 3, y + 3), label, font=font)
+        draw.rectangle(_pad(bbox, 2), fill=(0, 0, 0))
+        draw.text((x + 3, y + 3), label, font=font, fill=(255, 255, 0))
+    return sheet
+
+
+def draw_boxes(pixels, corners, colors, width=1, open_edges=False):
+    """Tegn rektangelkanter for alle boksene på én gang i et (h, w, 3) uint8-array.
+
+    corners er (n, 4) med (x0, y0, x1, y1) i piksler, colors (n, 3) uint8.
+    Senere bokser tegnes over tidligere, som i matplotlib. Kanter utenfor bildet
+    klippes til bildekanten; med open_edges=True tegnes de ikke i det hele tatt,
+    så bokser som krysser en flisgrense blir åpne der.
+    """
+    height, width_px = pixels.shape[:2]
+    inside = ((corners[:, 2] >= 0) & (corners[:, 0] < width_px) &
+              (corners[:, 3] >= 0) & (corners[:, 1] < height))
+    corners, colors = corners[inside], colors[inside]
+    if not len(corners):
+        return
+    x0 = np.clip(corners[:, 0], 0, width_px - 1)
+    x1 = np.clip(corners[:, 2], 0, width_px - 1)
+    y0 = np.clip(corners[:, 1], 0, height - 1)
+    y1 = np.clip(corners[:, 3], 0, height - 1)
+    if open_edges:
+        top, bottom = corners[:, 1] >= 0, corners[:, 3] < height
+        left, right = corners[:, 0] >= 0, corners[:, 2] < width_px
+    else:
+        top = bottom = left = right = np.ones(len(corners), dtype=bool)
+
+    for t in range(width):
+        _hlines(pixels, np.minimum(y0 + t, y1)[top], x0[top], x1[top], colors[top])
+        _hlines(pixels, np.maximum(y1 - t, y0)[bottom], x0[bottom], x1[bottom], colors[bottom])
+        _vlines(pixels, np.minimum(x0 + t, x1)[left], y0[left], y1[left], colors[left])
+        _vlines(pixels, np.maximum(x1 - t, x0)[right], y0[right], y1[right], colors[right])
+
+
+def wc_colors(wc):
+    """Fargen for hver WC-verdi som (n, 3) uint8, interpolert langs fargeskalaen i ett pass. NaN blir grå."""
+    wc = np.asarray(wc, dtype=np.float64)
+    missing = np.isnan(wc)
+    values = np.clip(np.where(missing, 0.0, wc), 0.0, 1.0)
+    colors = np.column_stack([np.interp(values, _WC_STOPS, _WC_COLORS[:, c]) for c in range(3)])
+    colors[missing] = _WC_MISSING
+    return np.rint(colors).astype(np.uint8)
+
+
+# Bitene i differansematrisen som holder boksnummeret (høyst ~1 million bokser per bilde)
+_LABEL_BITS = 20
+
+
+def fill_boxes(pixels, corners, colors, alpha):
+    """Fyll alle boksene halvgjennomsiktig på én gang i et (h, w, 3) uint8-array.
+
+    corners er (n, 4) med (x0, y0, x1, y1) i piksler der x1 og y1 ikke er med, så
+    bokser som bare grenser mot hverandre ikke overlapper. colors er (n, 3) uint8 og
+    alpha (n,) mellom 0 og 1. Boksnummeret legges inn i hjørnene av en differansematrise,
+    og to kumulative summer gir hvilken boks som dekker hver piksel; fargen slås så opp
+    for alle piksler samtidig. Der bokser overlapper, brukes snittet av blandingene.
+    """
+    height, width = pixels.shape[:2]
+    x0 = np.clip(corners[:, 0], 0, width)
+    x1 = np.clip(corners[:, 2], 0, width)
+    y0 = np.clip(corners[:, 1], 0, height)
+    y1 = np.clip(corners[:, 3], 0, height)
+    keep = np.flatnonzero((x1 > x0) & (y1 > y0))
+    if not len(keep):
+        return
+    x0, x1, y0, y1 = x0[keep], x1[keep], y0[keep], y1[keep]
+
+    # Boksnummer + 1 i de nederste _LABEL_BITS bitene og antall bokser over dem
+    value = np.arange(1, len(keep) + 1, dtype=np.int32) + (1 << _LABEL_BITS)
+    acc = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.add.at(acc, (y0, x0), value)
+    np.add.at(acc, (y0, x1), -value)
+    np.add.at(acc, (y1, x0), -value)
+    np.add.at(acc, (y1, x1), value)
+    np.add.accumulate(acc, axis=0, out=acc)
+    np.add.accumulate(acc, axis=1, out=acc)
+    acc = acc[:height, :width]
+    label = acc & ((1 << _LABEL_BITS) - 1)
+    overlap = np.nonzero(acc >= (2 << _LABEL_BITS))
+    label[overlap] = 0
+
+    # Farge × alfa og 1 − alfa per boks, alfa i 1/64; rad 0 er ingen boks
+    a = np.zeros(len(keep) + 1, dtype=np.uint16)
+    a[1:] = np.rint(np.broadcast_to(alpha, corners[:, 0].shape)[keep] * 64)
+    premultiplied = np.zeros((len(keep) + 1, 3), dtype=np.uint16)
+    premultiplied[1:] = colors[keep] * a[1:, None]
+    blended = pixels * np.take(64 - a, label)[..., None]
+    blended += np.take(premultiplied, label, axis=0)
+    blended >>= 6
+
+    if len(overlap[0]):
+        ys, xs = overlap
+        boxes = np.column_stack([x0, y0, x1 - x0, y1 - y0])
+        point, box = GridIndex(boxes, width, height).query_rects(np.column_stack([xs, ys, np.ones_like(xs),
+                                                                                  np.ones_like(ys)]))
+        mixed = pixels[ys[point], xs[point]].astype(np.float64) * (64 - a[box + 1, None]) + premultiplied[box + 1]
+        total = np.column_stack([np.bincount(point, mixed[:, c], minlength=len(ys)) for c in range(3)])
+        blended[ys, xs] = np.rint(total / (64 * np.bincount(point, minlength=len(ys))[:, None]))
+    pixels[...] = blended
+
+
+def _spans(start, stop):
+    """Alle heltall i [start, stop] for hver rad, konkatenert, og lengden per rad."""
+    lengths = stop - start + 1
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(start, lengths) + offsets, lengths
+
+
+def _hlines(pixels, y, x0, x1, colors):
+    xs, lengths = _spans(x0, x1)
+    pixels[np.repeat(y, lengths), xs] = np.repeat(colors, lengths, axis=0)
+
+
+def _vlines(pixels, x, y0, y1, colors):
+    ys, lengths = _spans(y0, y1)
+    pixels[ys, np.repeat(x, lengths)] = np.repeat(colors, lengths, axis=0)
+
+
+def _draw_labels(page, xywh, regions, show_numbers, numbers=None):
+    """Blokknumre (gult på halvgjennomsiktig svart) og margmerker, som i matplotlib-versjonen."""
+    img_height = page.size[1]
+    number_font = ImageFont.load_default(size=max(10, round(img_height * 0.015)))
+    tag_font = ImageFont.load_default(size=max(8, round(img_height * 0.012)))
+    layer = Image.new('RGBA', page.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    region_codes = regions.tolist() if regions is not None else [None] * len(xywh)
+    numbers = range(1, len(xywh) + 1) if numbers is None else numbers
+
+    for num, (x, y, w, h), region in zip(numbers, xywh.tolist(), region_codes):
+        if show_numbers:
+            cx, cy = x + w / 2, y + h / 2
+            bbox = draw.textbbox((cx, cy), str(num), font=number_font, anchor='mm')
+            draw.rectangle(_pad(bbox, 3), fill=(0, 0, 0, 128))
+            draw.text((cx, cy), str(num), font=number_font, anchor='mm', fill=(255, 255, 0, 255))
+
+        edgecolor, tag = _REGION_STYLE.get(region, (None, None))
+        if tag:
+            bbox = draw.textbbox((x + 2, y + 2), tag, font=tag_font, anchor='la')
+            draw.rectangle(_pad(bbox, 2), fill=(255, 255, 255, 179))
+            draw.text((x + 2, y + 2), tag, font=tag_font, anchor='la', fill=ImageColor.getrgb(edgecolor) + (255,))
+
+    page.paste(layer, (0, 0), layer)
+
+
+def _pad(bbox, pad):
+    x0, y0, x1, y1 = bbox
+    return x0 - pad, y0 - pad, x1 + pad, y1 + pad
+
+
+@timed_stage('matplotlib')
+def _plot_alto_matplotlib(image, alto_width, alto_height, boxes, color, regions, show_numbers):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+
     fig, ax = plt.subplots(figsize=(10, 12))
     ax.imshow(image, cmap='gray')
     img_width, img_height = image.size
     scale_x = img_width / alto_width
     scale_y = img_height / alto_height
+    scaled = (np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * [scale_x, scale_y, scale_x, scale_y]).tolist()
+    region_codes = regions.tolist() if regions is not None else [None] * len(scaled)
 
-    for element in elements:
-        x, y, w, h = element[:4]
-        num = element[4] if len(element) > 4 else None
-        region = element[5] if len(element) > 5 else None
-
-        if region == "PrintSpace":
-            edgecolor = "red"
-            tag = None
-        elif region == "TopMargin":
-            edgecolor = "orange"
-            tag = "TopMargin"
-        elif region == "BottomMargin":
-            edgecolor = "gray"
-            tag = "BottomMargin"
-        else:
-            edgecolor = color
-            tag = None
+    for num, ((x, y, w, h), region) in enumerate(zip(scaled, region_codes), 1):
+        edgecolor, tag = _REGION_STYLE.get(region, (color, None))
 
         rect = patches.Rectangle(
-            (x * scale_x, y * scale_y), w * scale_x, h * scale_y,
+            (x, y), w, h,
             linewidth=1, edgecolor=edgecolor, facecolor='none'
         )
         ax.add_patch(rect)
 
-        if show_numbers and num is not None:
+        if show_numbers:
             ax.text(
-                (x + w / 2) * scale_x, (y + h / 2) * scale_y, str(num),
+                x + w / 2, y + h / 2, str(num),
                 color='yellow', fontsize=10, ha='center', va='center',
                 bbox=dict(facecolor='black', alpha=0.5, edgecolor='none')
             )
 
         if tag:
             ax.text(
-                x * scale_x + 2, y * scale_y + 2, tag,
+                x + 2, y + 2, tag,
                 color=edgecolor, fontsize=8, ha='left', va='top',
                 bbox=dict(facecolor='white', alpha=0.7, edgecolor='none', boxstyle='round,pad=0.1')
             )
@@ -96,5 +445,4 @@ def plot_alto(image, alto_width, alto_height, elements, color="red", show_number
     buf = io.BytesIO()
     fig.savefig(buf, format='png', bbox_inches='tight', pad_inches=0)
     plt.close(fig)
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode()
+    return buf.getvalue()
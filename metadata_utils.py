@@ -1,23 +1,54 @@
-# metadata_utils: fetch_iiif_manifest, get_page_list, get_metadata, extract_urn_or_lookup
+# metadata_utils: fetch_iiif_manifest, fetch_image_info, get_page_list, get_metadata, extract_urn_or_lookup
 from functools import lru_cache
 import json
 import re
 
 import requests
 
+from cache_utils import (IMAGE_TTL, MANIFEST_TTL, METADATA_TTL, SingleFlight, get_shared_cache, image_info_key,
+                         manifest_key, metadata_key)
+from http_utils import NB_API_BASE, NB_IMAGE_BASE, http_get
+from metrics_utils import register_lru_cache, register_stats, stage
 
-@lru_cache(maxsize=128)
-def fetch_iiif_manifest(urn):
-    url = f"https://api.nb.no/catalog/v1/iiif/{urn}/manifest"
+# Samtidige kall for samme manifest eller metadata venter på én henting
+_json_flight = SingleFlight()
+
+
+def _fetch_json(url, key, ttl, stage_name):
+    """Hent JSON via den delte cachen; None ved feil. stage_name er trinnet kallet måles som."""
+    cached = get_shared_cache().get(key)
+    if cached is not None:
+        return json.loads(cached)
+    return _json_flight.do(key, _fetch_json_upstream, url, key, ttl, stage_name)
+
+
+def _fetch_json_upstream(url, key, ttl, stage_name):
+    cache = get_shared_cache()
     try:
-        response = requests.get(url, timeout=10)
+        with stage(stage_name):
+            response = http_get(url)
         if response.status_code == 200:
-            return response.json()
-    except requests.RequestException:
+            data = response.json()
+            cache.set(key, json.dumps(data).encode('utf-8'), ttl=ttl)
+            return data
+    except (requests.RequestException, ValueError):
         pass
     return None
 
 
+@lru_cache(maxsize=128)
+def fetch_iiif_manifest(urn):
+    url = f"{NB_API_BASE}/catalog/v1/iiif/{urn}/manifest"
+    return _fetch_json(url, manifest_key(urn), MANIFEST_TTL, 'manifest_fetch')
+
+
+@lru_cache(maxsize=512)
+def fetch_image_info(page_id):
+    """IIIF info.json for sidebildet: full størrelse og flisoppsett. None ved feil."""
+    url = f"{NB_IMAGE_BASE}/services/image/resolver/{page_id}/info.json"
+    return _fetch_json(url, image_info_key(page_id), IMAGE_TTL, 'image_info_fetch')
+
+
 def get_page_list(manifest):
     """Returns (labels, page_ids) where page_ids are extracted from IIIF canvas IDs."""
     if not manifest:
@@ -33,14 +64,8 @@ def get_page_list(manifest):
 
 @lru_cache(maxsize=128)
 def _fetch_metadata(urn):
-    url = f"https://api.nb.no/catalog/v1/items/{urn}"
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-    except requests.RequestException:
-        pass
-    return None
+    url = f"{NB_API_BASE}/catalog/v1/items/{urn}"
+    return _fetch_json(url, metadata_key(urn), METADATA_TTL, 'metadata_fetch')
 
 
 def get_metadata(urn):
@@ -66,9 +91,9 @@ def extract_urn_or_lookup(input_str):
     id_match = re.search(r"/items/([a-f0-9]{32})", input_str)
     if id_match:
         doc_id = id_match.group(1)
-        url = f"https://api.nb.no/catalog/v1/items/{doc_id}"
+        url = f"{NB_API_BASE}/catalog/v1/items/{doc_id}"
         try:
-            response = requests.get(url, timeout=10)
+            response = http_get(url)
             if response.status_code == 200:
                 flat_json = json.dumps(response.json())
                 urn_fallback = re.search(r"URN:NBN:[^\s\",]+", flat_json)
@@ -80,3 +105,9 @@ def extract_urn_or_lookup(input_str):
             pass
 
     return None
+
+
+register_lru_cache('fetch_iiif_manifest', fetch_iiif_manifest)
+register_lru_cache('fetch_metadata', _fetch_metadata)
+register_lru_cache('fetch_image_info', fetch_image_info)
+register_stats('singleflight_json', _json_flight.stats)
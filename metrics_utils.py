@@ -0,0 +1,202 @@
+# metrics_utils: stage, timed_stage, stage_timings, observe, inc, track_stream, render_metrics
+#
+# Trinn måles med stage('navn') eller @timed_stage('navn'). Varigheten havner i histogrammet
+# alto_stage_seconds og, hvis en forespørsel er i gang i samme kontekst, i forespørselens
+# egne timinger som app.py sender som Server-Timing. /metrics leses i Prometheus-tekstformat.
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+import math
+import threading
+import time
+
+# Bøttegrenser i sekunder, fra cachetreff til trege kall mot nb.no
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_HELP = {
+    'alto_stage_seconds':            ('histogram', 'Tid per behandlingstrinn'),
+    'alto_request_seconds':          ('histogram', 'Tid per forespørsel til svaret starter'),
+    'alto_upstream_seconds':         ('histogram', 'Tid per kall mot nb.no'),
+    'alto_upstream_responses_total': ('counter',   'Svar fra nb.no per vert og statuskode'),
+    'alto_sse_streams_in_flight':    ('gauge',     'Strømmende svar som er i gang'),
+}
+
+_lock = threading.Lock()
+_histograms = {}   # (navn, etiketter) -> [tellinger per bøtte, sum, antall]
+_counters = {}     # (navn, etiketter) -> verdi
+_gauges = {}
+_lru_caches = {}   # navn -> funksjon med cache_info()
+_stats_sources = {}  # navn -> funksjon som returnerer {nøkkel: tall}
+
+# Timinger for forespørselen som behandles i denne konteksten: {trinn: ms}
+_request_timings = ContextVar('alto_request_timings', default=None)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[0][i] += 1
+                break
+        hist[1] += seconds
+        hist[2] += 1
+
+
+def inc(name, amount=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def gauge_add(name, delta, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+
+# ── Trinn og forespørsler ────────────────────────────────────────────────────
+
+def begin_request():
+    """Start nye timinger for forespørselen i denne konteksten (tråd eller greenlet)."""
+    _request_timings.set({})
+
+
+def stage_timings():
+    """Summert tid i ms per trinn for forespørselen i denne konteksten."""
+    return dict(_request_timings.get() or {})
+
+
+def _record_stage(name, seconds):
+    observe('alto_stage_seconds', seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds * 1000
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(name, time.perf_counter() - start)
+
+
+def timed_stage(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record_stage(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def submit_in_context(pool, fn, *args):
+    """pool.submit som tar med konteksten, så trinn i arbeidertråden telles på forespørselen."""
+    return pool.submit(copy_context().run, fn, *args)
+
+
+def track_stream(name, iterable):
+    """Tell et strømmende svar som pågående til klienten har fått alt eller koblet fra."""
+    gauge_add('alto_sse_streams_in_flight', 1, endpoint=name)
+    try:
+        yield from iterable
+    finally:
+        gauge_add('alto_sse_streams_in_flight', -1, endpoint=name)
+
+
+# ── Registrering av cacher og andre kilder ───────────────────────────────────
+
+def register_lru_cache(name, fn):
+    """Eksporter treff, bom og størrelse for en functools.lru_cache-funksjon."""
+    _lru_caches[name] = fn
+
+
+def register_stats(name, source):
+    """Eksporter tallene fra source() som alto_<name>_<nøkkel>."""
+    _stats_sources[name] = source
+
+
+# ── Prometheus-tekstformat ───────────────────────────────────────────────────
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(lines, name, kind, help_text):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render_metrics():
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    seen = set()
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        if name not in seen:
+            seen.add(name)
+            _header(lines, name, *_HELP.get(name, ('histogram', name)))
+        cumulative = 0
+        for bound, n in zip(BUCKETS, buckets):
+            cumulative += n
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total!r}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+
+    for metrics in (counters, gauges):
+        for (name, labels), value in sorted(metrics.items()):
+            if name not in seen:
+                seen.add(name)
+                _header(lines, name, *_HELP.get(name, ('gauge' if metrics is gauges else 'counter', name)))
+            lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+
+    if _lru_caches:
+        infos = {name: fn.cache_info() for name, fn in sorted(_lru_caches.items())}
+        for field, kind, help_text in (('hits', 'counter', 'Treff i lru_cache'),
+                                       ('misses', 'counter', 'Bom i lru_cache'),
+                                       ('currsize', 'gauge', 'Elementer i lru_cache'),
+                                       ('maxsize', 'gauge', 'Maks elementer i lru_cache')):
+            suffix = '_total' if kind == 'counter' else ''
+            metric = f"alto_lru_cache_{field}{suffix}"
+            _header(lines, metric, kind, help_text)
+            for name, info in infos.items():
+                lines.append(f"{metric}{_fmt_labels([('cache', name)])} {_fmt_value(getattr(info, field))}")
+
+    for source_name, source in sorted(_stats_sources.items()):
+        for key, value in sorted(source().items()):
+            if isinstance(value, (int, float)) or value is None:
+                metric = f"alto_{source_name}_{key}"
+                _header(lines, metric, 'gauge', f"{source_name}: {key}")
+                lines.append(f"{metric} {_fmt_value(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,89 @@
+# prefetch_utils: Prefetcher – varmer opp nabosidene i bakgrunnen
+from collections import OrderedDict, deque
+import threading
+import time
+
+from http_utils import paced
+
+
+class Prefetcher:
+    """Kjører warm(urn, page_id) for nabosidene til siden brukeren nettopp så på.
+
+    Køen er liten og kaster de eldste oppgavene når den er full. Hver eier
+    (f.eks. klient + dokument) har en generasjon; når eieren ber om en ny
+    side, blir oppgaver fra tidligere generasjoner hoppet over. Hver forespørsel
+    mot nb.no fra forhåndshentingen (ALTO, bilde, manifest) begrenses til rate
+    per sekund for hele prosessen, så forhåndshenting aldri presser nb.no hardere
+    enn det; sider som allerede er cachet, koster ingenting.
+    """
+
+    def __init__(self, warm, neighbours, queue_size=8, rate=2.0, max_owners=1024):
+        self._warm = warm
+        self._neighbours = neighbours
+        self._queue = deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+        self._generations = OrderedDict()
+        self._max_owners = max_owners
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._thread = None
+        self.stats = {'scheduled': 0, 'warmed': 0, 'stale': 0, 'dropped': 0, 'failed': 0}
+
+    def schedule(self, owner, urn, page_id):
+        """Legg inn forhåndshenting rundt page_id og gjør eldre oppgaver for samme eier utdaterte."""
+        with self._cond:
+            generation = self._generations.pop(owner, 0) + 1
+            self._generations[owner] = generation
+            while len(self._generations) > self._max_owners:
+                self._generations.popitem(last=False)
+            if len(self._queue) == self._queue.maxlen:
+                self.stats['dropped'] += 1
+            self._queue.append((owner, generation, urn, page_id))
+            self.stats['scheduled'] += 1
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        # Startes ved første bruk, slik at hver gunicorn-arbeider får sin egen tråd etter fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+            self._thread.start()
+
+    def _current(self, owner, generation):
+        with self._cond:
+            return self._generations.get(owner) == generation
+
+    def _run(self):
+        with paced(self._throttle):
+            self._loop()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                owner, generation, urn, page_id = self._queue.popleft()
+            if not self._current(owner, generation):
+                self.stats['stale'] += 1
+                continue
+            try:
+                targets = self._neighbours(urn, page_id)
+            except Exception:
+                self.stats['failed'] += 1
+                continue
+            for target in targets:
+                if not self._current(owner, generation):
+                    self.stats['stale'] += 1
+                    break
+                try:
+                    self._warm(urn, target)
+                    self.stats['warmed'] += 1
+                except Exception:
+                    self.stats['failed'] += 1
+
+    def _throttle(self):
+        now = time.monotonic()
+        wait = self._next_slot - now
+        if wait > 0:
+            time.sleep(wait)
+        self._next_slot = max(now, self._next_slot) + self._interval
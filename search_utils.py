@@ -0,0 +1,217 @@
+# search_utils: normalize, tokenize, DocumentIndex, IndexCache
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+# Omtrentlig kostnad i byte for hvert nytt ord i indeksen (ordbokoppføring, str og array)
+_TOKEN_OVERHEAD = 200
+
+# Bokstaver og sifre; bindestrek og apostrof inne i ord beholdes ("Bjørnstjerne-Bjørnson", "o'")
+_TOKEN_RE = re.compile(r"\w+(?:[-'’]\w+)*")
+
+
+def normalize(word):
+    """Normalisert søkeform: NFKC, små bokstaver, uten tegnsetting rundt ordet. '' hvis ingenting er igjen."""
+    match = _TOKEN_RE.search(unicodedata.normalize('NFKC', word).casefold())
+    return match.group(0).replace('’', "'") if match else ''
+
+
+def tokenize(query):
+    """Søkestrengen som normaliserte ord. Et ord som slutter på * er et prefikssøk."""
+    tokens = []
+    for part in query.split():
+        prefix = part.endswith('*')
+        token = normalize(part.rstrip('*'))
+        if token:
+            tokens.append((token, prefix))
+    return tokens
+
+
+class DocumentIndex:
+    """Invertert ordindeks for ett dokument: normalisert ord -> (side, ordindeks).
+
+    Sidene legges til etter hvert som de hentes, og søk kan gjøres underveis.
+    Ordboksene beholdes per side som int32-matriser (de samme som AltoPage.words),
+    så et treff kan slås opp til (x, y, w, h) uten å hente siden på nytt.
+    nbytes er et løpende anslag over minnet indeksen bruker.
+    """
+
+    def __init__(self, page_ids):
+        self.page_ids = list(page_ids)
+        self.indexed = 0
+        self.nbytes = 0
+        self.complete = False
+        self.failed = False
+        self.truncated = False
+        self.cancelled = threading.Event()
+        self._postings = defaultdict(lambda: array('i'))  # ord -> [side, ordindeks, side, ordindeks, ...]
+        self._boxes = {}
+        self._sorted_tokens = None
+        self._lock = threading.Lock()
+
+    def add_page(self, page_number, page):
+        """Indekser én parset side (AltoPage). page kan være None for sider uten ALTO."""
+        local = defaultdict(list)
+        if page is not None:
+            for i, content in enumerate(page.word_content):
+                token = normalize(content)
+                if token:
+                    local[token].append(i)
+        with self._lock:
+            if page is not None and len(page.words):
+                self._boxes[page_number] = page.words
+                self.nbytes += page.words.nbytes
+            for token, indices in local.items():
+                if token not in self._postings:
+                    self.nbytes += len(token) + _TOKEN_OVERHEAD
+                self.nbytes += 8 * len(indices)
+                postings = self._postings[token]
+                for i in indices:
+                    postings.append(page_number)
+                    postings.append(i)
+            if local:
+                self._sorted_tokens = None
+            self.indexed += 1
+
+    def finish(self, failed=False, truncated=False):
+        with self._lock:
+            self.complete = True
+            self.failed = failed
+            self.truncated = truncated
+
+    def _matching_tokens(self, token, prefix):
+        if not prefix:
+            return [token] if token in self._postings else []
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        start = bisect_left(self._sorted_tokens, token)
+        matches = []
+        for candidate in self._sorted_tokens[start:]:
+            if not candidate.startswith(token):
+                break
+            matches.append(candidate)
+        return matches
+
+    def _hits(self, token, prefix):
+        """{side: sett med ordindekser} for ett søkeord."""
+        hits = defaultdict(set)
+        for match in self._matching_tokens(token, prefix):
+            postings = np.frombuffer(self._postings[match], dtype=np.int32).reshape(-1, 2)
+            for page_number, word_index in postings.tolist():
+                hits[page_number].add(word_index)
+        return hits
+
+    def search(self, query, limit=50):
+        """Sider der alle søkeordene forekommer, med boksene til ordene som traff.
+
+        Returnerer sidene i siderekkefølge, høyst limit sider med bokser; total_pages
+        og total_hits teller alle treff.
+        """
+        tokens = tokenize(query)
+        with self._lock:
+            progress = {'indexed': self.indexed, 'total': len(self.page_ids),
+                        'complete': self.complete, 'failed': self.failed, 'truncated': self.truncated}
+            if not tokens:
+                return {'pages': [], 'total_pages': 0, 'total_hits': 0, **progress}
+
+            per_token = [self._hits(token, prefix) for token, prefix in tokens]
+            pages = set(per_token[0])
+            for hits in per_token[1:]:
+                pages &= set(hits)
+
+            results, total_hits = [], 0
+            for page_number in sorted(pages):
+                indices = sorted(set().union(*(hits[page_number] for hits in per_token)))
+                total_hits += len(indices)
+                if len(results) >= limit:
+                    continue
+                boxes = self._boxes.get(page_number)
+                results.append({
+                    'page':    page_number,
+                    'page_id': self.page_ids[page_number - 1],
+                    'hits':    len(indices),
+                    'words':   indices,
+                    'boxes':   boxes[indices].ravel().tolist() if boxes is not None else [],
+                })
+        return {'pages': results, 'total_pages': len(pages), 'total_hits': total_hits, **progress}
+
+    def stats(self):
+        with self._lock:
+            return {'tokens': len(self._postings), 'indexed': self.indexed, 'bytes': self.nbytes,
+                    'postings': sum(len(p) // 2 for p in self._postings.values())}
+
+
+class IndexCache:
+    """De sist brukte dokumentindeksene i prosessen, begrenset av anslått størrelse i byte.
+
+    get(urn) gir indeksen med en gang; er den ny, bygges den i bakgrunnen av sidene
+    fra pages(urn, page_ids) mens søk svarer med det som er indeksert så langt.
+    Høyst max_builds indekser bygges samtidig; resten venter i kø. En indeks som
+    skyves ut av cachen, avbrytes, så den ikke fortsetter å hente sider. Blir én
+    indeks alene større enn max_bytes, stopper byggingen og dokumentet søkes i
+    sidene som rakk å bli indeksert (truncated).
+    """
+
+    def __init__(self, pages, max_bytes, max_builds=2):
+        self._pages = pages
+        self.max_bytes = max_bytes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_builds, thread_name_prefix='search-index')
+
+    def get(self, urn, page_ids):
+        with self._lock:
+            index = self._indexes.get(urn)
+            if index is not None and not (index.complete and index.failed):
+                self._indexes.move_to_end(urn)
+                return index
+            index = self._indexes[urn] = DocumentIndex(page_ids)
+            self._trim(index)
+        self._pool.submit(self._run, urn, index)
+        return index
+
+    def _trim(self, keep):
+        """Skyv ut og avbryt de minst nylig brukte indeksene til totalen er innenfor max_bytes.
+        Kalles med låsen holdt; keep skyves aldri ut."""
+        total = sum(index.nbytes for index in self._indexes.values())
+        for urn in list(self._indexes):
+            if total <= self.max_bytes:
+                break
+            index = self._indexes[urn]
+            if index is keep:
+                continue
+            del self._indexes[urn]
+            index.cancelled.set()
+            total -= index.nbytes
+
+    def _run(self, urn, index):
+        if index.cancelled.is_set():
+            return
+        try:
+            # closing avbryter sidehentingen som fortsatt pågår når byggingen stopper
+            with closing(self._pages(urn, index.page_ids)) as pages:
+                for page_number, page in pages:
+                    index.add_page(page_number, page)
+                    with self._lock:
+                        self._trim(index)
+                    if index.cancelled.is_set():
+                        return
+                    if index.nbytes > self.max_bytes:
+                        index.finish(truncated=True)
+                        return
+            index.finish()
+        except Exception:
+            index.finish(failed=True)
+
+    def stats(self):
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {'documents': len(indexes), 'building': sum(not i.complete for i in indexes),
+                'bytes': sum(i.nbytes for i in indexes), 'max_bytes': self.max_bytes}
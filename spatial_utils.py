@@ -0,0 +1,163 @@
+# spatial_utils: GridIndex, page_index, hit_test – punkt- og rektangeloppslag i ALTO-koordinater
+import numpy as np
+
+from alto_utils import REGIONS
+
+LEVELS = ('blocks', 'lines', 'words')
+
+# Sikter mot omtrent så mange bokser per celle; større celler gir færre, men lengre lister
+_TARGET_PER_CELL = 4
+
+
+class GridIndex:
+    """Uniformt rutenett over (n, 4)-bokser (x, y, w, h).
+
+    Cellene lagres i CSR-form: items[offsets[c]:offsets[c + 1]] er boksene som
+    overlapper celle c. Bygges vektorisert i ett pass; et oppslag ser bare på
+    kandidatene i cellene punktet eller rektangelet dekker.
+    """
+
+    def __init__(self, boxes, width, height):
+        self.boxes = boxes
+        n = len(boxes)
+        width, height = max(1, int(width)), max(1, int(height))
+        cell = max(8.0, np.sqrt(width * height * _TARGET_PER_CELL / max(n, 1)))
+        self.cell = cell
+        self.cols = int(np.ceil(width / cell))
+        self.rows = int(np.ceil(height / cell))
+
+        if not n:
+            self.offsets = np.zeros(self.cols * self.rows + 1, dtype=np.int64)
+            self.items = np.empty(0, dtype=np.int32)
+            return
+
+        box, cells = self._cover(boxes)
+        order = np.argsort(cells, kind='stable')
+        self.items = box[order]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self.cols * self.rows))))
+
+    def _cells(self, x, y):
+        c = np.clip((x / self.cell).astype(np.int64), 0, self.cols - 1)
+        r = np.clip((y / self.cell).astype(np.int64), 0, self.rows - 1)
+        return c, r
+
+    def _cover(self, boxes):
+        """Ett (boks, celle)-par per celle hver boks dekker, vektorisert."""
+        c0, r0 = self._cells(boxes[:, 0], boxes[:, 1])
+        c1, r1 = self._cells(boxes[:, 0] + np.maximum(boxes[:, 2] - 1, 0),
+                             boxes[:, 1] + np.maximum(boxes[:, 3] - 1, 0))
+        ncols = c1 - c0 + 1
+        counts = ncols * (r1 - r0 + 1)
+        box = np.repeat(np.arange(len(boxes), dtype=np.int32), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cols = np.repeat(c0, counts) + k % np.repeat(ncols, counts)
+        rows = np.repeat(r0, counts) + k // np.repeat(ncols, counts)
+        return box, rows * self.cols + cols
+
+    def _candidates(self, c0, r0, c1, r1):
+        parts = [self.items[self.offsets[r * self.cols + c0]:self.offsets[r * self.cols + c1 + 1]]
+                 for r in range(r0, r1 + 1)]
+        candidates = np.concatenate(parts) if parts else self.items[:0]
+        return np.unique(candidates) if r1 > r0 or c1 > c0 else candidates
+
+    def query_point(self, x, y):
+        """Indeksene til boksene som inneholder punktet, minste boks først."""
+        c, r = self._cells(np.array([x]), np.array([y]))
+        idx = self._candidates(c[0], r[0], c[0], r[0])
+        b = self.boxes[idx]
+        hit = (b[:, 0] <= x) & (x < b[:, 0] + b[:, 2]) & (b[:, 1] <= y) & (y < b[:, 1] + b[:, 3])
+        idx = idx[hit]
+        area = self.boxes[idx, 2].astype(np.int64) * self.boxes[idx, 3]
+        return idx[np.argsort(area, kind='stable')]
+
+    def query_rect(self, x, y, w, h):
+        """Indeksene til boksene som overlapper rektangelet, i dokumentrekkefølge."""
+        c0, r0 = self._cells(np.array([x]), np.array([y]))
+        c1, r1 = self._cells(np.array([x + max(w - 1, 0)]), np.array([y + max(h - 1, 0)]))
+        idx = self._candidates(c0[0], r0[0], c1[0], r1[0])
+        b = self.boxes[idx]
+        hit = (b[:, 0] < x + w) & (x < b[:, 0] + b[:, 2]) & (b[:, 1] < y + h) & (y < b[:, 1] + b[:, 3])
+        return np.sort(idx[hit])
+
+    def query_rects(self, rects):
+        """Alle overlappende par for mange rektangler (n, 4) på én gang.
+
+        Returnerer (rektangelindekser, boksindekser), sortert på rektangel og så boks.
+        Samme test som query_rect, men uten en Python-løkke per rektangel.
+        """
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        if not len(rects) or not len(self.items):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        rect, cells = self._cover(rects)
+        starts = self.offsets[cells]
+        lengths = self.offsets[cells + 1] - starts
+        pos = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        pairs = np.unique(np.repeat(rect.astype(np.int64), lengths) * len(self.boxes) + self.items[pos])
+        rect, idx = pairs // len(self.boxes), pairs % len(self.boxes)
+        r, b = rects[rect], self.boxes[idx]
+        hit = ((b[:, 0] < r[:, 0] + r[:, 2]) & (r[:, 0] < b[:, 0] + b[:, 2]) &
+               (b[:, 1] < r[:, 1] + r[:, 3]) & (r[:, 1] < b[:, 1] + b[:, 3]))
+        return rect[hit], idx[hit]
+
+
+def page_index(page, level):
+    """GridIndex for ett nivå ('blocks', 'lines' eller 'words'), bygd én gang og lagret på siden."""
+    key = ('grid', level)
+    grid = page.derived.get(key)
+    if grid is None:
+        grid = page.derived[key] = GridIndex(getattr(page, level), page.width, page.height)
+    return grid
+
+
+def _word_ranges(page):
+    """Start/slutt-indeks for ordene i hver linje; ordene ligger i linjerekkefølge."""
+    ranges = page.derived.get('word_ranges')
+    if ranges is None:
+        lines = np.arange(len(page.lines))
+        ranges = page.derived['word_ranges'] = (np.searchsorted(page.word_line, lines, 'left'),
+                                                np.searchsorted(page.word_line, lines, 'right'))
+    return ranges
+
+
+def _mean(wc):
+    valid = wc[~np.isnan(wc)]
+    return round(float(valid.mean()), 3) if valid.size else None
+
+
+def _line_text(page, line, starts, ends):
+    return " ".join(page.word_content[starts[line]:ends[line]])
+
+
+def describe(page, level, i):
+    """Tekst, WC, ID og foreldre for element i på gitt nivå."""
+    box = getattr(page, level)[i].tolist()
+    if level == 'words':
+        wc = float(page.word_wc[i])
+        line = int(page.word_line[i])
+        return {'index': int(i), 'id': page.word_ids[i], 'box': box, 'text': page.word_content[i],
+                'wc': None if wc != wc else round(wc, 3), 'line': line, 'block': int(page.line_block[line])}
+
+    starts, ends = _word_ranges(page)
+    if level == 'lines':
+        return {'index': int(i), 'id': page.line_ids[i], 'box': box, 'text': _line_text(page, i, starts, ends),
+                'wc': _mean(page.word_wc[starts[i]:ends[i]]), 'block': int(page.line_block[i])}
+
+    lines = np.flatnonzero(page.line_block == i)
+    words = np.concatenate([np.arange(starts[l], ends[l]) for l in lines]) if len(lines) else np.empty(0, int)
+    return {'index': int(i), 'id': page.block_ids[i], 'box': box, 'number': int(i) + 1,
+            'region': REGIONS[page.block_region[i]],
+            'text': "\n".join(_line_text(page, l, starts, ends) for l in lines),
+            'wc': _mean(page.word_wc[words])}
+
+
+def hit_test(page, levels, x, y, w=None, h=None, limit=200):
+    """Elementene på de valgte nivåene under punktet (x, y) eller i rektangelet, i ALTO-koordinater.
+
+    Returnerer {nivå: [beskrivelse, ...]}; for punkt kommer minste element først.
+    """
+    result = {}
+    for level in levels:
+        grid = page_index(page, level)
+        idx = grid.query_point(x, y) if w is None else grid.query_rect(x, y, w, h)
+        result[level] = [describe(page, level, i) for i in idx[:limit].tolist()]
+    return result
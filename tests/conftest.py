@@ -0,0 +1,31 @@
+"""Felles oppsett for testene: appen pekes mot den lokale stand-in-serveren for nb.no.
+
+Miljøvariablene må settes før modulene som leser dem importeres, så serveren
+startes når conftest lastes, før testmodulene samles inn.
+"""
+import os
+
+import pytest
+
+from benchmarks.fixture_server import FixtureServer
+
+_server = FixtureServer(latency=0.0, pages=10).start()
+os.environ.update({
+    'NB_API_BASE':        _server.url,
+    'NB_IMAGE_BASE':      _server.url,
+    'NB_HTTP_RETRIES':    '0',
+    'ALTO_CACHE_BACKEND': 'none',
+    'ALTO_RATELIMIT':     '0',
+    'ALTO_PREFETCH':      '0',
+})
+
+URN = 'URN:NBN:no-nb_digibok_0000000000000'
+
+
+@pytest.fixture
+def fixture_server():
+    return _server
+
+
+def pytest_sessionfinish(session, exitstatus):
+    _server.stop()
@@ -0,0 +1,40 @@
+import app as appmod
+from conftest import URN
+
+ROOT = '/alto-viewer'
+PAGE_IDS = ','.join(f'{URN}_{i:04d}' for i in range(1, 4))
+QUERY = {'urn': URN, 'page_ids': PAGE_IDS, 'stream': '1'}
+
+
+def _event_ids(response):
+    return [line[4:] for line in response.data.decode().splitlines() if line.startswith('id: ')]
+
+
+def _resume(query, last_event_id=None):
+    headers = {'Last-Event-ID': last_event_id} if last_event_id else {}
+    with appmod.app.test_request_context(f'{ROOT}/api/download/full/progress', query_string=query, headers=headers):
+        return appmod._resume()
+
+
+def test_event_id_resumes_same_download_from_delivered_page():
+    client = appmod.app.test_client()
+    ids = _event_ids(client.get(f'{ROOT}/api/download/full/progress', query_string=QUERY))
+    start, download = _resume(QUERY, ids[0])
+    assert start == 1 and download == ids[0].split('.')[1]
+
+    resumed = _event_ids(client.get(f'{ROOT}/api/download/full/progress', query_string=QUERY,
+                                    headers={'Last-Event-ID': ids[0]}))
+    assert [i.split('.')[:2] for i in resumed[:2]] == [['2', download], ['3', download]]
+
+
+def test_start_without_signed_event_id_is_not_a_resume():
+    client = appmod.app.test_client()
+    first = _event_ids(client.get(f'{ROOT}/api/download/full/progress', query_string=QUERY))[0]
+    _, download, mac = first.split('.')
+
+    assert _resume({**QUERY, 'start': '1'}) == (1, None)
+    assert _resume(QUERY, '1')[1] is None
+    # Signaturen gjelder bare for det antallet sider og den sidelisten den ble utstedt for
+    assert _resume(QUERY, f'2.{download}.{mac}')[1] is None
+    assert _resume({**QUERY, 'page_ids': PAGE_IDS + ',x'}, first)[1] is None
+    assert _resume({**QUERY, 'stream': '0'}, first)[1] is None
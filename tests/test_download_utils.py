@@ -0,0 +1,47 @@
+import pytest
+import requests
+
+import download_utils
+from conftest import URN
+
+PAGE_ID = URN + '_0001'
+
+
+@pytest.fixture
+def flaky_alto(monkeypatch, fixture_server):
+    """_fetch_alto_response som feiler til state['down'] settes til False."""
+    real = download_utils._fetch_alto_response
+    state = {'down': True, 'calls': 0}
+
+    def fetch(urn, page_id):
+        state['calls'] += 1
+        if state['down']:
+            raise requests.ConnectionError('nb.no er nede')
+        return real(urn, page_id)
+
+    monkeypatch.setattr(download_utils, '_fetch_alto_response', fetch)
+    download_utils._cached_alto.cache_clear()
+    download_utils._cached_alto_page.cache_clear()
+    yield state
+    download_utils._cached_alto.cache_clear()
+    download_utils._cached_alto_page.cache_clear()
+
+
+def test_fetch_alto_does_not_cache_failure(flaky_alto):
+    assert download_utils.fetch_alto(URN, PAGE_ID) is None
+    flaky_alto['down'] = False
+    assert download_utils.fetch_alto(URN, PAGE_ID).startswith('<?xml')
+
+
+def test_fetch_alto_page_recovers_after_failure(flaky_alto):
+    page = download_utils.fetch_alto_page(URN, PAGE_ID)
+    assert page.width is None and not len(page.words)
+
+    flaky_alto['down'] = False
+    page = download_utils.fetch_alto_page(URN, PAGE_ID)
+    assert page.width is not None and len(page.words)
+
+    # Vellykkede sider caches
+    calls = flaky_alto['calls']
+    assert download_utils.fetch_alto_page(URN, PAGE_ID) is page
+    assert flaky_alto['calls'] == calls
@@ -0,0 +1,18 @@
+import app as appmod
+
+URL = '/alto-viewer/metrics'
+
+
+def test_metrics_off_by_default():
+    assert appmod.app.test_client().get(URL).status_code == 404
+
+
+def test_metrics_token(monkeypatch):
+    monkeypatch.setattr(appmod, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(appmod, 'METRICS_TOKEN', 'hemmelig')
+    client = appmod.app.test_client()
+    assert client.get(URL).status_code == 401
+    assert client.get(URL, headers={'Authorization': 'Bearer feil'}).status_code == 401
+    response = client.get(URL, headers={'Authorization': 'Bearer hemmelig'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
@@ -0,0 +1,41 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import app as appmod
+from conftest import URN
+
+ROOT = '/alto-viewer'
+PAGE_ID = f'{URN}_0001'
+
+
+def _render(**params):
+    return appmod.app.test_client().get(f'{ROOT}/api/render', query_string={'urn': URN, 'page_id': PAGE_ID, **params})
+
+
+def test_render_defaults_to_jpeg_and_overlay_url_hits_cache():
+    response = _render()
+    assert response.status_code == 200
+    overlay_url = response.get_json()['overlay_url']
+    assert parse_qs(urlsplit(overlay_url).query)['format'] == ['jpeg']
+
+    overlay = appmod.app.test_client().get(ROOT + overlay_url)  # APP_ROOT er tom i testene
+    assert overlay.status_code == 200
+    assert overlay.mimetype == 'image/jpeg'
+    assert overlay.data[:2] == b'\xff\xd8'
+
+
+@pytest.mark.parametrize('fmt, expected', [('jpg', 'jpeg'), ('jpeg', 'jpeg'), ('png', 'png'), ('webp', 'webp')])
+def test_render_and_overlay_accept_same_formats(fmt, expected):
+    assert parse_qs(urlsplit(_render(format=fmt).get_json()['overlay_url']).query)['format'] == [expected]
+    overlay = appmod.app.test_client().get(f'{ROOT}/api/overlay',
+                                           query_string={'urn': URN, 'page_id': PAGE_ID, 'format': fmt})
+    assert overlay.mimetype == appmod.OVERLAY_FORMATS[expected]
+
+
+@pytest.mark.parametrize('params', [{'format': 'gif'}, {'format': 'jpeg', 'quality': '0'}])
+def test_render_and_overlay_reject_same_formats(params):
+    assert _render(**params).status_code == 400
+    overlay = appmod.app.test_client().get(f'{ROOT}/api/overlay',
+                                           query_string={'urn': URN, 'page_id': PAGE_ID, **params})
+    assert overlay.status_code == 400
@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+
+from search_utils import IndexCache
+
+
+class _Page:
+    """Det DocumentIndex.add_page trenger av en AltoPage."""
+
+    def __init__(self, page_number, words=50):
+        self.word_content = ['felles'] + [f'ord{page_number}_{i}' for i in range(1, words)]
+        self.words = np.zeros((words, 4), dtype=np.int32)
+
+
+def _pages(urn, page_ids):
+    for page_number, _ in enumerate(page_ids, 1):
+        yield page_number, _Page(page_number)
+
+
+def _built(cache, urn, page_ids, timeout=5):
+    index = cache.get(urn, page_ids)
+    deadline = time.monotonic() + timeout
+    while not index.complete and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return index
+
+
+def test_search_reports_truncated_index():
+    # Hver side koster noen kB; budsjettet rommer bare noen få av de 100 sidene
+    cache = IndexCache(_pages, max_bytes=20_000)
+    index = _built(cache, 'urn', [f'p{i}' for i in range(100)])
+
+    result = index.search('felles')
+    assert result['complete'] and result['truncated'] and not result['failed']
+    assert result['indexed'] < result['total'] == 100
+    assert result['total_pages'] == result['indexed']
+
+
+def test_search_complete_index_is_not_truncated():
+    cache = IndexCache(_pages, max_bytes=10_000_000)
+    result = _built(cache, 'urn', ['p1', 'p2', 'p3']).search('felles')
+    assert result['complete'] and not result['truncated']
+    assert result['total_pages'] == 3
@@ -0,0 +1,42 @@
+import pytest
+import requests
+
+import app as appmod
+import download_utils
+from conftest import URN
+
+ROOT = '/alto-viewer'
+PAGE_ID = URN + '_0002'
+TILE = {'urn': URN, 'page_id': PAGE_ID, 'view': 'ord', 's': 1, 'col': 0, 'row': 0}
+
+
+@pytest.fixture
+def client():
+    return appmod.app.test_client()
+
+
+def test_tile_overlay_returns_after_alto_failure(client, monkeypatch):
+    real = download_utils._fetch_alto_response
+    down = [True]
+
+    def fetch(urn, page_id):
+        if down[0]:
+            raise requests.ConnectionError('nb.no er nede')
+        return real(urn, page_id)
+
+    monkeypatch.setattr(download_utils, '_fetch_alto_response', fetch)
+
+    bare = client.get(f'{ROOT}/api/tile', query_string=TILE)
+    assert bare.status_code == 200
+    assert bare.headers['Cache-Control'] == 'no-store'
+    assert 'ETag' not in bare.headers
+
+    down[0] = False
+    tile = client.get(f'{ROOT}/api/tile', query_string=TILE)
+    assert tile.status_code == 200
+    assert tile.headers['Cache-Control'] == 'public, max-age=86400'
+    assert tile.headers['ETag']
+    assert tile.data != bare.data
+
+    render = client.get(f'{ROOT}/api/render', query_string={'urn': URN, 'page_id': PAGE_ID}).get_json()
+    assert render['full_text'] and render['overlay_url']
@@ -0,0 +1,66 @@
+# tile_utils: tile_grid, tile_region, tile_elements – IIIF-fliser og ALTO-elementene som er synlige i hver
+import math
+
+import numpy as np
+
+from spatial_utils import page_index
+
+# Flisstørrelse når info.json ikke oppgir den
+DEFAULT_TILE = 512
+
+
+def tile_grid(info):
+    """Flisrutenettet fra IIIF info.json, eller None uten gyldig størrelse.
+
+    Nivåene er skaleringsfaktorene fra info.json (1 = full oppløsning); mangler de,
+    brukes 1, 2, 4, ... til hele siden får plass i én flis.
+    """
+    try:
+        width, height = int(info['width']), int(info['height'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    tiles = (info.get('tiles') or [{}])[0]
+    tile = int(tiles.get('width') or DEFAULT_TILE)
+    factors = sorted({int(f) for f in tiles.get('scaleFactors') or () if int(f) > 0})
+    if not factors:
+        factors = [1]
+        while max(width, height) > tile * factors[-1]:
+            factors.append(factors[-1] * 2)
+    return {
+        'width':  width,
+        'height': height,
+        'tile':   tile,
+        'levels': [{'scale_factor': s,
+                    'width':   math.ceil(width / s),
+                    'height':  math.ceil(height / s),
+                    'columns': math.ceil(width / (tile * s)),
+                    'rows':    math.ceil(height / (tile * s))} for s in factors],
+    }
+
+
+def tile_region(grid, scale_factor, column, row):
+    """Regionen (x, y, w, h) i fullt oppløst bilde og leveringsbredden for én flis, eller None."""
+    if scale_factor not in {level['scale_factor'] for level in grid['levels']}:
+        return None
+    span = grid['tile'] * scale_factor
+    x, y = column * span, row * span
+    if column < 0 or row < 0 or x >= grid['width'] or y >= grid['height']:
+        return None
+    w, h = min(span, grid['width'] - x), min(span, grid['height'] - y)
+    return (x, y, w, h), math.ceil(w / scale_factor)
+
+
+def tile_elements(page, level, grid, region):
+    """Elementene på nivået ('blocks', 'lines', 'words') som overlapper flisen.
+
+    Returnerer (indekser, bokser) der boksene er i fullt oppløste bildepiksler
+    relativt til flisens hjørne. Oppslaget går via sidens rutenettindeks, så bare
+    elementene i flisens celler sjekkes.
+    """
+    kx, ky = grid['width'] / page.width, grid['height'] / page.height
+    x, y, w, h = region
+    idx = page_index(page, level).query_rect(x / kx, y / ky, w / kx, h / ky)
+    boxes = getattr(page, level)[idx] * np.array([kx, ky, kx, ky]) - np.array([x, y, 0, 0])
+    return idx, boxes
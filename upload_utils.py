@@ -0,0 +1,62 @@
+# upload_utils: zip_members, read_zip_member, iter_zip_pages – lokale ALTO-leveranser i ZIP
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+
+from alto_utils import parse_alto_stream
+from cpu_utils import run_cpu
+
+
+def zip_members(archive):
+    """XML-filene i arkivet sortert på navn, uten mapper og macOS-metadata (__MACOSX/, ._*)."""
+    members = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or not name.lower().endswith('.xml'):
+            continue
+        if name.startswith('__MACOSX/') or posixpath.basename(name).startswith('._'):
+            continue
+        members.append(info)
+    return sorted(members, key=lambda info: info.filename)
+
+
+def read_zip_member(archive, info, max_bytes):
+    """Parse én ALTO-fil rett fra arkivet. Returnerer (AltoPage, None) eller (None, feilmelding)."""
+    if info.file_size > max_bytes:
+        return None, f"Filen er for stor (maks {max_bytes // (1024 * 1024)} MB)"
+    try:
+        with archive.open(info) as source:
+            page = run_cpu(parse_alto_stream, source, True)
+    except ET.ParseError as e:
+        return None, f"Ugyldig XML: {e}"
+    except (zipfile.BadZipFile, RuntimeError, OSError, EOFError):
+        # RuntimeError: kryptert fil; BadZipFile: CRC-feil eller ødelagt innhold
+        return None, "Kunne ikke lese filen fra ZIP-arkivet"
+    if page.width is None:
+        return None, "Mangler Layout/Page med gyldig WIDTH og HEIGHT"
+    return page, None
+
+
+def iter_zip_pages(archive, members, max_bytes, workers):
+    """Parse filene samtidig. Gir (nummer, info, AltoPage eller None, feilmelding) i den
+    rekkefølgen filene blir ferdige; nummeret er 1-basert i members-rekkefølgen.
+
+    Høyst 2 × workers filer er under arbeid samtidig, så store leveranser holdes ikke i minnet.
+    """
+    numbered = enumerate(members, 1)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        running = {pool.submit(read_zip_member, archive, info, max_bytes): (n, info)
+                   for n, info in islice(numbered, 2 * workers)}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                n, info = running.pop(future)
+                for next_n, next_info in islice(numbered, 1):
+                    running[pool.submit(read_zip_member, archive, next_info, max_bytes)] = (next_n, next_info)
+                page, error = future.result()
+                yield n, info, page, error
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)